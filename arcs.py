@@ -0,0 +1,164 @@
+import math
+
+# Plane selection, same values as the PLANE_* constants of machineclient.
+PLANE_XY = 1
+PLANE_ZX = 2
+PLANE_YZ = 3
+
+# Axis indices (first, second, normal) of each plane, in the order that makes
+# a G02 clockwise when looking down the normal axis.
+PLANE_AXES = {
+    PLANE_XY: (0, 1, 2),
+    PLANE_ZX: (2, 0, 1),
+    PLANE_YZ: (1, 2, 0),
+}
+
+# Center offset words of each plane, matching PLANE_AXES.
+PLANE_OFFSETS = {
+    PLANE_XY: ("I", "J"),
+    PLANE_ZX: ("K", "I"),
+    PLANE_YZ: ("J", "K"),
+}
+
+DEFAULT_TOLERANCE = 0.01
+TWO_PI = 2.0 * math.pi
+
+
+class ArcError(ValueError):
+    """ Raised for arcs without center offsets or radius. """
+
+
+def arc_center(start, end, plane, clockwise, offsets=None, radius=None):
+    """ Returns the 3D center of an arc.
+    Args:
+      start, end (tuple): (x, y, z) end points
+      plane (int): PLANE_XY, PLANE_ZX or PLANE_YZ
+      offsets (tuple): center offsets from start in the plane (e.g. I, J),
+        None entries count as 0; takes precedence over radius
+      radius (float): R word; negative selects the arc larger than 180 degrees
+    """
+    a, b, _ = PLANE_AXES[plane]
+    center = list(start)
+    if offsets is not None and any(o is not None for o in offsets):
+        center[a] += offsets[0] or 0.0
+        center[b] += offsets[1] or 0.0
+        return tuple(center)
+    if radius is None:
+        raise ArcError("arc needs center offsets or a radius")
+
+    da, db = end[a] - start[a], end[b] - start[b]
+    chord = math.hypot(da, db)
+    if chord == 0.0:
+        raise ArcError("R-word arc with coincident end points")
+    h = math.sqrt(max(radius * radius - chord * chord / 4.0, 0.0))
+    # The center lies right of the chord for CW arcs (left for CCW), flipped for R < 0.
+    if clockwise == (radius > 0):
+        h = -h
+    center[a] = start[a] + da / 2.0 - h * db / chord
+    center[b] = start[b] + db / 2.0 + h * da / chord
+    return tuple(center)
+
+
+def arc_params(start, end, center, plane, clockwise):
+    """ Returns (radius, start angle, sweep) of an arc; the sweep is positive
+    in the direction of travel and a full circle when start and end coincide.
+    """
+    a, b, _ = PLANE_AXES[plane]
+    radius = math.hypot(start[a] - center[a], start[b] - center[b])
+    a0 = math.atan2(start[b] - center[b], start[a] - center[a])
+    a1 = math.atan2(end[b] - center[b], end[a] - center[a])
+    sweep = (a0 - a1) if clockwise else (a1 - a0)
+    sweep %= TWO_PI
+    if sweep <= 1e-12:
+        sweep = TWO_PI
+    return radius, a0, sweep
+
+
+def arc_length(start, end, center, plane, clockwise):
+    """ Path length of an arc, including the helical travel along the normal axis. """
+    radius, _, sweep = arc_params(start, end, center, plane, clockwise)
+    normal = PLANE_AXES[plane][2]
+    return math.hypot(radius * sweep, end[normal] - start[normal])
+
+
+def arc_tangents(start, end, center, plane, clockwise):
+    """ Returns the unit direction of travel at the start and at the end of an arc. """
+    a, b, normal = PLANE_AXES[plane]
+    radius, _, sweep = arc_params(start, end, center, plane, clockwise)
+    rise = end[normal] - start[normal]
+    length = math.hypot(radius * sweep, rise) or 1.0
+    planar = radius * sweep / length / (radius or 1.0)
+    sign = -1.0 if clockwise else 1.0
+    result = []
+    for p in (start, end):
+        d = [0.0, 0.0, 0.0]
+        d[a] = -sign * (p[b] - center[b]) * planar
+        d[b] = sign * (p[a] - center[a]) * planar
+        d[normal] = rise / length
+        result.append(tuple(d))
+    return result
+
+
+def arc_extrema(start, end, center, plane, clockwise):
+    """ Returns the points where the arc crosses the 0/90/180/270 degree
+    directions of its plane, i.e. where its in-plane coordinates peak.
+    """
+    a, b, normal = PLANE_AXES[plane]
+    radius, a0, sweep = arc_params(start, end, center, plane, clockwise)
+    points = []
+    for quadrant in range(4):
+        angle = quadrant * math.pi / 2.0
+        # Angle travelled from the start to reach this axis crossing.
+        travel = ((a0 - angle) if clockwise else (angle - a0)) % TWO_PI
+        if travel <= sweep:
+            p = list(start)
+            p[a] = center[a] + radius * math.cos(angle)
+            p[b] = center[b] + radius * math.sin(angle)
+            p[normal] = start[normal] + (end[normal] - start[normal]) * travel / sweep
+            points.append(tuple(p))
+    return points
+
+
+def arc_point(start, end, center, plane, clockwise, fraction):
+    """ Returns the point reached after the given fraction (0..1) of the arc. """
+    a, b, normal = PLANE_AXES[plane]
+    radius, a0, sweep = arc_params(start, end, center, plane, clockwise)
+    angle = a0 + (-sweep if clockwise else sweep) * fraction
+    p = list(start)
+    p[a] = center[a] + radius * math.cos(angle)
+    p[b] = center[b] + radius * math.sin(angle)
+    p[normal] = start[normal] + (end[normal] - start[normal]) * fraction
+    return tuple(p)
+
+
+def segment_count(radius, sweep, tolerance=DEFAULT_TOLERANCE):
+    """ Number of chords keeping the chord error (sagitta) within tolerance. """
+    if radius <= tolerance:
+        return 1
+    step = 2.0 * math.acos(1.0 - tolerance / radius)
+    return max(1, math.ceil(sweep / step))
+
+
+def arc_points(start, end, center, plane, clockwise, tolerance=DEFAULT_TOLERANCE):
+    """ Discretizes an arc into chords within tolerance. Returns the points
+    after start, ending exactly at end. Only one sin/cos pair is evaluated
+    per arc; the points are generated by repeated rotation.
+    """
+    a, b, normal = PLANE_AXES[plane]
+    radius, a0, sweep = arc_params(start, end, center, plane, clockwise)
+    n = segment_count(radius, sweep, tolerance)
+    step = (-sweep if clockwise else sweep) / n
+    cos_s, sin_s = math.cos(step), math.sin(step)
+    ra, rb = start[a] - center[a], start[b] - center[b]
+    rise = (end[normal] - start[normal]) / n
+
+    points = []
+    p = list(start)
+    for i in range(1, n):
+        ra, rb = ra * cos_s - rb * sin_s, ra * sin_s + rb * cos_s
+        p[a] = center[a] + ra
+        p[b] = center[b] + rb
+        p[normal] = start[normal] + rise * i
+        points.append(tuple(p))
+    points.append(tuple(end))
+    return points
@@ -0,0 +1,124 @@
+import functools
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from machineclient import MachineClient as MC
+from main import iter_blocks, execute_command
+from program import GCodeFormatError
+from sinks import StructuredSink, ERROR
+from estimator import estimate_program
+from export import export_preview
+from toolpath import get_toolpath, segment_lengths, RAPID
+
+GCODE_EXTENSIONS = (".txt", ".nc", ".gcode")
+
+
+def collect_files(specs):
+    """ Expands directories (recursively, G-code extensions only) and glob patterns. """
+    files = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            for dirpath, _, filenames in os.walk(spec):
+                files.extend(os.path.join(dirpath, name) for name in filenames
+                             if name.lower().endswith(GCODE_EXTENSIONS))
+        else:
+            files.extend(path for path in glob.glob(spec, recursive=True) if os.path.isfile(path))
+    return sorted(set(files))
+
+
+def preview_name(path):
+    """ PNG file name of a program's preview, unique per relative path
+    (e.g. "jobs/a/part.nc" -> "jobs_a_part.nc.png").
+    """
+    name = os.path.normpath(path).lstrip(os.sep).replace(os.sep, "_").replace(":", "_")
+    return name + ".png"
+
+
+def simulate_file(path, preview_dir=None):
+    """ Parses and runs one file through a MachineClient that only records errors.
+    Returns a summary dict: commands, blocks, travel distances [mm],
+    estimated cycle time [s] and any errors reported on the way; with a
+    preview_dir, also the file name of the PNG preview written there.
+    """
+    summary = {"file": path, "blocks": 0, "commands": 0,
+               "travel": 0.0, "rapid_travel": 0.0, "cycle_time": 0.0, "errors": []}
+    pgm_data = {}
+    sink = StructuredSink(level=ERROR)
+
+    try:
+        with open(path) as f:
+            machine = MC(sink)
+            for block in iter_blocks(f, pgm_data):
+                for command in block:
+                    execute_command(machine, command)
+    except (OSError, GCodeFormatError, ValueError, TypeError) as err:
+        summary["errors"].append(f"{type(err).__name__}: {err}")
+
+    parsed = not summary["errors"]
+    summary["errors"].extend(sink.errors())
+
+    program = pgm_data.get("commands")
+    if program is not None:
+        summary["blocks"] = len(program)
+        summary["commands"] = program.num_commands
+    if program is not None and parsed:
+        try:
+            analyze_program(summary, program, path, preview_dir)
+        except Exception as err:
+            # One file the passes choke on must not end the whole batch.
+            summary["errors"].append(f"{type(err).__name__}: {err}")
+
+    for key in ("travel", "rapid_travel", "cycle_time"):
+        summary[key] = round(summary[key], 3)
+    return summary
+
+
+def analyze_program(summary, program, path, preview_dir=None):
+    """ Adds the travel distances, cycle time and preview of a parsed
+    program to its summary.
+    """
+    tp = get_toolpath(program)
+    for length, kind in zip(segment_lengths(tp), tp.kinds):
+        if kind == RAPID:
+            summary["rapid_travel"] += length
+        else:
+            summary["travel"] += length
+    summary["cycle_time"] = estimate_program(program).total
+    if preview_dir is not None:
+        preview = os.path.join(preview_dir, preview_name(path))
+        try:
+            export_preview(program, preview)
+            summary["preview"] = preview
+        except OSError as err:
+            summary["errors"].append(f"{type(err).__name__}: {err}")
+
+
+def run_batch(specs, jobs=None, out=None, preview_dir=None):
+    """ Simulates all files matching specs in a process pool, writing one
+    JSON line per file (in file order), and PNG previews into preview_dir
+    if given. Returns the number of failed files.
+    """
+    out = out or sys.stdout
+    files = collect_files(specs)
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (jobs * 8))
+    failed = 0
+    start = time.perf_counter()
+
+    if preview_dir is not None:
+        os.makedirs(preview_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for summary in pool.map(functools.partial(simulate_file, preview_dir=preview_dir), files,
+                                chunksize=chunksize):
+            failed += bool(summary["errors"])
+            out.write(json.dumps(summary) + "\n")
+
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {len(files)} files ({failed} with errors) in {elapsed:.2f} s "
+          f"[{len(files) / elapsed if elapsed else 0:.1f} files/s, {jobs} workers].", file=sys.stderr)
+    return failed
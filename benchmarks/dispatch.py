@@ -0,0 +1,58 @@
+""" Commands/second of per-command interpretation vs. the precompiled dispatch list.
+Usage: python benchmarks/dispatch.py [n_lines]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from machineclient import MachineClient
+from main import iter_blocks, execute_command, compile_program, run_compiled
+from sinks import SilentSink
+from synth import zigzag_program
+
+GCODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "gcode")
+
+
+def load(text):
+    pgm_data = {}
+    for _ in iter_blocks(io.StringIO(text), pgm_data):
+        pass
+    return pgm_data["commands"]
+
+
+def bench(name, program, min_commands=1000000):
+    repeats = max(1, min_commands // max(program.num_commands, 1))
+    machine = MachineClient(SilentSink())
+    commands = [cmd for block in program for cmd in block]
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for cmd in commands:
+            execute_command(machine, cmd)
+    interpreted = len(commands) * repeats / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    compiled = compile_program(program, machine)
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeats):
+        run_compiled(compiled)
+    run_rate = len(compiled) * repeats / (time.perf_counter() - start)
+
+    print(f"{name:<16} interpreted {interpreted:>12,.0f} cmd/s   "
+          f"compiled {run_rate:>12,.0f} cmd/s   (compile {compile_time:.3f} s)")
+
+
+def main(args):
+    n_lines = int(args[1]) if len(args) > 1 else 1000000
+    with open(os.path.join(GCODE_DIR, "scorpion.txt")) as f:
+        bench("scorpion.txt", load(f.read()))
+    bench(f"synthetic {n_lines}", load(zigzag_program(n_lines)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,175 @@
+""" Benchmark suite: parse, execute, bounds, simplify and render throughput on
+synthetic programs at several scales, written to a JSON results file.
+Usage: python benchmarks/suite.py [--scales 1k,10k,100k,1M] [--programs zigzag,arcs,mixed]
+                                  [--repeat N] [--out results.json] [--compare old.json]
+Programs are generated once into --data (default: benchmarks/data) and reused.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from machineclient import MachineClient
+from main import parse_file, compile_program, run_compiled
+from renderer import LodScene, ViewTransform, fit_scale
+from simplify import simplify_toolpath
+from sinks import SilentSink
+from toolpath import build_toolpath, compute_bounds
+from synth import GENERATORS, write_program
+
+SUFFIXES = {"k": 1000, "M": 1000000}
+# View size used for the render benchmark [px].
+VIEW_SIZE = (800, 600)
+
+
+def parse_scale(text):
+    """ "10k" -> 10000, "1M" -> 1000000. """
+    if text[-1] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def program_path(data_dir, kind, n_lines):
+    path = os.path.join(data_dir, f"{kind}_{n_lines}.gcode")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        write_program(path + ".tmp", kind, n_lines)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def best_of(repeat, func):
+    """ Returns (fastest wall time, last result) of repeat calls. """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_program(path, repeat):
+    """ Runs all stages on one program; returns {stage: (seconds, items)}. """
+    def parse():
+        pgm_data = {}
+        with open(path) as f:
+            if not parse_file(f, pgm_data):
+                raise SystemExit(f"{path}: parse failed")
+        return pgm_data["commands"]
+
+    results = {}
+    seconds, program = best_of(repeat, parse)
+    results["parse"] = (seconds, len(program))
+
+    machine = MachineClient(SilentSink())
+    seconds, compiled = best_of(repeat, lambda: compile_program(program, machine))
+    results["compile"] = (seconds, len(compiled))
+    seconds, _ = best_of(repeat, lambda: run_compiled(compiled))
+    results["execute"] = (seconds, len(compiled))
+
+    seconds, tp = best_of(repeat, lambda: build_toolpath(program))
+    results["toolpath"] = (seconds, len(tp))
+    seconds, bounds = best_of(repeat, lambda: compute_bounds(tp))
+    results["bounds"] = (seconds, len(tp))
+    # The zigzag program is a serpentine raster, the worst case of Ramer-Douglas-Peucker.
+    seconds, _ = best_of(repeat, lambda: simplify_toolpath(program, tp, fit_arcs=True))
+    results["simplify"] = (seconds, len(tp))
+
+    # Render: LOD scene construction, then a fitted frame and a 10x zoomed frame.
+    program.cache["toolpath"] = tp
+    program.cache["bounds"] = bounds
+    scale = fit_scale(bounds, *VIEW_SIZE)
+
+    def scene():
+        program.cache.pop(("polyline", 0.25 / scale), None)
+        return LodScene(program, 0.25 / scale)
+    seconds, lod = best_of(repeat, scene)
+    results["scene"] = (seconds, len(tp))
+
+    def frames(view):
+        def draw():
+            # Fresh level cache, so every repeat pays for the decimation as on first display.
+            lod.levels.clear()
+            return sum(len(coords) // 2 for coords in lod.polylines(view, *VIEW_SIZE))
+        return draw
+    fit = ViewTransform(bounds.x_min, bounds.y_min, scale)
+    seconds, points = best_of(repeat, frames(fit))
+    results["render_fit"] = (seconds, points)
+    zoom = ViewTransform(bounds.x_min, bounds.y_min, scale * 10.0)
+    seconds, points = best_of(repeat, frames(zoom))
+    results["render_zoom"] = (seconds, points)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old_path):
+    """ Prints the rate change of every stage against an earlier results file. """
+    with open(old_path) as f:
+        old = {(r["program"], r["lines"], r["stage"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {old_path}:")
+    for r in results:
+        before = old.get((r["program"], r["lines"], r["stage"]))
+        if before and before["seconds"] > 0 and r["seconds"] > 0:
+            change = before["seconds"] / r["seconds"] - 1.0
+            print(f"  {r['program']:<8} {r['lines']:>9} {r['stage']:<12} {change:+7.1%}")
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="suite.py", description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default="1k,10k,100k,1M",
+                        help="comma separated program sizes in lines, e.g. 1k,10k,100k,1M,10M")
+    parser.add_argument("--programs", default=",".join(GENERATORS),
+                        help="comma separated generators: " + ", ".join(GENERATORS))
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is kept")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+                        help="directory caching the generated programs")
+    parser.add_argument("--out", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--compare", metavar="OLD", help="earlier results file to compare with")
+    options = parser.parse_args(args[1:])
+
+    results = []
+    for kind in options.programs.split(","):
+        for scale in options.scales.split(","):
+            n_lines = parse_scale(scale)
+            path = program_path(options.data, kind, n_lines)
+            for stage, (seconds, items) in bench_program(path, options.repeat).items():
+                rate = items / seconds if seconds > 0 else None
+                results.append({"program": kind, "lines": n_lines, "stage": stage,
+                                "seconds": seconds, "items": items, "rate": rate})
+                print(f"{kind:<8} {n_lines:>9} {stage:<12} {seconds:10.4f} s "
+                      f"{rate or 0:>14,.0f} items/s", flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": options.repeat,
+        },
+        "results": results,
+    }
+    with open(options.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Results written to {options.out}")
+    if options.compare:
+        compare(results, options.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,82 @@
+""" Synthetic G-code program generators for benchmarks.
+The *_lines() generators yield the program line by line (without newlines),
+so even 10M-line programs can be written to disk in constant memory.
+"""
+import math
+
+
+def zigzag_lines(n_lines, width=100.0, step=0.5, feed=600):
+    """ Dense G01 zig-zag pocketing, n_lines motion blocks. """
+    yield from ("%", "O1", "G21 G17 G90 G94", "G00 X0 Y0 Z5", f"G01 Z-1 F{feed}")
+    y = 0.0
+    for n in range(n_lines):
+        if n % 2 == 0:
+            # Alternate between the two sides of the pocket.
+            yield f"G01 X{width if n % 4 == 0 else 0.0:.3f}"
+        else:
+            y += step
+            yield f"G01 Y{y:.3f}"
+    yield from ("G00 Z5", "M30", "%")
+
+
+def arc_lines(n_lines, radius=40.0, feed=800):
+    """ Arc-heavy contouring: helical rings of CCW quarter arcs, alternating
+    between I/J and R words per ring and stepping down 0.1 mm per ring,
+    n_lines arc blocks.
+    """
+    yield from ("%", "O2", "G21 G17 G90 G94", f"G00 X{radius:.3f} Y0 Z5", f"G01 Z0 F{feed}")
+    corners = [(radius * math.cos(a * math.pi / 2), radius * math.sin(a * math.pi / 2)) for a in range(4)]
+    z = 0.0
+    for n in range(n_lines):
+        quarter = n % 4
+        if quarter == 0:
+            z -= 0.1
+        x0, y0 = corners[quarter]
+        x1, y1 = corners[(quarter + 1) % 4]
+        if (n // 4) % 2 == 0:
+            yield f"G03 X{x1:.3f} Y{y1:.3f} Z{z:.3f} I{-x0:.3f} J{-y0:.3f}"
+        else:
+            yield f"G03 X{x1:.3f} Y{y1:.3f} Z{z:.3f} R{radius:.3f}"
+    yield from ("G00 Z5", "M30", "%")
+
+
+def mixed_lines(n_lines, feed=500):
+    """ Mixed program: absolute rapids and plunges, incremental (G91) G01
+    steps and small arcs, with tool changes and spindle words.
+    """
+    yield from ("%", "O3", "G21 G17 G94", "T1 M06", "S12000 M03")
+    for n in range(n_lines):
+        phase = n % 10
+        if phase == 0:
+            yield f"G90 G00 X{(n // 10) % 100:.3f} Y{(n // 1000) % 100:.3f} Z2"
+        elif phase == 1:
+            yield f"G01 Z-0.5 F{feed}"
+        elif phase in (2, 3, 4, 5):
+            yield f"G91 G01 X{0.5 if phase % 2 else -0.25:.3f} Y0.250"
+        elif phase == 6:
+            yield "G90"
+        elif phase in (7, 8):
+            yield "G91 G02 X1.000 Y0 I0.500 J0"
+        else:
+            yield "G90 G00 Z2"
+    yield from ("M05", "M30", "%")
+
+
+GENERATORS = {
+    "zigzag": zigzag_lines,
+    "arcs": arc_lines,
+    "mixed": mixed_lines,
+}
+
+
+def zigzag_program(n_lines, width=100.0, step=0.5, feed=600):
+    """ zigzag_lines() as one string. """
+    return "\n".join(zigzag_lines(n_lines, width, step, feed)) + "\n"
+
+
+def write_program(path, kind, n_lines):
+    """ Writes the program of generator kind with n_lines blocks to path. """
+    with open(path, "w") as f:
+        for line in GENERATORS[kind](n_lines):
+            f.write(line)
+            f.write("\n")
@@ -0,0 +1,81 @@
+""" Random access into the simulation of a Program: the machine state is
+checkpointed every few blocks, so the state before any block is restored
+by replaying at most that many blocks instead of the whole program.
+"""
+from array import array
+from bisect import bisect_left
+from machineclient import MachineClient
+from main import compile_program
+from sinks import SilentSink
+
+# Blocks between two checkpoints.
+DEFAULT_INTERVAL = 1000
+
+
+class CheckpointIndex:
+    """ MachineState before every interval-th block of a Program. The
+    checkpoints are taken lazily while replaying on a silent MachineClient,
+    so seeking to block N first costs one replay up to N, and later seeks
+    at most interval blocks.
+    Args:
+      interval (int): blocks between two checkpoints
+      envelope (collision.Box): soft limits of the simulated machine, which
+        can refuse moves and so change the state
+    """
+
+    def __init__(self, program, interval=DEFAULT_INTERVAL, envelope=None):
+        self.program = program
+        self.interval = max(int(interval), 1)
+        self.machine = MachineClient(SilentSink(), envelope=envelope)
+        self.rows = array("L")
+        self.compiled = compile_program(program, self.machine, self.rows)
+        self.states = [self.machine.snapshot()]
+        # Calls executed on self.machine.
+        self.done = 0
+
+    def first_call(self, block):
+        """ Index of the first compiled call of block (or later), len(compiled) at the end. """
+        return bisect_left(self.rows, self.program.block_starts[block])
+
+    def _replay(self, stop):
+        compiled = self.compiled
+        for i in range(self.done, stop):
+            method, args = compiled[i]
+            method(*args)
+        self.done = stop
+
+    def state_at(self, block):
+        """ Returns the MachineState before block (0-based) is executed;
+        len(program) gives the state at the end.
+        """
+        block = min(max(block, 0), len(self.program))
+        k = block // self.interval
+        while len(self.states) <= k:
+            self._replay(self.first_call(len(self.states) * self.interval))
+            self.states.append(self.machine.snapshot())
+        start, stop = self.first_call(k * self.interval), self.first_call(block)
+        # The machine goes on from where the last seek left it if that is on the way.
+        if not start <= self.done <= stop:
+            self.machine.restore(self.states[k])
+            self.done = start
+        self._replay(stop)
+        return self.machine.snapshot()
+
+    def seek(self, machine, block):
+        """ Puts machine into the state before block, without any output. """
+        machine.restore(self.state_at(block))
+
+
+def get_checkpoints(program, interval=DEFAULT_INTERVAL, envelope=None):
+    """ Returns the (cached) CheckpointIndex of a Program on a machine with
+    the soft limits envelope (collision.Box, or None).
+    """
+    key = ("checkpoints", interval, envelope and envelope.bounds())
+    if key not in program.cache:
+        program.cache[key] = CheckpointIndex(program, interval, envelope)
+    return program.cache[key]
+
+
+def block_at_line(program, line):
+    """ Returns the index of the first block on or after a source line. """
+    return bisect_left(program.block_lines, line)
@@ -0,0 +1,235 @@
+import json
+import math
+from arcs import arc_points, arc_extrema, DEFAULT_TOLERANCE
+from renderer import SpatialGrid
+from toolpath import get_toolpath, RAPID, ARC_CW
+
+# Obstacle roles: fixtures are off limits to every move, stock only to rapids.
+FIXTURE = "fixture"
+STOCK = "stock"
+
+# Violation kinds.
+SOFT_LIMIT = "soft limit"
+COLLISION = "collision"
+RAPID_IN_STOCK = "rapid through stock"
+
+_EPS = 1e-9
+
+
+class Box:
+    """ Axis-aligned box, used for the machine envelope and box obstacles. """
+
+    def __init__(self, x_min, y_min, z_min, x_max, y_max, z_max, name="", role=FIXTURE):
+        self.x_min, self.y_min, self.z_min = x_min, y_min, z_min
+        self.x_max, self.y_max, self.z_max = x_max, y_max, z_max
+        self.name = name
+        self.role = role
+
+    def bounds(self):
+        """ (x_min, y_min, z_min, x_max, y_max, z_max), as in the setup file. """
+        return self.x_min, self.y_min, self.z_min, self.x_max, self.y_max, self.z_max
+
+    def extent(self):
+        """ (x_min, y_min, x_max, y_max) footprint for the spatial index. """
+        return self.x_min, self.y_min, self.x_max, self.y_max
+
+    def contains(self, x, y, z):
+        return (self.x_min - _EPS <= x <= self.x_max + _EPS and self.y_min - _EPS <= y <= self.y_max + _EPS
+                and self.z_min - _EPS <= z <= self.z_max + _EPS)
+
+    def hits(self, p0, p1):
+        """ True if the segment p0-p1 passes through the inside of the box
+        (touching a face does not count). Liang-Barsky slab clipping.
+        """
+        t0, t1 = 0.0, 1.0
+        for a, lo, hi in ((0, self.x_min, self.x_max), (1, self.y_min, self.y_max), (2, self.z_min, self.z_max)):
+            d = p1[a] - p0[a]
+            if abs(d) < _EPS:
+                if not lo + _EPS < p0[a] < hi - _EPS:
+                    return False
+                continue
+            ta, tb = (lo - p0[a]) / d, (hi - p0[a]) / d
+            if ta > tb:
+                ta, tb = tb, ta
+            t0, t1 = max(t0, ta), min(t1, tb)
+            if t1 - t0 <= _EPS:
+                return False
+        return True
+
+
+class Prism:
+    """ Obstacle with a polygonal footprint extruded from z_min to z_max. """
+
+    def __init__(self, points, z_min, z_max, name="", role=FIXTURE):
+        self.points = [tuple(p) for p in points]
+        self.z_min = z_min
+        self.z_max = z_max
+        self.name = name
+        self.role = role
+
+    def extent(self):
+        xs = [p[0] for p in self.points]
+        ys = [p[1] for p in self.points]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def _inside(self, x, y):
+        inside = False
+        pts = self.points
+        for i in range(len(pts)):
+            (ax, ay), (bx, by) = pts[i - 1], pts[i]
+            if (ay > y) != (by > y) and x < ax + (y - ay) * (bx - ax) / (by - ay):
+                inside = not inside
+        return inside
+
+    def hits(self, p0, p1):
+        """ True if the segment p0-p1 passes through the prism. """
+        # Clip to the z range first, then test the remaining 2D piece.
+        dz = p1[2] - p0[2]
+        t0, t1 = 0.0, 1.0
+        if abs(dz) < _EPS:
+            if not self.z_min + _EPS < p0[2] < self.z_max - _EPS:
+                return False
+        else:
+            ta, tb = (self.z_min - p0[2]) / dz, (self.z_max - p0[2]) / dz
+            t0, t1 = max(t0, min(ta, tb)), min(t1, max(ta, tb))
+            if t1 - t0 <= _EPS:
+                return False
+        ax, ay = p0[0] + (p1[0] - p0[0]) * t0, p0[1] + (p1[1] - p0[1]) * t0
+        bx, by = p0[0] + (p1[0] - p0[0]) * t1, p0[1] + (p1[1] - p0[1]) * t1
+        if self._inside(ax, ay) or self._inside(bx, by):
+            return True
+        pts = self.points
+        for i in range(len(pts)):
+            if _segments_cross((ax, ay), (bx, by), pts[i - 1], pts[i]):
+                return True
+        return False
+
+
+def _segments_cross(a, b, c, d):
+    """ True if the 2D segments a-b and c-d properly intersect. """
+    def side(p, q, r):
+        return (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    d1, d2 = side(c, d, a), side(c, d, b)
+    d3, d4 = side(a, b, c), side(a, b, d)
+    return ((d1 > _EPS and d2 < -_EPS) or (d1 < -_EPS and d2 > _EPS)) and \
+           ((d3 > _EPS and d4 < -_EPS) or (d3 < -_EPS and d4 > _EPS))
+
+
+class Violation:
+    """ First problem found by a CollisionChecker. """
+
+    def __init__(self, kind, block, segment, point, obstacle=None):
+        self.kind = kind
+        self.block = block
+        self.segment = segment
+        self.point = point
+        self.obstacle = obstacle
+
+    def describe(self, program=None):
+        where = f"block #{self.block + 1}"
+        if program is not None:
+            where += f" (line {program.block_lines[self.block]})"
+        what = self.kind
+        if self.obstacle is not None and self.obstacle.name:
+            what += f" with '{self.obstacle.name}'"
+        return "{}: {} near X={:.3f} Y={:.3f} Z={:.3f}".format(where, what, *self.point)
+
+
+class CollisionChecker:
+    """ Checks toolpath segments against the machine envelope (soft limits),
+    fixture obstacles and, for rapids only, the stock. Obstacles are
+    indexed by footprint in a SpatialGrid, so each segment is only tested
+    against the obstacles in the cells it crosses.
+    Args:
+      envelope (Box): allowed travel; None disables the soft limits
+      obstacles (list): Box / Prism obstacles with role FIXTURE or STOCK
+      tolerance (float): chord tolerance for testing arcs [mm]
+    """
+
+    def __init__(self, envelope=None, obstacles=(), tolerance=DEFAULT_TOLERANCE):
+        self.envelope = envelope
+        self.obstacles = list(obstacles)
+        self.tolerance = tolerance
+        self.grid = None
+        if self.obstacles:
+            extents = [o.extent() for o in self.obstacles]
+            self.extent = (min(e[0] for e in extents), min(e[1] for e in extents),
+                           max(e[2] for e in extents), max(e[3] for e in extents))
+            self.grid = SpatialGrid(*self.extent, len(extents))
+            for i, e in enumerate(extents):
+                self.grid.insert(i, *e)
+
+    def check_move(self, p0, p1, rapid):
+        """ Returns (kind, point, obstacle) for a straight move, or None if it is clear.
+        Only the end point is held to the envelope: the start is the end of the
+        move before, or the machine origin, which need not lie inside it.
+        """
+        envelope = self.envelope
+        if envelope is not None and not envelope.contains(*p1):
+            return SOFT_LIMIT, p1, None
+        if self.grid is None:
+            return None
+        x0, x1 = min(p0[0], p1[0]), max(p0[0], p1[0])
+        y0, y1 = min(p0[1], p1[1]), max(p0[1], p1[1])
+        e = self.extent
+        if x1 < e[0] or y1 < e[1] or x0 > e[2] or y0 > e[3]:
+            return None
+        candidates = self.grid.query(x0, y0, x1, y1)
+        for i in sorted(candidates):
+            obstacle = self.obstacles[i]
+            if obstacle.role == STOCK and not rapid:
+                continue
+            if obstacle.hits(p0, p1):
+                return (RAPID_IN_STOCK if obstacle.role == STOCK else COLLISION), p1, obstacle
+        return None
+
+    def check_toolpath(self, tp):
+        """ Returns the Violation of the first offending segment, or None. """
+        for n in range(len(tp)):
+            kind = tp.kinds[n]
+            start = (tp.x0[n], tp.y0[n], tp.z0[n])
+            if kind >= ARC_CW:
+                arc = (start, (tp.x1[n], tp.y1[n], tp.z1[n]), (tp.cx[n], tp.cy[n], tp.cz[n]), tp.planes[n])
+                if self.envelope is not None:
+                    for p in arc_extrema(*arc, kind == ARC_CW):
+                        if not self.envelope.contains(*p):
+                            return Violation(SOFT_LIMIT, tp.blocks[n], n, p)
+                points = arc_points(*arc, kind == ARC_CW, self.tolerance)
+            else:
+                points = ((tp.x1[n], tp.y1[n], tp.z1[n]),)
+            for p in points:
+                found = self.check_move(start, p, kind == RAPID)
+                if found is not None:
+                    return Violation(found[0], tp.blocks[n], n, found[1], found[2])
+                start = p
+        return None
+
+    def check_program(self, program):
+        return self.check_toolpath(get_toolpath(program))
+
+
+def load_setup(path):
+    """ Reads a machine setup JSON file, e.g.
+    {"envelope": [0, 0, -100, 600, 400, 50],
+     "obstacles": [{"name": "vise", "box": [10, 10, -50, 60, 30, 20]},
+                   {"name": "clamp", "polygon": [[0, 0], [10, 0], [5, 8]], "z": [-50, 10]},
+                   {"name": "part", "role": "stock", "box": [0, 0, -20, 100, 100, 0]}]}
+    Boxes are [x_min, y_min, z_min, x_max, y_max, z_max]. Returns a CollisionChecker.
+    """
+    with open(path) as f:
+        setup = json.load(f)
+    envelope = Box(*setup["envelope"], name="envelope") if "envelope" in setup else None
+    obstacles = []
+    for i, spec in enumerate(setup.get("obstacles", [])):
+        name = spec.get("name", f"obstacle #{i + 1}")
+        role = spec.get("role", FIXTURE)
+        if role not in (FIXTURE, STOCK):
+            raise ValueError(f"{path}: unknown role '{role}' of {name}")
+        if "box" in spec:
+            obstacles.append(Box(*spec["box"], name=name, role=role))
+        elif "polygon" in spec:
+            z_min, z_max = spec.get("z", (-math.inf, math.inf))
+            obstacles.append(Prism(spec["polygon"], z_min, z_max, name=name, role=role))
+        else:
+            raise ValueError(f"{path}: {name} needs a 'box' or a 'polygon'")
+    return CollisionChecker(envelope, obstacles)
@@ -0,0 +1,234 @@
+""" DNC drip-feed simulation: G-code arrives line by line from stdin or a
+local TCP connection and is parsed and executed as it comes, through a
+bounded look-ahead buffer like a controller's, in constant memory.
+"""
+import asyncio
+import os
+import stat
+import sys
+import time
+from machineclient import MachineClient
+from main import display_block_info, display_program_info, execute_block, parse_line, validate_markers
+from profiler import Histogram
+from program import GCodeFormatError, Program
+from sinks import INFO, ERROR
+
+# Lines buffered ahead of the executing block.
+DEFAULT_LOOKAHEAD = 256
+DEFAULT_HOST = "127.0.0.1"
+# Longest line accepted from the stream [bytes].
+LINE_LIMIT = 1 << 16
+
+
+class StreamParser:
+    """ Line-at-a-time form of main.iter_blocks(keep=False): only the
+    current block is held, so memory does not grow with the program.
+    """
+
+    def __init__(self, pgm_data):
+        self.pgm_data = pgm_data
+        pgm_data["commands"] = Program()
+        pgm_data["num_commands"] = 0
+        pgm_data["markers"] = 0
+        self.line_no = 0
+
+    def feed(self, txt_row):
+        """ Parses the next line; returns its Block or None. """
+        self.line_no += 1
+        return parse_line(txt_row, self.pgm_data, self.line_no, keep=False)
+
+    def finish(self):
+        """ Validates the "%" markers once the stream has ended. """
+        validate_markers(self.pgm_data["markers"])
+
+
+class StreamReport:
+    """ Statistics of one drip-fed program: block latency (line received to
+    block executed), buffer underruns (the executor waiting for data after
+    the first block), the highest buffer fill and the throughput.
+    """
+
+    def __init__(self, lookahead):
+        self.lookahead = lookahead
+        self.latency = Histogram()
+        self.lines = 0
+        self.blocks = 0
+        self.underruns = 0
+        self.starved = 0.0
+        self.max_fill = 0
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        rate = self.blocks / elapsed if elapsed > 0 else 0.0
+        h = self.latency
+        return [f"Streamed {self.lines} lines, {self.blocks} blocks in {elapsed:.3f} s ({rate:.0f} blocks/s).",
+                f"Block latency: p50 < {h.percentile(50) * 1e6:.0f} us, p99 < {h.percentile(99) * 1e6:.0f} us, "
+                f"max {h.max * 1e6:.0f} us.",
+                f"Buffer: {self.underruns} underruns ({self.starved:.3f} s starved), "
+                f"max fill {self.max_fill}/{self.lookahead} lines."]
+
+
+async def _feed(reader, buffer, report):
+    """ Reads lines into the buffer; waits while it is full, which stops
+    reading and so pushes back on the sender. None marks the end, a read
+    error is passed on in its place.
+    """
+    clock = time.perf_counter
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if report.started is None:
+                report.started = clock()
+            await buffer.put((line, clock()))
+            report.lines += 1
+            if buffer.qsize() > report.max_fill:
+                report.max_fill = buffer.qsize()
+    except (ConnectionError, ValueError) as err:
+        await buffer.put(err)
+        return
+    await buffer.put(None)
+
+
+async def _execute(buffer, report, machine, pgm_data):
+    """ Parses and executes the buffered lines as they come. """
+    clock = time.perf_counter
+    parser = StreamParser(pgm_data)
+    verbose = machine.sink.level <= INFO
+    add_latency = report.latency.add
+    refill = max(buffer.maxsize // 2, 1)
+    while True:
+        if buffer.qsize() <= refill:
+            # Lets the feeder top up the buffer from what the stream has ready,
+            # so an empty buffer below means the sender fell behind.
+            await asyncio.sleep(0)
+        if buffer.empty() and report.blocks:
+            wait = clock()
+            item = await buffer.get()
+            if item is not None:
+                report.underruns += 1
+                report.starved += clock() - wait
+        else:
+            item = await buffer.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+        line, received = item
+        block = parser.feed(line.decode("utf-8", "replace"))
+        if block is None:
+            continue
+        report.blocks += 1
+        if verbose:
+            if report.blocks == 1:
+                display_program_info(machine.sink, pgm_data)
+            display_block_info(machine.sink, report.blocks, block)
+        execute_block(machine, block, verbose)
+        add_latency(clock() - received)
+    report.finished = clock()
+    parser.finish()
+
+
+async def stream_program(reader, machine, lookahead=DEFAULT_LOOKAHEAD):
+    """ Simulates one drip-fed program from an asyncio StreamReader on
+    machine. Returns the StreamReport; a format or read error stops the
+    program and is raised.
+    """
+    report = StreamReport(lookahead)
+    buffer = asyncio.Queue(lookahead)
+    feeder = asyncio.ensure_future(_feed(reader, buffer, report))
+    try:
+        await _execute(buffer, report, machine, {})
+    finally:
+        feeder.cancel()
+        await asyncio.gather(feeder, return_exceptions=True)
+    return report
+
+
+class _FileReader:
+    """ readline() of a StreamReader over a regular file, which is always
+    ready to read (the event loop can only watch pipes and sockets).
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    async def readline(self):
+        return self.f.readline(LINE_LIMIT)
+
+
+async def _stdin_reader():
+    if stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode):
+        return _FileReader(sys.stdin.buffer)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    return reader
+
+
+def _print_report(report):
+    # Printed like the profiler report, so it shows whatever the log level.
+    print("\n".join(report.summary()), flush=True)
+
+
+async def serve_stdin(sink, lookahead=DEFAULT_LOOKAHEAD):
+    """ Simulates the program piped into stdin. Returns its StreamReport. """
+    report = await stream_program(await _stdin_reader(), MachineClient(sink), lookahead)
+    _print_report(report)
+    return report
+
+
+async def serve_tcp(sink, port, host=DEFAULT_HOST, lookahead=DEFAULT_LOOKAHEAD, count=None):
+    """ Accepts drip-feed connections on host:port, each sending one program.
+    Programs run one at a time on their own MachineClient, as on a single
+    controller; further senders wait (and are pushed back by TCP).
+    Serves count programs, or until cancelled if count is None.
+    """
+    lock = asyncio.Lock()
+    done = asyncio.Event()
+    served = 0
+
+    async def handle(reader, writer):
+        nonlocal served
+        async with lock:
+            if sink.level <= INFO:
+                sink.emit(INFO, f"DNC connection from {writer.get_extra_info('peername')}.")
+            try:
+                report = await stream_program(reader, MachineClient(sink), lookahead)
+                _print_report(report)
+            except (GCodeFormatError, ValueError, ConnectionError) as err:
+                sink.emit(ERROR, f"Error: {err}")
+            finally:
+                writer.close()
+            served += 1
+            if count is not None and served >= count:
+                done.set()
+
+    server = await asyncio.start_server(handle, host, port, limit=LINE_LIMIT)
+    if sink.level <= INFO:
+        sink.emit(INFO, f"DNC server listening on {host}:{port}.")
+    async with server:
+        await done.wait()
+
+
+def parse_address(text):
+    """ Splits "[HOST:]PORT" into (host, port). """
+    host, _, port = text.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+def run_dnc(sink, source, lookahead=DEFAULT_LOOKAHEAD, count=None):
+    """ Runs the drip-feed simulation from source: "-" for stdin, else
+    "[HOST:]PORT" to listen on.
+    """
+    if source == "-":
+        asyncio.run(serve_stdin(sink, lookahead))
+    else:
+        host, port = parse_address(source)
+        try:
+            asyncio.run(serve_tcp(sink, port, host, lookahead, count))
+        except KeyboardInterrupt:
+            pass
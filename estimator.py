@@ -0,0 +1,163 @@
+import math
+from array import array
+from arcs import arc_params, arc_tangents
+from toolpath import get_toolpath, segment_lengths, RAPID, ARC_CW, FEED_INVTIME
+
+
+class MotionLimits:
+    """ Kinematic limits of the machine used by the time estimator.
+    Args:
+      rapid_rates (tuple): max X/Y/Z traverse rates [mm/min]
+      accelerations (tuple): max X/Y/Z accelerations [mm/s^2]
+      junction_deviation (float): allowed corner deviation [mm]; cornering
+        speed is derived from it (as in grbl) instead of an explicit jerk limit
+      default_feed (float): feed used before the first F word [mm/min]
+    """
+
+    def __init__(self, rapid_rates=(5000.0, 5000.0, 2000.0), accelerations=(500.0, 500.0, 200.0),
+                 junction_deviation=0.01, default_feed=100.0):
+        self.rapid_rates = rapid_rates
+        self.accelerations = accelerations
+        self.junction_deviation = junction_deviation
+        self.default_feed = default_feed
+
+    def key(self):
+        """ The limit values as a tuple, for caching results computed with them. """
+        return tuple(self.rapid_rates), tuple(self.accelerations), self.junction_deviation, self.default_feed
+
+
+DEFAULT_LIMITS = MotionLimits()
+
+
+class Estimate:
+    """ Result of estimate_toolpath(): times[n] is the duration [s] of segment n. """
+
+    def __init__(self, toolpath, times):
+        self.toolpath = toolpath
+        self.times = times
+        self.total = math.fsum(times)
+
+    def block_times(self):
+        """ Returns {block index: seconds} for all blocks containing motion. """
+        result = {}
+        for block, t in zip(self.toolpath.blocks, self.times):
+            result[block] = result.get(block, 0.0) + t
+        return result
+
+
+def estimate_program(program, limits=None):
+    """ Returns the (cached) Estimate of a Program for the given limits. """
+    limits = limits or DEFAULT_LIMITS
+    key = ("estimate", limits.key())
+    if key not in program.cache:
+        program.cache[key] = estimate_toolpath(get_toolpath(program), limits)
+    return program.cache[key]
+
+
+def _axis_limit(ux, uy, uz, per_axis):
+    """ Largest magnitude along direction u that keeps every axis within its limit. """
+    limit = math.inf
+    for u, axis_limit in zip((ux, uy, uz), per_axis):
+        if u:
+            limit = min(limit, axis_limit / abs(u))
+    return limit
+
+
+def estimate_toolpath(tp, limits):
+    """ Computes segment times with trapezoidal velocity profiles.
+    A backward and a forward pass over the segments limit every junction
+    speed by the corner angle (junction deviation), the nominal speeds of
+    both segments and the speed reachable by accelerating over the
+    neighbouring segments, so the machine stops only where it must.
+    """
+    n_seg = len(tp)
+    lengths = segment_lengths(tp)
+    kinds, feeds, modes = tp.kinds, tp.feeds, tp.feed_modes
+    x0, y0, z0, x1, y1, z1 = tp.x0, tp.y0, tp.z0, tp.x1, tp.y1, tp.z1
+    cxs, cys, czs, planes = tp.cx, tp.cy, tp.cz, tp.planes
+    rapid_rates = tuple(rate / 60.0 for rate in limits.rapid_rates)
+    accelerations = limits.accelerations
+    deviation = limits.junction_deviation
+    default_feed = limits.default_feed
+
+    v_nominal = array("d", bytes(8 * n_seg))
+    accel = array("d", bytes(8 * n_seg))
+    v_junction = array("d", bytes(8 * (n_seg + 1)))
+    prev_dir = None
+    prev_a = prev_v = 0.0
+
+    for n in range(n_seg):
+        length = lengths[n]
+        if length <= 0.0:
+            # Zero-length moves take no time and do not break the look-ahead.
+            v_nominal[n] = accel[n] = 1.0
+            v_junction[n] = math.inf
+            continue
+        kind = kinds[n]
+
+        if kind >= ARC_CW:
+            arc = ((x0[n], y0[n], z0[n]), (x1[n], y1[n], z1[n]), (cxs[n], cys[n], czs[n]), planes[n],
+                   kind == ARC_CW)
+            radius = arc_params(*arc)[0] or 1e-9
+            start_dir, end_dir = arc_tangents(*arc)
+        else:
+            radius = 0.0
+            start_dir = end_dir = ((x1[n] - x0[n]) / length, (y1[n] - y0[n]) / length, (z1[n] - z0[n]) / length)
+
+        a = _axis_limit(*start_dir, accelerations)
+        if kind == RAPID:
+            v = _axis_limit(*start_dir, rapid_rates)
+        elif modes[n] == FEED_INVTIME and feeds[n] > 0:
+            v = length * feeds[n] / 60.0
+        else:
+            v = (feeds[n] or default_feed) / 60.0
+        if radius:
+            # Centripetal acceleration bounds the speed on arcs.
+            v = min(v, math.sqrt(a * radius))
+        v_nominal[n] = v
+        accel[n] = a
+
+        if prev_dir is not None:
+            cos_theta = -(prev_dir[0] * start_dir[0] + prev_dir[1] * start_dir[1] + prev_dir[2] * start_dir[2])
+            if cos_theta > 0.999999:
+                v_j = 0.0
+            elif cos_theta < -0.999999:
+                v_j = math.inf
+            else:
+                sin_half = math.sqrt(0.5 * (1.0 - cos_theta))
+                v_j = math.sqrt(min(a, prev_a) * deviation * sin_half / (1.0 - sin_half))
+            v_junction[n] = min(v_j, v, prev_v)
+        prev_dir, prev_a, prev_v = end_dir, a, v
+
+    # Backward pass: every entry speed must allow stopping at the program end.
+    v_exit = 0.0
+    for n in range(n_seg - 1, -1, -1):
+        v_entry = min(v_junction[n], math.sqrt(v_exit * v_exit + 2.0 * accel[n] * lengths[n]))
+        v_junction[n] = v_entry
+        v_exit = v_entry
+
+    # Forward pass: entry speeds reachable from the previous segment, then segment times.
+    times = array("d", bytes(8 * n_seg))
+    v_entry = 0.0
+    for n in range(n_seg):
+        length = lengths[n]
+        v_exit = v_junction[n + 1] if n + 1 < n_seg else 0.0
+        v_exit = min(v_exit, math.sqrt(v_entry * v_entry + 2.0 * accel[n] * length))
+        times[n] = _trapezoid_time(length, v_entry, v_exit, v_nominal[n], accel[n])
+        if n + 1 < n_seg:
+            v_junction[n + 1] = v_exit
+        v_entry = v_exit
+
+    return Estimate(tp, times)
+
+
+def _trapezoid_time(length, v_entry, v_exit, v_max, a):
+    if length <= 0.0:
+        return 0.0
+    d_accel = (v_max * v_max - v_entry * v_entry) / (2.0 * a)
+    d_decel = (v_max * v_max - v_exit * v_exit) / (2.0 * a)
+    if d_accel + d_decel <= length:
+        return (v_max - v_entry) / a + (v_max - v_exit) / a + (length - d_accel - d_decel) / v_max
+    # Triangular profile: the nominal speed is never reached.
+    v_peak = math.sqrt((2.0 * a * length + v_entry * v_entry + v_exit * v_exit) / 2.0)
+    return (v_peak - v_entry) / a + (v_peak - v_exit) / a
@@ -0,0 +1,175 @@
+""" Headless toolpath previews: SVG documents and anti-aliased PNG images,
+rendered from the same LodScene and ViewTransform as the visualizer
+canvas, without Tk.
+"""
+import math
+import struct
+import zlib
+from renderer import LodScene, ViewTransform, fit_scale
+from toolpath import get_bounds
+
+# Colors of the visualizer canvas (gray70 background, steel blue path, brown4 markers).
+BACKGROUND = (179, 179, 179)
+PATH_COLOR = (70, 130, 180)
+MARKER_COLOR = (139, 35, 35)
+MARKER_RADIUS = 3.0
+# Path line width of the visualizer canvas [px].
+PATH_WIDTH = 2.0
+DEFAULT_SIZE = (400, 300)
+# Blank border around the fitted toolpath [px].
+MARGIN = 10
+
+
+def preview_view(program, width, height, margin=MARGIN):
+    """ Returns the ViewTransform fitting the program's bounds into the image,
+    centered, with margin pixels of border.
+    """
+    bounds = get_bounds(program)
+    scale = fit_scale(bounds, max(width - 2 * margin, 1), max(height - 2 * margin, 1))
+    if bounds is None:
+        return ViewTransform(0.0, 0.0, scale)
+    offset_x = (width - (bounds.x_max - bounds.x_min) * scale) / 2.0
+    offset_y = (height - (bounds.y_max - bounds.y_min) * scale) / 2.0
+    return ViewTransform(bounds.x_min, bounds.y_min, scale, offset_x, offset_y)
+
+
+def _scene(program, view):
+    # Arcs are discretized to a quarter pixel, like the visualizer does.
+    return LodScene(program, 0.25 / view.scale)
+
+
+def _hex(color):
+    return "#%02x%02x%02x" % color
+
+
+def render_svg(program, width=DEFAULT_SIZE[0], height=DEFAULT_SIZE[1]):
+    """ Returns the toolpath preview as an SVG document (str). """
+    view = preview_view(program, width, height)
+    scene = _scene(program, view)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}">',
+             f'<rect width="100%" height="100%" fill="{_hex(BACKGROUND)}"/>',
+             f'<g fill="none" stroke="{_hex(PATH_COLOR)}" stroke-width="{PATH_WIDTH:g}" stroke-linejoin="round">']
+    for coords in scene.polylines(view, width, height):
+        points = " ".join(f"{coords[i]:.1f},{coords[i + 1]:.1f}" for i in range(0, len(coords), 2))
+        parts.append(f'<polyline points="{points}"/>')
+    parts.append("</g>")
+    parts.append(f'<g fill="{_hex(MARKER_COLOR)}">')
+    for x, y in scene.markers(view, width, height):
+        parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{MARKER_RADIUS:g}"/>')
+    parts.append("</g>")
+    parts.append("</svg>")
+    return "\n".join(parts) + "\n"
+
+
+class Raster:
+    """ 8-bit coverage mask: alpha[y * width + x] is how much of a pixel is
+    covered (0-255). Overlapping shapes keep the larger coverage, so dense
+    paths do not saturate.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.alpha = bytearray(width * height)
+
+    def _plot(self, x, y, coverage):
+        if 0 <= x < self.width and 0 <= y < self.height and coverage > 0.0:
+            i = y * self.width + x
+            value = int(coverage * 255.0 + 0.5)
+            if value > self.alpha[i]:
+                self.alpha[i] = value
+
+    def line(self, x0, y0, x1, y1, width=1.0):
+        """ Anti-aliased line of width px with butt ends, like a Tk canvas
+        line (Xiaolin Wu's walk, covering a band of that width across the
+        line). Pixel (x, y) covers [x, x + 1] x [y, y + 1].
+        """
+        steep = abs(y1 - y0) > abs(x1 - x0)
+        if steep:
+            x0, y0, x1, y1 = y0, x0, y1, x1
+        if x0 > x1:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        dx = x1 - x0
+        gradient = (y1 - y0) / dx if dx else 1.0
+        plot = (lambda a, b, c: self._plot(b, a, c)) if steep else self._plot
+        # Width of the band across the line, measured along the minor axis.
+        half = width * math.sqrt(1.0 + gradient * gradient) / 2.0
+
+        # Only the columns inside the image are walked.
+        limit = (self.height if steep else self.width) - 1
+        start = max(int(math.floor(x0)), 0)
+        end = min(int(math.ceil(x1)) - 1, limit)
+        for x in range(start, end + 1):
+            # End columns are weighted by how much of them the line covers.
+            weight = min(x1, x + 1.0) - max(x0, float(x))
+            y = y0 + gradient * (x + 0.5 - x0)
+            low, high = y - half, y + half
+            for k in range(int(math.floor(low)), int(math.ceil(high))):
+                plot(x, k, (min(high, k + 1.0) - max(low, float(k))) * weight)
+
+    def disc(self, cx, cy, radius):
+        """ Anti-aliased filled circle. """
+        for y in range(int(cy - radius - 1), int(cy + radius + 2)):
+            for x in range(int(cx - radius - 1), int(cx + radius + 2)):
+                distance = math.hypot(x + 0.5 - cx, y + 0.5 - cy)
+                self._plot(x, y, min(radius + 0.5 - distance, 1.0))
+
+
+def encode_png(width, height, background, layers):
+    """ Composites coverage layers [(Raster, color)] over a background
+    color, in order, and returns the 8-bit RGB PNG file (bytes).
+    """
+    channels = [bytearray([value]) * (width * height) for value in background]
+    for n, (raster, color) in enumerate(layers):
+        if n == 0:
+            # Over the uniform background, blending is a lookup by coverage.
+            for c, channel in enumerate(channels):
+                table = bytes((background[c] * (255 - a) + color[c] * a + 127) // 255 for a in range(256))
+                channels[c] = bytearray(raster.alpha.translate(table))
+            continue
+        for i, a in enumerate(raster.alpha):
+            if a:
+                for c, channel in enumerate(channels):
+                    channel[i] = (channel[i] * (255 - a) + color[c] * a + 127) // 255
+
+    rgb = bytearray(3 * width * height)
+    for c, channel in enumerate(channels):
+        rgb[c::3] = channel
+    stride = 3 * width
+    # Filter type 0 (none) before every row.
+    raw = b"".join(b"\x00" + rgb[y * stride:(y + 1) * stride] for y in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b""))
+
+
+def render_png(program, width=DEFAULT_SIZE[0], height=DEFAULT_SIZE[1]):
+    """ Returns the toolpath preview as a PNG image (bytes). """
+    view = preview_view(program, width, height)
+    scene = _scene(program, view)
+    path = Raster(width, height)
+    for coords in scene.polylines(view, width, height):
+        for i in range(0, len(coords) - 2, 2):
+            path.line(coords[i], coords[i + 1], coords[i + 2], coords[i + 3], PATH_WIDTH)
+    markers = Raster(width, height)
+    for x, y in scene.markers(view, width, height):
+        markers.disc(x, y, MARKER_RADIUS)
+    return encode_png(width, height, BACKGROUND, [(path, PATH_COLOR), (markers, MARKER_COLOR)])
+
+
+def export_preview(program, path, width=DEFAULT_SIZE[0], height=DEFAULT_SIZE[1]):
+    """ Writes a preview image; the format (.svg or .png) follows the file name. """
+    if path.lower().endswith(".svg"):
+        with open(path, "w") as f:
+            f.write(render_svg(program, width, height))
+    elif path.lower().endswith(".png"):
+        with open(path, "wb") as f:
+            f.write(render_png(program, width, height))
+    else:
+        raise ValueError(f"{path}: preview must be a .png or .svg file")
@@ -1,233 +1,418 @@
-import math
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from machineclient import MachineClient
-from main import parse_file, execute_command, check_markers
-
-class CNCVisualizer:
-    def __init__(self, root):
-        self.root = root
-        self.root.title("CNC Visualizer")
-
-        # Create main frame with canvas and controls
-        self.canvas = tk.Canvas(root, width=800, height=600, bg="gray70")
-        self.canvas.grid(row=0, column=1, rowspan=3, sticky="nsew")
-
-        self.control_frame = tk.Frame(root)
-        self.control_frame.grid(row=0, column=0, sticky="n")
-
-        # G-code related controls
-        self.load_button = tk.Button(self.control_frame, text="Load G-Code", command=self.load_file)
-        self.load_button.pack(pady=10)
-
-        self.run_button = tk.Button(self.control_frame, text="Run Program", command=self.run_program, state=tk.DISABLED)
-        self.run_button.pack(pady=10)
-
-        # Navigation controls
-        self.move_frame = tk.Frame(self.control_frame)
-        self.move_frame.pack(pady=20)
-
-        self.up_button = tk.Button(self.move_frame, text="Up", command=lambda: self.move_canvas(0, -20))
-        self.up_button.grid(row=0, column=1)
-
-        self.left_button = tk.Button(self.move_frame, text="Left", command=lambda: self.move_canvas(-20, 0))
-        self.left_button.grid(row=1, column=0)
-
-        self.right_button = tk.Button(self.move_frame, text="Right", command=lambda: self.move_canvas(20, 0))
-        self.right_button.grid(row=1, column=2)
-
-        self.down_button = tk.Button(self.move_frame, text="Down", command=lambda: self.move_canvas(0, 20))
-        self.down_button.grid(row=2, column=1)
-
-        # Zoom controls
-        self.zoom_in_button = tk.Button(self.control_frame, text="Zoom In", command=self.zoom_in)
-        self.zoom_in_button.pack(pady=10)
-
-        self.zoom_out_button = tk.Button(self.control_frame, text="Zoom Out", command=self.zoom_out)
-        self.zoom_out_button.pack(pady=10)
-
-        # MachineClient integration
-        self.machine = MachineClient()
-        self.pgm_data = {}
-        self.current_pos = {"x": 400, "y": 300, "z": 0}
-        self.scale_factor = 10
-        self.bounds = {"x_min": None, "x_max": None, "y_min": None, "y_max": None}
-        self.canvas_offset = {"x": 0, "y": 0}
-
-        # Status display
-        self.status_frame = tk.Frame(root)
-        self.status_frame.grid(row=1, column=0, sticky="ew")
-
-        self.status_label = tk.Label(self.status_frame, text="Status: Idle", anchor="w")
-        self.status_label.pack(fill=tk.X)
-
-    def update_status(self, message):
-        self.status_label.config(text=f"Status: {message}")
-
-    def load_file(self):
-        filepath = filedialog.askopenfilename(filetypes=[("G-Code Files", "*.txt *.nc *.gcode")])
-        if not filepath:
-            return
-        try:
-            with open(filepath) as f:
-                if not check_markers(f):
-                    raise ValueError("Invalid G-code file markers.")
-                parse_file(f, self.pgm_data)
-
-            self.calculate_bounds()
-            messagebox.showinfo("Success", f"Loaded {len(self.pgm_data['commands'])} command blocks.")
-            self.run_button.config(state=tk.NORMAL)
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to load G-code file: {e}")
-
-    def run_program(self):
-        self.current_pos = {"x": 400, "y": 300, "z": 0}
-        self.canvas.delete("all")
-        self.update_status("Running program...")
-
-        for block in self.pgm_data["commands"]:
-            for command in block:
-                try:
-                    self.execute_visual_command(command)
-                except Exception as e:
-                    print(f"Error while executing command {command}: {e}")
-        self.update_status("Program finished.")
-
-    def execute_visual_command(self, cmd_data):
-        cmd = cmd_data["cmd"]
-        params = cmd_data.get("params", [])
-
-        if cmd in ["G00", "G01"]:  # Movement commands
-            self.handle_movement(cmd, params)
-        elif cmd in ["G02", "G03"]:  # Arc commands
-            self.handle_arc(cmd, params)
-        elif cmd == "G92":  # Set offset command
-            self.handle_offset(params)
-        execute_command(self.machine, cmd_data)
-
-    def handle_movement(self, cmd, params):
-        x, y, z = self.current_pos["x"], self.current_pos["y"], self.current_pos["z"]
-
-        for param in params:
-            if param.startswith("X"):
-                x = (float(param[1:]) - self.bounds["x_min"]) * self.scale_factor + self.canvas_offset["x"]
-            elif param.startswith("Y"):
-                y = (float(param[1:]) - self.bounds["y_min"]) * self.scale_factor + self.canvas_offset["y"]
-            elif param.startswith("Z"):
-                z = float(param[1:])
-
-        if cmd == "G01":  # Linear movement
-            self.canvas.create_line(
-                self.current_pos["x"], self.current_pos["y"], x, y, fill="steel blue", width=2
-            )
-
-        self.canvas.create_oval(x - 3, y - 3, x + 3, y + 3, fill="brown4")  # Mark position
-        self.current_pos["x"], self.current_pos["y"], self.current_pos["z"] = x, y, z
-
-    def handle_arc(self, cmd, params):
-        x, y = self.current_pos["x"], self.current_pos["y"]
-        i = j = None
-
-        for param in params:
-            if param.startswith("X"):
-                x = (float(param[1:]) - self.bounds["x_min"]) * self.scale_factor + self.canvas_offset["x"]
-            elif param.startswith("Y"):
-                y = (float(param[1:]) - self.bounds["y_min"]) * self.scale_factor + self.canvas_offset["y"]
-            elif param.startswith("I"):
-                i = float(param[1:]) * self.scale_factor
-            elif param.startswith("J"):
-                j = float(param[1:]) * self.scale_factor
-
-        if i is not None and j is not None:
-            # Calculate center of the arc
-            cx = self.current_pos["x"] + i
-            cy = self.current_pos["y"] + j
-
-            # Calculate radius
-            radius = math.sqrt(i ** 2 + j ** 2)
-
-            # Calculate start and end angles
-            start_angle = self.calculate_angle(cx, cy, self.current_pos["x"], self.current_pos["y"])
-            end_angle = self.calculate_angle(cx, cy, x, y)
-
-            # Determine the extent of the arc
-            if cmd == "G02":  # Clockwise
-                extent = (end_angle - start_angle) % 360
-            else:  # Counterclockwise
-                extent = (start_angle - end_angle) % 360
-
-            # Debugging information
-            print(f"Debug: Arc center=({cx}, {cy}), start_angle={start_angle}, end_angle={end_angle}, extent={extent}")
-
-            # Draw the arc
-            self.canvas.create_arc(
-                cx - radius, cy - radius, cx + radius, cy + radius,
-                start=start_angle, extent=extent, style=tk.ARC, outline="steel blue", width=2
-            )
-
-        self.canvas.create_oval(x - 3, y - 3, x + 3, y + 3, fill="brown4")  # Mark position
-        self.current_pos["x"], self.current_pos["y"] = x, y
-
-    def calculate_angle(self, cx, cy, x, y):
-        angle = math.degrees(math.atan2(y - cy, x - cx))
-        return (360 + angle) % 360
-
-    def handle_offset(self, params):
-        for param in params:
-            axis = param[0]
-            value = float(param[1:])
-            if axis == "X":
-                self.current_pos["x"] = (value - self.bounds["x_min"]) * self.scale_factor + self.canvas_offset["x"]
-            elif axis == "Y":
-                self.current_pos["y"] = (value - self.bounds["y_min"]) * self.scale_factor + self.canvas_offset["y"]
-            elif axis == "Z":
-                self.current_pos["z"] = value
-
-    def calculate_bounds(self):
-        x_coords = []
-        y_coords = []
-
-        for block in self.pgm_data["commands"]:
-            for cmd in block:
-                params = cmd.get("params", [])
-                for param in params:
-                    if param.startswith("X"):
-                        x_coords.append(float(param[1:]))
-                    if param.startswith("Y"):
-                        y_coords.append(float(param[1:]))
-
-        if x_coords and y_coords:
-            self.bounds["x_min"] = min(x_coords)
-            self.bounds["x_max"] = max(x_coords)
-            self.bounds["y_min"] = min(y_coords)
-            self.bounds["y_max"] = max(y_coords)
-
-            x_range = self.bounds["x_max"] - self.bounds["x_min"]
-            y_range = self.bounds["y_max"] - self.bounds["y_min"]
-
-            if x_range > 0 and y_range > 0:
-                self.scale_factor = min(700 / x_range, 500 / y_range)
-
-    def zoom_in(self):
-        self.scale_factor *= 1.2
-        self.redraw_canvas()
-
-    def zoom_out(self):
-        self.scale_factor /= 1.2
-        self.redraw_canvas()
-
-    def move_canvas(self, dx, dy):
-        self.canvas_offset["x"] += dx
-        self.canvas_offset["y"] += dy
-        self.redraw_canvas()
-
-    def redraw_canvas(self):
-        self.canvas.delete("all")
-        self.run_program()
-
-if __name__ == "__main__":
-    root = tk.Tk()
-    root.rowconfigure(0, weight=1)
-    root.columnconfigure(1, weight=1)
-    app = CNCVisualizer(root)
+import queue
+import time
+import tkinter as tk
+from bisect import bisect_left
+from tkinter import filedialog, messagebox
+from arcs import DEFAULT_TOLERANCE
+from checkpoints import get_checkpoints
+from machineclient import MachineClient
+from main import phase
+from playback import Playback, get_timeline, SPEEDS
+from profiler import Profiler
+from progcache import DEFAULT_CACHE_DIR
+from renderer import ViewTransform
+from runner import LoadWorker, RunWorker
+from toolpath import get_bounds
+
+# Worker events are drained every FRAME_MS, at most MAX_EVENTS per frame.
+FRAME_MS = 30
+MAX_EVENTS = 200
+
+class CNCVisualizer:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("CNC Visualizer")
+
+        # Create main frame with canvas and controls
+        self.canvas = tk.Canvas(root, width=800, height=600, bg="gray70")
+        self.canvas.grid(row=0, column=1, rowspan=3, sticky="nsew")
+
+        self.control_frame = tk.Frame(root)
+        self.control_frame.grid(row=0, column=0, sticky="n")
+
+        # G-code related controls
+        self.load_button = tk.Button(self.control_frame, text="Load G-Code", command=self.load_file)
+        self.load_button.pack(pady=10)
+
+        self.run_button = tk.Button(self.control_frame, text="Run Program", command=self.run_program, state=tk.DISABLED)
+        self.run_button.pack(pady=10)
+
+        self.pause_button = tk.Button(self.control_frame, text="Pause", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(pady=10)
+
+        self.cancel_button = tk.Button(self.control_frame, text="Cancel", command=self.cancel_worker, state=tk.DISABLED)
+        self.cancel_button.pack(pady=10)
+
+        # Navigation controls
+        self.move_frame = tk.Frame(self.control_frame)
+        self.move_frame.pack(pady=20)
+
+        self.up_button = tk.Button(self.move_frame, text="Up", command=lambda: self.move_canvas(0, -20))
+        self.up_button.grid(row=0, column=1)
+
+        self.left_button = tk.Button(self.move_frame, text="Left", command=lambda: self.move_canvas(-20, 0))
+        self.left_button.grid(row=1, column=0)
+
+        self.right_button = tk.Button(self.move_frame, text="Right", command=lambda: self.move_canvas(20, 0))
+        self.right_button.grid(row=1, column=2)
+
+        self.down_button = tk.Button(self.move_frame, text="Down", command=lambda: self.move_canvas(0, 20))
+        self.down_button.grid(row=2, column=1)
+
+        # Zoom controls
+        self.zoom_in_button = tk.Button(self.control_frame, text="Zoom In", command=self.zoom_in)
+        self.zoom_in_button.pack(pady=10)
+
+        self.zoom_out_button = tk.Button(self.control_frame, text="Zoom Out", command=self.zoom_out)
+        self.zoom_out_button.pack(pady=10)
+
+        # Playback controls
+        self.play_button = tk.Button(self.control_frame, text="Play", command=self.toggle_playback, state=tk.DISABLED)
+        self.play_button.pack(pady=10)
+
+        self.speed_var = tk.StringVar(value="1x")
+        self.speed_menu = tk.OptionMenu(self.control_frame, self.speed_var, *SPEEDS, command=self.set_speed)
+        self.speed_menu.pack(pady=10)
+
+        # Block seek controls: the playback and the next run start at the block.
+        self.seek_frame = tk.Frame(self.control_frame)
+        self.seek_frame.pack(pady=10)
+        self.block_var = tk.StringVar()
+        self.block_entry = tk.Entry(self.seek_frame, textvariable=self.block_var, width=8)
+        self.block_entry.grid(row=0, column=0)
+        self.block_entry.bind("<Return>", lambda event: self.go_to_block())
+        self.go_button = tk.Button(self.seek_frame, text="Go to block", command=self.go_to_block)
+        self.go_button.grid(row=0, column=1)
+
+        self.scrubber = tk.Scale(root, orient=tk.HORIZONTAL, showvalue=False, from_=0, to=1,
+                                 resolution=0.001, command=self.scrub, state=tk.DISABLED)
+        self.scrubber.grid(row=3, column=1, sticky="ew")
+
+        # Profiling controls
+        self.profile_var = tk.BooleanVar(value=False)
+        self.profile_check = tk.Checkbutton(self.control_frame, text="Profile", variable=self.profile_var)
+        self.profile_check.pack(pady=5)
+
+        self.cache_var = tk.BooleanVar(value=True)
+        self.cache_check = tk.Checkbutton(self.control_frame, text="Cache", variable=self.cache_var)
+        self.cache_check.pack(pady=5)
+
+        self.simplify_var = tk.BooleanVar(value=False)
+        self.simplify_check = tk.Checkbutton(self.control_frame, text="Simplify", variable=self.simplify_var)
+        self.simplify_check.pack(pady=5)
+
+        self.stats_button = tk.Button(self.control_frame, text="Stats", command=self.show_stats)
+        self.stats_button.pack(pady=5)
+
+        # MachineClient integration
+        self.machine = MachineClient()
+        self.pgm_data = {}
+        self.scale_factor = 10
+        self.bounds = {"x_min": None, "x_max": None, "y_min": None, "y_max": None}
+        self.canvas_offset = {"x": 0, "y": 0}
+        self.scene = None
+        self.refresh_job = None
+        # Background job state; None while idle.
+        self.events = queue.Queue()
+        self.worker = None
+        self.done_segments = None
+        self.profiler = None
+        self.stats_text = None
+        self.playback = None
+        self.play_job = None
+        self.last_tick = 0.0
+        self.start_block = 0
+
+        # Status display
+        self.status_frame = tk.Frame(root)
+        self.status_frame.grid(row=1, column=0, sticky="ew")
+
+        self.status_label = tk.Label(self.status_frame, text="Status: Idle", anchor="w")
+        self.status_label.pack(fill=tk.X)
+
+    def update_status(self, message):
+        self.status_label.config(text=f"Status: {message}")
+
+    def load_file(self):
+        filepath = filedialog.askopenfilename(filetypes=[("G-Code Files", "*.txt *.nc *.gcode")])
+        if not filepath:
+            return
+        self.run_button.config(state=tk.DISABLED)
+        self.update_status("Loading...")
+        # Each load starts a fresh profile; runs and redraws add to it.
+        self.profiler = Profiler() if self.profile_var.get() else None
+        cache_dir = DEFAULT_CACHE_DIR if self.cache_var.get() else None
+        simplify = DEFAULT_TOLERANCE if self.simplify_var.get() else None
+        self.start_worker(LoadWorker(filepath, events=self.events, profiler=self.profiler, cache_dir=cache_dir,
+                                     simplify=simplify))
+
+    def run_program(self):
+        self.canvas.delete("all")
+        self.update_status("Running program...")
+        self.done_segments = 0
+        if not self.profile_var.get():
+            self.profiler = None
+        elif self.profiler is None:
+            self.profiler = Profiler()
+        self.start_worker(RunWorker(self.pgm_data["commands"], self.machine, events=self.events,
+                                    profiler=self.profiler, start_block=self.start_block))
+
+    def start_worker(self, worker):
+        """ Parsing and execution run off the Tk thread; their events are polled per frame. """
+        self.worker = worker
+        self.stop_playback()
+        self.play_button.config(state=tk.DISABLED)
+        self.load_button.config(state=tk.DISABLED)
+        self.run_button.config(state=tk.DISABLED)
+        self.pause_button.config(state=tk.NORMAL, text="Pause")
+        self.cancel_button.config(state=tk.NORMAL)
+        worker.start()
+        self.root.after(FRAME_MS, self.poll_events)
+
+    def stop_worker(self, status):
+        self.worker = None
+        self.done_segments = None
+        self.load_button.config(state=tk.NORMAL)
+        self.run_button.config(state=tk.NORMAL if self.pgm_data else tk.DISABLED)
+        self.pause_button.config(state=tk.DISABLED, text="Pause")
+        self.cancel_button.config(state=tk.DISABLED)
+        if self.playback is not None and self.playback.timeline.duration > 0:
+            self.play_button.config(state=tk.NORMAL)
+        self.update_status(status)
+        self.draw_toolpath()
+        if self.stats_text is not None and self.stats_text.winfo_exists():
+            # An open statistics panel shows the job that just finished.
+            self.show_stats()
+
+    def toggle_pause(self):
+        if self.worker is None:
+            return
+        if self.worker.paused:
+            self.worker.resume()
+            self.pause_button.config(text="Pause")
+        else:
+            self.worker.pause()
+            self.pause_button.config(text="Resume")
+            self.update_status("Paused")
+
+    def cancel_worker(self):
+        if self.worker is not None:
+            self.worker.cancel()
+
+    def poll_events(self):
+        """ Applies a bounded batch of worker events, then reschedules itself. """
+        for _ in range(MAX_EVENTS):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self.handle_event(event)
+            if self.worker is None:
+                return
+        if self.worker is not None:
+            self.root.after(FRAME_MS, self.poll_events)
+
+    def handle_event(self, event):
+        kind = event[0]
+        if kind == "load_progress":
+            self.update_status(f"Loading... {event[1]:.0%}")
+        elif kind == "loaded":
+            _, self.pgm_data, self.scene, self.scale_factor = event
+            bounds = get_bounds(self.pgm_data["commands"])
+            if bounds is None:
+                self.scene = None
+            else:
+                self.bounds = bounds.as_dict()
+            self.canvas_offset = {"x": 0, "y": 0}
+            self.start_block = 0
+            self.reset_playback()
+            self.stop_worker(f"Loaded {len(self.pgm_data['commands'])} command blocks.")
+        elif kind == "progress":
+            _, done, total, segments = event
+            if self.worker is not None and not self.worker.paused:
+                self.update_status(f"Running program... {done}/{total} commands")
+            if segments != self.done_segments:
+                self.done_segments = segments
+                # Throttled rather than debounced, so the path grows while events keep coming.
+                if self.refresh_job is None:
+                    self.refresh_job = self.root.after(FRAME_MS, self.draw_toolpath)
+        elif kind == "finished":
+            self.stop_worker("Program finished.")
+        elif kind == "cancelled":
+            self.stop_worker("Cancelled.")
+        elif kind == "error":
+            self.stop_worker("Error.")
+            messagebox.showerror("Error", event[1])
+
+    def reset_playback(self):
+        self.stop_playback()
+        program = self.pgm_data["commands"]
+        self.playback = Playback(get_timeline(program), SPEEDS[self.speed_var.get()])
+        duration = self.playback.timeline.duration
+        state = tk.NORMAL if duration > 0 else tk.DISABLED
+        self.play_button.config(state=state, text="Play")
+        self.scrubber.config(to=max(duration, 0.001), resolution=max(duration, 0.001) / 1000, state=state)
+        self.show_playback_time()
+
+    def toggle_playback(self):
+        if self.playback is None:
+            return
+        if self.playback.playing:
+            self.stop_playback()
+        else:
+            self.playback.play()
+            self.play_button.config(text="Stop")
+            self.last_tick = time.perf_counter()
+            self.play_job = self.root.after(FRAME_MS, self.playback_tick)
+
+    def stop_playback(self):
+        if self.playback is not None:
+            self.playback.pause()
+        if self.play_job is not None:
+            self.root.after_cancel(self.play_job)
+            self.play_job = None
+        self.play_button.config(text="Play")
+
+    def set_speed(self, name):
+        if self.playback is not None:
+            self.playback.speed = SPEEDS[name]
+
+    def playback_tick(self):
+        """ One animation frame: advance the fixed-step clock by the elapsed wall time. """
+        now = time.perf_counter()
+        if self.playback.advance(now - self.last_tick):
+            self.show_playback_time()
+        self.last_tick = now
+        if self.playback.playing:
+            self.play_job = self.root.after(FRAME_MS, self.playback_tick)
+        else:
+            self.play_job = None
+            self.play_button.config(text="Play")
+
+    def scrub(self, value):
+        # Tk also reports our own scrubber.set() calls (rounded to the resolution); skip those.
+        if self.playback is None or abs(float(value) - self.playback.time) <= self.scrubber.cget("resolution"):
+            return
+        self.playback.seek(float(value))
+        self.show_playback_time(move_scrubber=False)
+
+    def show_playback_time(self, move_scrubber=True):
+        """ Moves the tool head marker (and the scrubber) to the playback time. """
+        playback = self.playback
+        if move_scrubber:
+            self.scrubber.set(playback.time)
+        self.draw_tool_head()
+        if playback.timeline.duration > 0:
+            _, n = playback.timeline.position(playback.time)
+            block = playback.timeline.toolpath.blocks[n]
+            line = self.pgm_data["commands"].block_lines[block]
+            self.update_status(f"{playback.time:.1f} / {playback.timeline.duration:.1f} s, line {line}")
+
+    def go_to_block(self):
+        """ Seeks to the block number entered: restores the machine state
+        before it from the checkpoints and moves the playback to its start.
+        """
+        if not self.pgm_data or self.worker is not None:
+            return
+        program = self.pgm_data["commands"]
+        try:
+            block = int(self.block_var.get()) - 1
+        except ValueError:
+            self.update_status("Enter a block number.")
+            return
+        if not 0 <= block < len(program):
+            self.update_status(f"No block #{block + 1} (the program has {len(program)} blocks).")
+            return
+        get_checkpoints(program, envelope=self.machine.envelope).seek(self.machine, block)
+        self.start_block = block
+        if self.playback is not None and self.playback.timeline.duration > 0:
+            timeline = self.playback.timeline
+            n = bisect_left(timeline.toolpath.blocks, block)
+            self.stop_playback()
+            self.playback.seek(timeline.ends[n - 1] if n else 0.0)
+            self.scrubber.set(self.playback.time)
+            self.draw_tool_head()
+        state = self.machine.snapshot()
+        self.update_status(f"Block #{block + 1} (line {program.block_lines[block]}) at "
+                           f"X={state.x:.3f} Y={state.y:.3f} Z={state.z:.3f}; Run Program starts here.")
+
+    def draw_tool_head(self):
+        self.canvas.delete("head")
+        if self.playback is None or self.scene is None:
+            return
+        point, _ = self.playback.timeline.position(self.playback.time)
+        if point is None:
+            return
+        x, y = self.view().to_view(point[0], point[1])
+        self.canvas.create_oval(x - 6, y - 6, x + 6, y + 6, outline="red", width=2, tags="head")
+
+    def show_stats(self):
+        """ Opens (or refreshes) the statistics panel. """
+        if self.stats_text is None or not self.stats_text.winfo_exists():
+            window = tk.Toplevel(self.root)
+            window.title("Profile")
+            self.stats_text = tk.Text(window, width=70, height=30, font="TkFixedFont")
+            self.stats_text.pack(fill=tk.BOTH, expand=True)
+            tk.Button(window, text="Refresh", command=self.show_stats).pack(pady=5)
+        if self.profiler is None:
+            report = ["Profiling is off. Check 'Profile', then load or run a program."]
+        else:
+            report = self.profiler.report()
+        self.stats_text.delete("1.0", tk.END)
+        self.stats_text.insert(tk.END, "\n".join(report))
+
+    def view(self):
+        return ViewTransform(self.bounds["x_min"], self.bounds["y_min"], self.scale_factor,
+                             self.canvas_offset["x"], self.canvas_offset["y"])
+
+    def draw_toolpath(self):
+        """ Draws the visible part of the toolpath at the current level of detail. """
+        self.refresh_job = None
+        self.canvas.delete("all")
+        if self.scene is None:
+            return
+        with phase(self.profiler, "render"):
+            self.render_scene()
+
+    def render_scene(self):
+        view = self.view()
+        width = max(self.canvas.winfo_width(), 2)
+        height = max(self.canvas.winfo_height(), 2)
+
+        for coords in self.scene.polylines(view, width, height, self.done_segments):
+            self.canvas.create_line(*coords, fill="steel blue", width=2)
+        for x, y in self.scene.markers(view, width, height):
+            self.canvas.create_oval(x - 3, y - 3, x + 3, y + 3, fill="brown4")  # Mark position
+        if self.playback is not None and self.playback.time > 0:
+            self.draw_tool_head()
+
+    def schedule_redraw(self, delay=50):
+        """ Re-renders once interaction pauses; until then the canvas transforms give instant feedback. """
+        if self.refresh_job is not None:
+            self.root.after_cancel(self.refresh_job)
+        self.refresh_job = self.root.after(delay, self.draw_toolpath)
+
+    def zoom_in(self):
+        self.zoom(1.2)
+
+    def zoom_out(self):
+        self.zoom(1 / 1.2)
+
+    def zoom(self, factor):
+        # Scaling about the offset point keeps view() consistent with the drawn items.
+        self.scale_factor *= factor
+        self.canvas.scale("all", self.canvas_offset["x"], self.canvas_offset["y"], factor, factor)
+        self.schedule_redraw()
+
+    def move_canvas(self, dx, dy):
+        self.canvas_offset["x"] += dx
+        self.canvas_offset["y"] += dy
+        self.canvas.move("all", dx, dy)
+        self.schedule_redraw()
+
+if __name__ == "__main__":
+    root = tk.Tk()
+    root.rowconfigure(0, weight=1)
+    root.columnconfigure(1, weight=1)
+    app = CNCVisualizer(root)
     root.mainloop()
\ No newline at end of file
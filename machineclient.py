@@ -1,3 +1,7 @@
+from arcs import arc_center, arc_points, ArcError, PLANE_AXES, PLANE_OFFSETS, DEFAULT_TOLERANCE
+from estimator import estimate_program, DEFAULT_LIMITS
+from sinks import TextSink, DEBUG, INFO, ERROR
+
 # Constant value definitions for parameters.
 UNDEFINED = 0
 PLANE_XY = 1
@@ -31,18 +35,45 @@ NAMES = [
 ]
 
 
+class MachineState:
+    """ Snapshot of the mutable state of a MachineClient (see
+    MachineClient.snapshot() and restore()); spindle_on is None until a
+    spindle mode was set.
+    """
+    __slots__ = ("plane", "x", "y", "z", "tool_name", "spindle_active", "spindle_speed", "spindle_mode",
+                 "spindle_on", "feed_rate", "feed_mode", "coolant_on", "unit", "dist_mode", "motion_mode")
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "MachineState(" + ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__) + ")"
+
+
 class MachineClient:
-    _plane = UNDEFINED
-    _pos = {"x": 0.0, "y": 0.0, "z": 0.0}
-    _tool_name = ""
-    _spindle_params = {"is_active": False, "speed": 0, "mode": UNDEFINED}
-    _feed_rate_params = {"rate": 0, "mode": UNDEFINED}
-    _coolant_on = False
-    _unit = UNDEFINED
-    _dist_mode = UNDEFINED
-    _motion_mode = UNDEFINED
-
-    def __init__(self):
+    def __init__(self, sink=None, limits=None, arc_tolerance=DEFAULT_TOLERANCE, envelope=None):
+        """ Args:
+          sink: event sink receiving status messages (see sinks.py),
+            defaults to printing them as text
+          limits (MotionLimits): kinematic limits for estimate_time()
+          arc_tolerance (float): max chord error of interpolated arcs [mm]
+          envelope (collision.Box): soft limits; moves ending outside are refused
+        """
+        self.sink = sink if sink is not None else TextSink()
+        self.limits = limits or DEFAULT_LIMITS
+        self.arc_tolerance = arc_tolerance
+        self.envelope = envelope
+        # Machine state is per instance, so several clients (e.g. batch runs) never share it.
+        self._plane = UNDEFINED
+        self._pos = {"x": 0.0, "y": 0.0, "z": 0.0}
+        self._tool_name = ""
+        self._spindle_params = {"is_active": False, "speed": 0, "mode": UNDEFINED}
+        self._feed_rate_params = {"rate": 0, "mode": UNDEFINED}
+        self._coolant_on = False
+        self._unit = UNDEFINED
+        self._dist_mode = UNDEFINED
+        self._motion_mode = UNDEFINED
         self.statusprint("CNC machine initializing.")
 
     def __del__(self):
@@ -53,40 +84,25 @@ class MachineClient:
         self._motion_mode = MOTION_MODE_RAPID
 
         if params is None:
-            self.statusprint("Setting motion mode to {}".format(NAMES[self._motion_mode]))
+            self.statusprint("Setting motion mode to {}", NAMES[self._motion_mode])
             return
 
-        new_x = self._pos["x"]
-        new_y = self._pos["y"]
-        new_z = self._pos["z"]
-
-        for par in params:
-            if par[0] == "X":
-                new_x = float(par[1: len(par)])
-            if par[0] == "Y":
-                new_y = float(par[1: len(par)])
-            if par[0] == "Z":
-                new_z = float(par[1: len(par)])
+        new_x = params.get("X", self._pos["x"])
+        new_y = params.get("Y", self._pos["y"])
+        new_z = params.get("Z", self._pos["z"])
 
         self.move(new_x, new_y, new_z)
 
     def lin_move(self, params):
         self._motion_mode = MOTION_MODE_LINEAR
         if (params is None):
-            self.statusprint("Setting motion mode to {}".format(NAMES[self._motion_mode]))
+            self.statusprint("Setting motion mode to {}", NAMES[self._motion_mode])
             return
-        new_x = self._pos["x"]
-        new_y = self._pos["y"]
-        new_z = self._pos["z"]
-        for par in params:
-            if par[0] == "F":
-                self.set_feed_rate(float(par[1: len(par)]))
-            if par[0] == "X":
-                new_x = float(par[1: len(par)])
-            if par[0] == "Y":
-                new_y = float(par[1: len(par)])
-            if par[0] == "Z":
-                new_z = float(par[1: len(par)])
+        if "F" in params:
+            self.set_feed_rate(params.get("F"))
+        new_x = params.get("X", self._pos["x"])
+        new_y = params.get("Y", self._pos["y"])
+        new_z = params.get("Z", self._pos["z"])
         self.move(new_x, new_y, new_z)
 
     def arc_move(self, params, clockwise):
@@ -95,60 +111,56 @@ class MachineClient:
             return
 
         # Extract parameters
-        x = self._pos["x"]
-        y = self._pos["y"]
-        z = self._pos["z"]
-        i = j = r = None  # Arc center offsets or radius
-        for param in params:
-            if param[0] == "X":
-                x = float(param[1:])
-            elif param[0] == "Y":
-                y = float(param[1:])
-            elif param[0] == "Z":
-                z = float(param[1:])
-            elif param[0] == "I":
-                i = float(param[1:])
-            elif param[0] == "J":
-                j = float(param[1:])
-            elif param[0] == "R":
-                r = float(param[1:])
-
-        # Calculate center
-        if i is not None and j is not None:
-            cx = self._pos["x"] + i
-            cy = self._pos["y"] + j
-        elif r is not None:
-            raise NotImplementedError("Radius-based arc not implemented yet.")
+        start = (self._pos["x"], self._pos["y"], self._pos["z"])
+        if self._dist_mode == DIST_MODE_INC:
+            end = (start[0] + params.get("X", 0.0), start[1] + params.get("Y", 0.0), start[2] + params.get("Z", 0.0))
         else:
-            self.statusprint("Error: Arc move requires either I/J or R parameters.")
+            end = (params.get("X", start[0]), params.get("Y", start[1]), params.get("Z", start[2]))
+        plane = self._plane if self._plane in PLANE_AXES else PLANE_XY
+        first, second = PLANE_OFFSETS[plane]
+
+        # Calculate center from the plane's offset words (e.g. I/J) or the radius
+        try:
+            center = arc_center(start, end, plane, clockwise,
+                                (params.get(first), params.get(second)), params.get("R"))
+        except ArcError as err:
+            self.statusprint("Error: Arc move requires center offsets or an R parameter ({}).", err, level=ERROR)
+            return
+        if not self.within_limits(*end):
             return
 
         # Perform arc movement
-        self.statusprint(
-            f"Moving in an {'clockwise' if clockwise else 'counter-clockwise'} arc to X={x}, Y={y} with center ({cx}, {cy}).")
-        self._pos.update({"x": x, "y": y, "z": z})
+        points = arc_points(start, end, center, plane, clockwise, self.arc_tolerance)
+        self.statusprint("Moving in an {} arc in the {} plane to X={:.3f} Y={:.3f} Z={:.3f} "
+                         "with center ({:.3f}, {:.3f}, {:.3f}) in {} segments.",
+                         "clockwise" if clockwise else "counter-clockwise", NAMES[plane],
+                         *end, *center, len(points))
+        if self.sink.level <= DEBUG:
+            for px, py, pz in points:
+                self.statusprint("Arc point X={:.3f} Y={:.3f} Z={:.3f}.", px, py, pz, level=DEBUG)
+        self._pos.update({"x": end[0], "y": end[1], "z": end[2]})
 
     def set_plane_xy(self, params={}):
         self._plane = PLANE_XY
-        self.statusprint("Plane set to {}".format(NAMES[self._plane]))
+        self.statusprint("Plane set to {}", NAMES[self._plane])
 
     def set_plane_zx(self, params={}):
         self._plane = PLANE_ZX
-        self.statusprint("Plane set to {}".format(NAMES[self._plane]))
+        self.statusprint("Plane set to {}", NAMES[self._plane])
 
     def set_plane_yz(self, params={}):
         self._plane = PLANE_YZ
-        self.statusprint("Plane set to {}".format(NAMES[self._plane]))
+        self.statusprint("Plane set to {}", NAMES[self._plane])
 
     def set_unit_mm(self, params={}):
         self._unit = UNIT_MM
-        self.statusprint("Unit of measure set to {}"
-                         .format(NAMES[self._unit]))
+        self.statusprint("Unit of measure set to {}",
+                         NAMES[self._unit])
 
     def set_unit_inch(self, params={}):
         self._unit = UNIT_INCH
-        self.statusprint("Unit of measure set to {}"
-                         .format(NAMES[self._unit]))
+        self.statusprint("Unit of measure set to {}",
+                         NAMES[self._unit])
 
     def set_cutter_comp_off(self, params={}):
         self.statusprint("Cutter compensation turned OFF")
@@ -163,48 +175,50 @@ class MachineClient:
 
     def set_feed_rate_mode_upmin(self, params={}):
         self._feed_rate_params["mode"] = FEED_MODE_UPMIN
-        self.statusprint("Feed rate mode set to {}"
-                         .format(NAMES[self._feed_rate_params["mode"]]))
+        self.statusprint("Feed rate mode set to {}",
+                         NAMES[self._feed_rate_params["mode"]])
 
     def set_feed_rate_mode_invtime(self, params={}):
         self._feed_rate_params["mode"] = FEED_MODE_INVTIME
-        self.statusprint("Feed rate mode set to {}"
-                         .format(NAMES[self._feed_rate_params["mode"]]))
+        self.statusprint("Feed rate mode set to {}",
+                         NAMES[self._feed_rate_params["mode"]])
 
     def set_feed_rate_mode_uprev(self, params={}):
         self._feed_rate_params["mode"] = FEED_MODE_UPREV
-        self.statusprint("Feed rate mode set to UNITS/REVOLUTION"
-                         .format(self._feed_rate_params["mode"]))
+        self.statusprint("Feed rate mode set to UNITS/REVOLUTION")
 
     def home(self, params):
+        if params is None:
+            params = {}
+
         if self._motion_mode == DIST_MODE_INC:
-            for par in params:
-                amount = float(par[1: len(par)])
-                if par[0] == "X":
+            for axis in params:
+                amount = params.get(axis)
+                if axis == "X":
                     self.move_x(self._pos["x"] + amount)
-                if par[0] == "Y":
+                if axis == "Y":
                     self.move_y(self._pos["y"] + amount)
-                if par[0] == "Z":
+                if axis == "Z":
                     self.move_z(self._pos["z"] + amount)
 
         elif (self._motion_mode == DIST_MODE_ABS):
-            for par in params:
-                amount = float(par[1: len(par)])
-                if par[0] == "X":
+            for axis in params:
+                amount = params.get(axis)
+                if axis == "X":
                     self.move_x(amount)
-                if par[0] == "Y":
+                if axis == "Y":
                     self.move_y(amount)
-                if par[0] == "Z":
+                if axis == "Z":
                     self.move_z(amount)
 
         # Homing.
         self.statusprint("Moving selected axes to home.")
-        for par in params:
-            if par[0] == "Z":
+        for axis in params:
+            if axis == "Z":
                 self.move_z(0.0)
-            if par[0] == "X":
+            if axis == "X":
                 self.move_x(0.0)
-            if par[0] == "Y":
+            if axis == "Y":
                 self.move_y(0.0)
 
     def move(self, x, y, z):
@@ -219,16 +233,19 @@ class MachineClient:
             new_z = z
 
         else:
-            self.statusprint("move(): Error, distance mode not set.")
+            self.statusprint("move(): Error, distance mode not set.", level=ERROR)
+            return
+
+        if not self.within_limits(new_x, new_y, new_z):
             return
 
-        self.statusprint("Moving to X={:.3f} Y={:.3f} Z={:.3f} [{}]."
-                         .format(new_x, new_y, new_z, NAMES[self._unit]))
+        self.statusprint("Moving to X={:.3f} Y={:.3f} Z={:.3f} [{}].",
+                         new_x, new_y, new_z, NAMES[self._unit])
 
         if self._motion_mode == MOTION_MODE_LINEAR:
             rate = self._feed_rate_params["rate"]
             mode = self._feed_rate_params["mode"]
-            self.statusprint("Using feed rate F={:.3f} {}".format(rate, NAMES[mode]))
+            self.statusprint("Using feed rate F={:.3f} {}", rate, NAMES[mode])
 
         if (new_z >= self._pos["z"]):
             # Mill bit must raise before changing position.
@@ -247,19 +264,27 @@ class MachineClient:
             if abs(new_z - self._pos["z"]) >= 0.001:
                 self.move_z(new_z)
 
+    def within_limits(self, x, y, z):
+        """ Checks a target position against the soft limits, reporting a violation. """
+        if self.envelope is None or self.envelope.contains(x, y, z):
+            return True
+        self.statusprint("Error: soft limit, X={:.3f} Y={:.3f} Z={:.3f} is outside the machine envelope.",
+                         x, y, z, level=ERROR)
+        return False
+
     def move_x(self, value):
-        self.statusprint("Moving X to {:.3f} [{}]."
-                         .format(value, NAMES[self._unit]))
+        self.statusprint("Moving X to {:.3f} [{}].",
+                         value, NAMES[self._unit], level=DEBUG)
         self._pos["x"] = value
 
     def move_y(self, value):
-        self.statusprint("Moving Y to {:.3f} [{}]."
-                         .format(value, NAMES[self._unit]))
+        self.statusprint("Moving Y to {:.3f} [{}].",
+                         value, NAMES[self._unit], level=DEBUG)
         self._pos["y"] = value
 
     def move_z(self, value):
-        self.statusprint("Moving Z to {:.3f} [{}]."
-                         .format(value, NAMES[self._unit]))
+        self.statusprint("Moving Z to {:.3f} [{}].",
+                         value, NAMES[self._unit], level=DEBUG)
         self._pos["z"] = value
 
     def set_feed_rate(self, value):
@@ -268,7 +293,7 @@ class MachineClient:
         value (float): Feed rate [mm/s]
         """
         if self._feed_rate_params["mode"] == UNDEFINED:
-            self.statusprint("set_feed_rate(): Error, unknown feed rate mode.")
+            self.statusprint("set_feed_rate(): Error, unknown feed rate mode.", level=ERROR)
             return
 
         # "Official" CNC feed rate is units/min
@@ -276,37 +301,37 @@ class MachineClient:
             self._feed_rate_params["rate"] = value * 60.0
 
         else:
-            self.statusprint("set_feed_rate(): Error, feed rate mode not implemented.")
+            self.statusprint("set_feed_rate(): Error, feed rate mode not implemented.", level=ERROR)
             return
 
     def set_spindle_speed(self, value):
         if (value < 0):
-            self.statusprint("set_spindle_speed(): Error, speed must be non-negative.")
+            self.statusprint("set_spindle_speed(): Error, speed must be non-negative.", level=ERROR)
             return
 
         self._spindle_params["speed"] = value
-        self.statusprint("Using spindle speed {} [rpm].".format(value))
+        self.statusprint("Using spindle speed {} [rpm].", value)
 
     def set_spindle_mode_cw(self, params={}):
         self._spindle_params["mode"] = SPINDLE_MODE_CW
         self._spindle_params["state"] = True
 
-        self.statusprint("Setting spindle mode to {}"
-                         .format(NAMES[self._spindle_params["mode"]]))
+        self.statusprint("Setting spindle mode to {}",
+                         NAMES[self._spindle_params["mode"]])
 
     def set_spindle_mode_ccw(self, params={}):
         self._spindle_params["mode"] = SPINDLE_MODE_CCW
         self._spindle_params["state"] = True
 
-        self.statusprint("Setting spindle mode to {}"
-                         .format(NAMES[self._spindle_params["mode"]]))
+        self.statusprint("Setting spindle mode to {}",
+                         NAMES[self._spindle_params["mode"]])
 
     def set_spindle_mode_halt(self, params={}):
         self._spindle_params["mode"] = SPINDLE_MODE_HALT
         self._spindle_params["state"] = False
 
-        self.statusprint("Setting spindle mode to {}"
-                         .format(NAMES[self._spindle_params["mode"]]))
+        self.statusprint("Setting spindle mode to {}",
+                         NAMES[self._spindle_params["mode"]])
 
     def set_dist_mode_abs(self, params={}):
         """ Sets distance mode to absolute.
@@ -314,33 +339,33 @@ class MachineClient:
           params (dict): unused
         """
         self._dist_mode = DIST_MODE_ABS
-        self.statusprint("Setting distance mode to {}"
-                         .format(NAMES[self._dist_mode]))
+        self.statusprint("Setting distance mode to {}",
+                         NAMES[self._dist_mode])
 
     def set_dist_mode_inc(self, params={}):
         self._dist_mode = DIST_MODE_INC
-        self.statusprint("Setting distance mode to {}"
-                         .format(NAMES[self._dist_mode]))
+        self.statusprint("Setting distance mode to {}",
+                         NAMES[self._dist_mode])
 
     def set_coord_system(self, num):
-        self.statusprint("Selecting coordinate system #{}".format(num))
+        self.statusprint("Selecting coordinate system #{}", num)
 
     def change_tool(self, tool_name):
         self._tool_name = tool_name
-        self.statusprint("Changing tool '{:s}'.".format(self._tool_name))
+        self.statusprint("Changing tool '{:s}'.", self._tool_name)
 
-    def manual_tool_change(self):
-        self.statusprint("Manual tool change to '{}' requested".format(self._tool_name))
+    def manual_tool_change(self, params={}):
+        self.statusprint("Manual tool change to '{}' requested", self._tool_name)
 
-    def coolant_on(self):
+    def coolant_on(self, params={}):
         self.statusprint("Coolant turned on.")
-        _coolant_on = True
+        self._coolant_on = True
 
-    def coolant_off(self):
+    def coolant_off(self, params={}):
         self.statusprint("Coolant turned off.")
-        _coolant_on = False
+        self._coolant_on = False
 
-    def program_end(self):
+    def program_end(self, params={}):
         self.statusprint("Program end reached.")
         self.set_coord_system(1)
         self.set_plane_xy()
@@ -350,6 +375,48 @@ class MachineClient:
         self.lin_move(None)
         self.coolant_off()
 
-    def statusprint(self, message):
-        print(4 * "-" + "> ", end="")
-        print(message)
+    def estimate_time(self, program):
+        """ Estimator mode: computes per-block and total machining time of a
+        compiled Program from its segment arrays, without executing it.
+        Returns the Estimate.
+        """
+        estimate = estimate_program(program, self.limits)
+        if self.sink.level <= DEBUG:
+            for block, seconds in estimate.block_times().items():
+                self.statusprint("Block #{} (line {}): {:.3f} s", block + 1, program.block_lines[block], seconds,
+                                 level=DEBUG)
+        minutes, seconds = divmod(estimate.total, 60.0)
+        self.statusprint("Estimated machining time {:.0f} min {:.1f} s ({} segments).",
+                         minutes, seconds, len(estimate.times))
+        return estimate
+
+    def snapshot(self):
+        """ Returns the current machine state as a MachineState. """
+        pos, spindle, feed = self._pos, self._spindle_params, self._feed_rate_params
+        return MachineState(self._plane, pos["x"], pos["y"], pos["z"], self._tool_name,
+                            spindle["is_active"], spindle["speed"], spindle["mode"], spindle.get("state"),
+                            feed["rate"], feed["mode"], self._coolant_on, self._unit, self._dist_mode,
+                            self._motion_mode)
+
+    def restore(self, state):
+        """ Puts the machine into a state taken by snapshot(), silently. """
+        self._plane = state.plane
+        self._pos = {"x": state.x, "y": state.y, "z": state.z}
+        self._tool_name = state.tool_name
+        self._spindle_params = {"is_active": state.spindle_active, "speed": state.spindle_speed,
+                                "mode": state.spindle_mode}
+        if state.spindle_on is not None:
+            self._spindle_params["state"] = state.spindle_on
+        self._feed_rate_params = {"rate": state.feed_rate, "mode": state.feed_mode}
+        self._coolant_on = state.coolant_on
+        self._unit = state.unit
+        self._dist_mode = state.dist_mode
+        self._motion_mode = state.motion_mode
+
+    def statusprint(self, message, *args, level=INFO):
+        """ Sends a status message to the sink. The message is only formatted
+        (with str.format and args) if the sink accepts the level.
+        """
+        if level < self.sink.level:
+            return
+        self.sink.emit(level, message.format(*args) if args else message)
@@ -1,185 +1,577 @@
+import argparse
+import contextlib
+import itertools
 import sys
+import time
+from array import array
+from bisect import bisect_left
 from machineclient import MachineClient as MC
+from program import (Program, Command, GCodeFormatError, OP_M, OP_T, OP_S,
+                     G00, G01, G02, G03, G17, G18, G19, G20, G21, G28, G90, G91, G93, G94)
+from sinks import make_sink, SINKS, LEVELS, INFO, ERROR
 
 
 def main(args):
-    if len(args) != 2:
+    if len(args) < 2:
         show_usage()
         return 1
 
-    print("args:", args)
-    pgm_data = {}
+    options = parse_args(args[1:])
+    if options.batch:
+        from batch import run_batch
+        return 1 if run_batch(options.batch, options.jobs, preview_dir=options.preview_dir) else 0
+    if options.filename is None and options.dnc is None:
+        show_usage()
+        return 1
 
+    sink = make_sink(options.log, options.log_level)
+    if options.log == "text":
+        print("args:", args)
+    if options.dnc is not None:
+        from dnc import run_dnc
+        try:
+            run_dnc(sink, options.dnc, options.lookahead)
+        except (OSError, GCodeFormatError, ValueError) as err:
+            print(f"Error: {err}")
+            return 1
+        finally:
+            finish_sink(sink)
+        return 0
+    pgm_data = {}
+    status = 0
+    profiler = None
+    if options.profile:
+        from profiler import Profiler
+        profiler = Profiler()
+
+    analyze = options.estimate or options.stock or options.preview or options.optimize or options.simplify
+    resume = options.start_block is not None or options.start_line is not None
     try:
-        with open(args[1]) as f:
-            parse_file(f, pgm_data)
+        checker = None
+        if options.check:
+            from collision import load_setup
+            checker = load_setup(options.check)
+        with open(options.filename) as f:
+            if options.cache:
+                from progcache import load_program
+                with phase(profiler, "load"):
+                    program = load_program(options.filename, pgm_data, options.cache)
+            elif options.parallel:
+                from parallel import parse_parallel
+                with phase(profiler, "parse"):
+                    program = parse_parallel(options.filename, pgm_data, options.jobs)
+            elif analyze or checker or resume:
+                with phase(profiler, "parse"):
+                    for _ in iter_blocks(f, pgm_data):
+                        pass
+                program = pgm_data["commands"]
+            if analyze or (checker and not resume):
+                if options.simplify:
+                    # The passes below then run on the reduced segment list.
+                    with phase(profiler, "simplify"):
+                        write_simplified(sink, program, options.simplify, options.tolerance, options.fit_arcs)
+                if checker:
+                    with phase(profiler, "check"):
+                        if not check_program(sink, program, checker):
+                            status = 1
+                if options.estimate:
+                    with phase(profiler, "estimate"):
+                        MC(sink).estimate_time(program)
+                if options.stock:
+                    with phase(profiler, "stock"):
+                        write_stock(sink, program, options.stock, options.tools)
+                if options.preview:
+                    from export import export_preview
+                    with phase(profiler, "preview"):
+                        export_preview(program, options.preview)
+                if options.optimize:
+                    with phase(profiler, "optimize"):
+                        write_optimized(sink, program, options.optimize)
+            elif resume:
+                # With --check, the machine refuses moves outside the setup's envelope.
+                run_from(sink, program, pgm_data, options.start_block, options.start_line, profiler,
+                         checker and checker.envelope)
+            elif options.cache or options.parallel:
+                run_compiled_program(program, pgm_data, sink, profiler)
+            elif options.mmap:
+                from mapped import MappedGCode
+                with MappedGCode(options.filename) as mapped:
+                    run_program(mapped.iter_blocks(pgm_data=pgm_data), pgm_data, sink, profiler)
+            else:
+                run_program(iter_blocks(f, pgm_data, keep=False), pgm_data, sink, profiler)
     except OSError as err:
         print(f"Error: {err}.")
         return 1
+    except (GCodeFormatError, ValueError) as err:
+        print(f"Error: {err}")
+        return 1
+    finally:
+        finish_sink(sink)
+        if profiler is not None:
+            print("\n".join(profiler.report()))
+
+    return status
+
+
+def parse_args(args):
+    from arcs import DEFAULT_TOLERANCE
+    from progcache import DEFAULT_CACHE_DIR
+    parser = argparse.ArgumentParser(prog="main.py", description="CNC G-code simulator.")
+    parser.add_argument("filename", nargs="?", help="G-code program to simulate")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="simulate all G-code files in directories / glob patterns, "
+                             "printing one JSON summary line per file")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes for --batch and --parallel (default: all cores)")
+    parser.add_argument("--estimate", action="store_true",
+                        help="only estimate the machining time (per block with --log-level debug)")
+    parser.add_argument("--stock", metavar="PGM",
+                        help="simulate material removal and write the stock heightmap as a PGM image")
+    parser.add_argument("--tools", metavar="TABLE",
+                        help="tool table for --stock, one '<tool number> <diameter>' per line")
+    parser.add_argument("--preview", metavar="IMAGE",
+                        help="write a toolpath preview image (.png or .svg) without opening a window")
+    parser.add_argument("--preview-dir", metavar="DIR",
+                        help="with --batch, write a PNG preview of every file into DIR")
+    parser.add_argument("--optimize", metavar="OUT",
+                        help="reorder the cutting features to minimize rapid travel and write the program to OUT")
+    parser.add_argument("--simplify", metavar="OUT",
+                        help="merge dense straight moves within --tolerance and write the program to OUT; "
+                             "the other analysis options then use the simplified toolpath")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, metavar="MM",
+                        help="max deviation of the simplified path (default: %(default)s mm)")
+    parser.add_argument("--fit-arcs", action="store_true",
+                        help="with --simplify, also replace circular stretches by G02/G03 arcs")
+    parser.add_argument("--check", metavar="SETUP",
+                        help="check the toolpath against the machine envelope and obstacles "
+                             "of a JSON setup file, reporting the first violating block; with "
+                             "--start-block/--start-line, run with the envelope as soft limits instead")
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_DIR, metavar="DIR",
+                        help="load the parsed program, toolpath and estimate from a cache keyed by the "
+                             "file content, storing them on the first run (default DIR: %(const)s)")
+    parser.add_argument("--parallel", action="store_true",
+                        help="parse the file in chunks on a process pool before running it")
+    parser.add_argument("--mmap", action="store_true",
+                        help="memory-map the file and parse it in chunks (bounded memory for huge programs)")
+    parser.add_argument("--start-block", type=int, metavar="N",
+                        help="start the simulation at block N (1-based), restoring the machine state "
+                             "from checkpoints instead of reporting the blocks before it")
+    parser.add_argument("--start-line", type=int, metavar="LINE",
+                        help="start the simulation at the first block on or after a source line")
+    parser.add_argument("--dnc", metavar="SOURCE",
+                        help="simulate a DNC drip-feed: execute G-code as it arrives on stdin ('-') or on "
+                             "connections to [HOST:]PORT, reporting block latency and buffer underruns")
+    parser.add_argument("--lookahead", type=int, default=256, metavar="LINES",
+                        help="with --dnc, lines buffered ahead of the executing block (default: %(default)s)")
+    parser.add_argument("--profile", action="store_true",
+                        help="report parse/execute time, per-opcode timings and block latencies")
+    parser.add_argument("--log", choices=SINKS, default="text",
+                        help="status output: text (default), buffered, structured or silent")
+    parser.add_argument("--log-level", choices=LEVELS, default=None,
+                        help="minimum level of status messages to report")
+    options = parser.parse_args(args)
+    if (options.start_block is not None or options.start_line is not None) and (
+            options.estimate or options.stock or options.preview or options.optimize or options.simplify):
+        parser.error("--start-block/--start-line cannot be combined with --estimate, --stock, --preview, "
+                     "--optimize or --simplify")
+    return options
+
+
+def finish_sink(sink):
+    """ Flushes buffered output, or summarizes a structured event log. """
+    if hasattr(sink, "flush"):
+        sink.flush()
+    elif hasattr(sink, "records"):
+        print(f"{len(sink.records)} events recorded.")
+        for message in sink.errors():
+            print(f"Error: {message}")
+
+
+def check_program(sink, program, checker):
+    """ Reports the first soft limit / collision violation; returns True if there is none. """
+    violation = checker.check_program(program)
+    if violation is None:
+        sink.emit(INFO, f"No collisions or soft limit violations in {len(program)} blocks.")
+        return True
+    sink.emit(ERROR, "Error: " + violation.describe(program))
+    return False
+
+
+def write_stock(sink, program, path, tool_table=None):
+    """ Runs the stock simulation, writes the heightmap image and reports the removed volume. """
+    from stock import ToolTable, simulate_stock
+    tools = ToolTable.load(tool_table) if tool_table else ToolTable()
+    heightmap = simulate_stock(program, tools)
+    with open(path, "wb") as f:
+        f.write(heightmap.shade())
+    sink.emit(INFO, f"Removed {heightmap.removed_volume():.1f} mm^3 of stock "
+                    f"({heightmap.nx}x{heightmap.ny} cells of {heightmap.cell:.3f} mm, image {path}).")
+
+
+def write_optimized(sink, program, path):
+    """ Writes the program with its features reordered for less rapid travel and reports the savings. """
+    from optimizer import optimize_program
+    text, report = optimize_program(program)
+    with open(path, "w") as f:
+        f.write(text)
+    for line in report.lines():
+        sink.emit(INFO, line)
+    sink.emit(INFO, f"Optimized program written to {path}.")
+
+
+def write_simplified(sink, program, path, tolerance, fit_arcs=False):
+    """ Writes the program with its dense straight moves simplified, reports
+    the reductions and makes the program use the simplified toolpath.
+    """
+    from simplify import simplify_program, use_toolpath
+    text, report = simplify_program(program, tolerance, fit_arcs)
+    with open(path, "w") as f:
+        f.write(text)
+    for line in report.lines():
+        sink.emit(INFO, line)
+    sink.emit(INFO, f"Simplified program written to {path}.")
+    use_toolpath(program, report.toolpath)
+
+
+def run_from(sink, program, pgm_data, start_block=None, start_line=None, profiler=None, envelope=None):
+    """ Runs a Program from a mid-program block (1-based) or source line;
+    the machine state before it comes from a CheckpointIndex.
+    Args:
+      envelope (collision.Box): soft limits of the machine, if any
+    """
+    from checkpoints import get_checkpoints, block_at_line
+    block = start_block - 1 if start_block is not None else block_at_line(program, start_line)
+    if not 0 <= block < len(program):
+        raise ValueError(f"no block to start from (the program has {len(program)} blocks)")
+    machine = MC(sink, envelope=envelope)
+    with phase(profiler, "seek"):
+        get_checkpoints(program, envelope=envelope).seek(machine, block)
+    state = machine.snapshot()
+    sink.emit(INFO, f"Starting at block #{block + 1} (line {program.block_lines[block]}) "
+                    f"at X={state.x:.3f} Y={state.y:.3f} Z={state.z:.3f}.")
+    run_compiled_program(program, pgm_data, sink, profiler, machine, block)
+
+
+def phase(profiler, name):
+    """ Times a phase if profiling, else does nothing. """
+    return profiler.phase(name) if profiler is not None else contextlib.nullcontext()
+
+
+def run_program(blocks, pgm_data, sink=None, profiler=None, machine=None, first=1):
+    """ Executes blocks as they are produced by the parser.
+    Args:
+      blocks (iterable): command blocks, e.g. from iter_blocks()
+      pgm_data (dict): program info filled in while parsing
+      sink: event sink for all output (default: text on stdout)
+      profiler (Profiler): if given, collects parse/execute timings
+      machine (MachineClient): machine to run on, e.g. one put into a
+        mid-program state by checkpoints.py (default: a new one on sink)
+      first (int): number of the first block, for the block messages
+    """
+    machine = machine if machine is not None else MC(sink)
+    verbose = machine.sink.level <= INFO
+    if profiler is not None:
+        blocks = profiler.timed_iter(blocks, "parse")
+
+    for i, block in enumerate(blocks, start=first):
+        if verbose:
+            if i == first:
+                display_program_info(machine.sink, pgm_data)
+            display_block_info(machine.sink, i, block)
+        if profiler is None:
+            execute_block(machine, block, verbose)
+        else:
+            execute_block_profiled(machine, block, verbose, profiler)
+
+    if verbose:
+        machine.sink.emit(INFO, f"\nProgram finished (total {pgm_data.get('num_commands', 0)} commands).",
+                          status=False)
+
+
+def run_compiled_program(program, pgm_data, sink=None, profiler=None, machine=None, start=0):
+    """ Executes a whole parsed Program, compiled once into a call list
+    (see compile_program()) instead of dispatching every command.
+    Args:
+      program (Program): the parsed program
+      pgm_data (dict): program info filled in while parsing
+      sink: event sink for all output (default: text on stdout)
+      profiler (Profiler): if given, collects compile/execute timings
+      machine (MachineClient): machine to run on (default: a new one on sink)
+      start (int): index of the first block to execute
+    """
+    from profiler import run_compiled_profiled
+    machine = machine if machine is not None else MC(sink)
+    verbose = machine.sink.level <= INFO
+    rows = array("L")
+    with phase(profiler, "compile"):
+        compiled = compile_program(program, machine, rows)
+    starts = program.block_starts
+    begin = bisect_left(rows, starts[start]) if start < len(program) else len(compiled)
+
+    if not verbose:
+        if profiler is None:
+            run_compiled(itertools.islice(compiled, begin, None))
+        else:
+            run_compiled_profiled(profiler, compiled, rows, program, begin)
+        return
 
-    run_program(pgm_data)
-    return 0
-
-
-def run_program(pgm_data):
-    machine = MC()
-    display_program_info(pgm_data)
-
-    for i, block in enumerate(pgm_data["commands"], start=1):
-        display_block_info(i, block)
-        execute_block(machine, block)
-
-
-def display_program_info(pgm_data):
-    print(f"Running the G-code program #{pgm_data['pgm_num']} "
-          f"(total {pgm_data['num_commands']} commands).\n")
-
-
-def display_block_info(i_block, block):
+    clock = time.perf_counter
+    i, total = begin, len(compiled)
+    for b in range(start, len(program)):
+        block = program[b]
+        if b == start:
+            display_program_info(machine.sink, pgm_data)
+        display_block_info(machine.sink, b + 1, block)
+        block_start = clock()
+        for k in range(starts[b], starts[b + 1]):
+            machine.sink.emit(INFO, repr(Command(program, k)), status=False)
+            while i < total and rows[i] == k:
+                method, args = compiled[i]
+                t0 = clock()
+                method(*args)
+                if profiler is not None:
+                    profiler.add_op(program.ops[k], clock() - t0)
+                i += 1
+        if profiler is not None:
+            elapsed = clock() - block_start
+            profiler.blocks.add(elapsed)
+            profiler.add_phase("execute", elapsed)
+    machine.sink.emit(INFO, f"\nProgram finished (total {pgm_data.get('num_commands', 0)} commands).",
+                      status=False)
+
+
+def display_program_info(sink, pgm_data):
+    sink.emit(INFO, f"Running the G-code program #{pgm_data.get('pgm_num', '-')}.\n", status=False)
+
+
+def display_block_info(sink, i_block, block):
     command_count = len(block)
-    print(f"Executing code block #{i_block} ({command_count} command{'s' if command_count > 1 else ''})")
-    print("-" * 50)
+    sink.emit(INFO, f"Executing code block #{i_block} ({command_count} command{'s' if command_count > 1 else ''})",
+              status=False)
+    sink.emit(INFO, "-" * 50, status=False)
 
 
-def execute_block(machine, block):
+def execute_block(machine, block, verbose=True):
     for command in block:
-        print(command)
+        if verbose:
+            machine.sink.emit(INFO, repr(command), status=False)
         execute_command(machine, command)
 
 
-def execute_command(machine, cmd_data):
-    command_map = {
-        "G": handle_g_command,
-        "M": handle_m_command,
-        "T": handle_t_command,
-        "S": handle_s_command,
-    }
-
-    cmd = cmd_data["cmd"]
-    cmd_num = cmd[1:]
-
-    handler = command_map.get(cmd[0])
-    if handler:
-        handler(machine, cmd_num, cmd_data.get("params"))
-    else:
-        print(f"Unknown command {cmd}")
-
-
-def handle_g_command(machine, cmd_num, params):
-    G_COMMANDS = {
-        "00": machine.rapid_move,
-        "01": machine.lin_move,
-        "02": lambda p: machine.arc_move(p, clockwise=True),
-        "03": lambda p: machine.arc_move(p, clockwise=False),
-        "17": machine.set_plane_xy,
-        "18": machine.set_plane_zx,
-        "19": machine.set_plane_yz,
-        "20": machine.set_unit_inch,
-        "21": machine.set_unit_mm,
-        "28": machine.home,
-        "40": machine.set_cutter_comp_off,
-        "49": machine.cancel_tool_length_comp,
-        "54": machine.set_coord_system,
-        "55": machine.set_coord_system,
-        "56": machine.set_coord_system,
-        "57": machine.set_coord_system,
-        "58": machine.set_coord_system,
-        "59": machine.set_coord_system,
-        "80": machine.cancel_canned_cycle,
-        "90": machine.set_dist_mode_abs,
-        "91": machine.set_dist_mode_inc,
-        "93": machine.set_feed_rate_mode_invtime,
-        "94": machine.set_feed_rate_mode_upmin,
-        "95": machine.set_feed_rate_mode_uprev,
-    }
-    if cmd_num in G_COMMANDS:
-        G_COMMANDS[cmd_num](params)
-
-
-def handle_m_command(machine, cmd_num, params):
-    M_COMMANDS = {
-        "03": machine.set_spindle_mode_cw,
-        "04": machine.set_spindle_mode_ccw,
-        "05": machine.set_spindle_mode_halt,
-        "06": machine.manual_tool_change,
-        "07": machine.coolant_on,
-        "08": machine.coolant_on,
-        "09": machine.coolant_off,
-        "30": machine.program_end,
-    }
-    if cmd_num in M_COMMANDS:
-        M_COMMANDS[cmd_num](params)
-
-
-def handle_t_command(machine, cmd_num, params):
-    machine.change_tool(f"TOOL #{cmd_num}")
-
-
-def handle_s_command(machine, cmd_num, params):
-    machine.set_spindle_speed(int(cmd_num))
-
+def execute_block_profiled(machine, block, verbose, profiler):
+    """ execute_block() timing every command by opcode and the block as a whole. """
+    clock = time.perf_counter
+    block_start = clock()
+    for command in block:
+        if verbose:
+            machine.sink.emit(INFO, repr(command), status=False)
+        start = clock()
+        execute_command(machine, command)
+        profiler.add_op(command.op, clock() - start)
+    elapsed = clock() - block_start
+    profiler.blocks.add(elapsed)
+    profiler.add_phase("execute", elapsed)
+
+
+def _words(cmd):
+    """ Pre-decodes the words of a command into a dict (None if it has none). """
+    return (cmd.to_dict(),) if cmd else (None,)
+
+
+def _no_args(cmd):
+    return ()
+
+
+# Dispatch table: opcode -> (MachineClient method name, argument decoder).
+# Decoders turn a Command into the positional arguments of the method.
+DISPATCH = {
+    G00: ("rapid_move", _words),
+    G01: ("lin_move", _words),
+    G02: ("arc_move", lambda cmd: _words(cmd) + (True,)),
+    G03: ("arc_move", lambda cmd: _words(cmd) + (False,)),
+    G17: ("set_plane_xy", _no_args),
+    G18: ("set_plane_zx", _no_args),
+    G19: ("set_plane_yz", _no_args),
+    G20: ("set_unit_inch", _no_args),
+    G21: ("set_unit_mm", _no_args),
+    G28: ("home", _words),
+    40: ("set_cutter_comp_off", _no_args),
+    49: ("cancel_tool_length_comp", _no_args),
+    54: ("set_coord_system", lambda cmd: (1,)),
+    55: ("set_coord_system", lambda cmd: (2,)),
+    56: ("set_coord_system", lambda cmd: (3,)),
+    57: ("set_coord_system", lambda cmd: (4,)),
+    58: ("set_coord_system", lambda cmd: (5,)),
+    59: ("set_coord_system", lambda cmd: (6,)),
+    80: ("cancel_canned_cycle", _no_args),
+    G90: ("set_dist_mode_abs", _no_args),
+    G91: ("set_dist_mode_inc", _no_args),
+    G93: ("set_feed_rate_mode_invtime", _no_args),
+    G94: ("set_feed_rate_mode_upmin", _no_args),
+    95: ("set_feed_rate_mode_uprev", _no_args),
+    OP_M + 3: ("set_spindle_mode_cw", _no_args),
+    OP_M + 4: ("set_spindle_mode_ccw", _no_args),
+    OP_M + 5: ("set_spindle_mode_halt", _no_args),
+    OP_M + 6: ("manual_tool_change", _no_args),
+    OP_M + 7: ("coolant_on", _no_args),
+    OP_M + 8: ("coolant_on", _no_args),
+    OP_M + 9: ("coolant_off", _no_args),
+    OP_M + 30: ("program_end", _no_args),
+    OP_T: ("change_tool", lambda cmd: (f"TOOL #{int(cmd.get('T')):02d}",)),
+    OP_S: ("set_spindle_speed", lambda cmd: (int(cmd.get("S")),)),
+}
+
+
+def bind_command(machine, cmd):
+    """ Returns (bound method, args) executing cmd on machine, or None for
+    codes the machine does not handle (skipped silently, including
+    non-integer ones such as G1.1).
+    """
+    entry = DISPATCH.get(cmd.op)
+    if entry is None:
+        return None
+    name, decode = entry
+    return getattr(machine, name), decode(cmd)
+
+
+def compile_program(program, machine, rows=None):
+    """ Compiles a Program once into a flat list of (bound method, args) calls.
+    Args:
+      rows (array): if given, receives the command index of each call
+    """
+    compiled = []
+    append = compiled.append
+    bound = {}
+    ops = program.ops
+
+    for k in range(len(ops)):
+        op = ops[k]
+        if op not in bound:
+            entry = DISPATCH.get(op)
+            bound[op] = entry and (getattr(machine, entry[0]), entry[1])
+        entry = bound[op]
+        if not entry:
+            continue
+        append((entry[0], entry[1](Command(program, k))))
+        if rows is not None:
+            rows.append(k)
+    return compiled
 
-def parse_file(f_obj, pgm_data):
-    if not check_markers(f_obj):
-        return
 
-    pgm_data["commands"] = []
-    pgm_data["num_commands"] = 0
+def run_compiled(compiled):
+    for method, args in compiled:
+        method(*args)
 
-    for txt_row in f_obj:
-        txt_row = txt_row.strip()
 
-        if is_comment(txt_row):
-            continue
+def execute_command(machine, cmd):
+    call = bind_command(machine, cmd)
+    if call is not None:
+        call[0](*call[1])
 
-        pgm_num = get_program_number(txt_row)
-        if pgm_num > 0:
-            if pgm_data.get("pgm_num") is not None:
-                print("Error: multiple program numbers found.")
-                return
-            pgm_data["pgm_num"] = pgm_num
-            continue
 
-        get_commands(txt_row, pgm_data)
+def parse_file(f_obj, pgm_data):
+    """ Parses the whole file into pgm_data["commands"].
+    Returns False (after printing the error) if the program is invalid.
+    """
+    try:
+        for _ in iter_blocks(f_obj, pgm_data):
+            pass
+    except GCodeFormatError as err:
+        print(f"Error: {err}")
+        return False
+    return True
 
 
-def get_commands(txt_row, pgm_data):
-    command_codes = {"G", "T", "S", "M"}
-    parameter_codes = {"X", "Y", "Z", "F", "I", "J"}
-    parts = txt_row.upper().split()
-    codes = []
-    num_commands = 0
-    gcode_seen = False
-    i = 0
+def iter_blocks(f_obj, pgm_data, keep=True):
+    """ Parses the program in a single forward pass, yielding blocks lazily.
+    Works on any line iterable (files, pipes, socket streams). The "%" markers
+    can only be validated once the whole stream was read, so a marker error is
+    raised at end-of-stream.
+    Args:
+      f_obj (iterable): source of text lines
+      pgm_data (dict): receives pgm_num, num_commands, markers (and commands
+        if keep)
+      keep (bool): keep all blocks in pgm_data["commands"]; if False only
+        the current block is held, so earlier Block views become invalid
+    """
+    pgm_data["commands"] = Program()
+    pgm_data["num_commands"] = 0
+    pgm_data["markers"] = 0
 
-    while i < len(parts):
-        if parts[i][0] == "N":
-            i += 1
-            continue
-        if gcode_seen and parts[i][0] in parameter_codes:
-            if not codes[-1].get("params"):
-                codes[-1]["params"] = []
-            codes[-1]["params"].append(parts[i])
-            i += 1
+    program = pgm_data["commands"]
+    for line_no, txt_row in enumerate(f_obj, start=1):
+        txt_row = scan_line(txt_row, pgm_data)
+        if txt_row is None:
             continue
-        if parts[i][0] in command_codes:
-            if parts[i][0] == "G":
-                gcode_seen = True
-            codes.append({"cmd": parts[i]})
-            num_commands += 1
-        i += 1
+        if not keep:
+            program.clear()
+        block = get_commands(txt_row, pgm_data, line_no)
+        if block:
+            yield block
+
+    validate_markers(pgm_data["markers"])
+
+
+def parse_line(txt_row, pgm_data, line_no=0, keep=True):
+    """ Parses one source line into pgm_data["commands"] (see scan_line()).
+    Returns the Block, or None for a line without commands.
+    Args:
+      keep (bool): if False, the blocks parsed before are dropped first
+    """
+    txt_row = scan_line(txt_row, pgm_data)
+    if txt_row is None:
+        return None
+    if not keep:
+        pgm_data["commands"].clear()
+    return get_commands(txt_row, pgm_data, line_no)
+
+
+def scan_line(txt_row, pgm_data):
+    """ First step of parsing a source line, shared by all the parsers: counts
+    a "%" marker in pgm_data["markers"], strips the comments and takes an
+    "O" program number (a second one is an error). Returns the text left to
+    tokenize, or None.
+    """
+    if is_marker(txt_row):
+        pgm_data["markers"] = pgm_data.get("markers", 0) + 1
+        return None
+
+    txt_row = strip_comments(txt_row.strip())
+    if not txt_row:
+        return None
+
+    pgm_num = get_program_number(txt_row)
+    if pgm_num > 0:
+        if pgm_data.get("pgm_num") is not None:
+            raise GCodeFormatError("multiple program numbers found.")
+        pgm_data["pgm_num"] = pgm_data["commands"].pgm_num = pgm_num
+        return None
+    return txt_row
+
+
+def validate_markers(markers_seen):
+    """ Raises GCodeFormatError unless exactly two "%" markers were seen. """
+    if markers_seen != 2:
+        raise GCodeFormatError(f"invalid number of data markers ({markers_seen}, should have 2)")
+
 
-    if codes:
-        pgm_data["commands"].append(codes)
-        pgm_data["num_commands"] += num_commands
+def get_commands(txt_row, pgm_data, line_no=0):
+    """ Compiles one line into pgm_data["commands"], returns the Block or None. """
+    block = pgm_data["commands"].append_line(txt_row, line_no)
+    if block:
+        pgm_data["num_commands"] += len(block)
+    return block
 
 
 def check_markers(f_obj):
+    """ Legacy whole-file marker check; iter_blocks() validates markers itself. """
     markers_seen = sum(1 for txt_row in f_obj if is_marker(txt_row))
     f_obj.seek(0)
 
-    if markers_seen != 2:
-        print(f"Error: invalid number of data markers ({markers_seen}, should have 2)")
+    try:
+        validate_markers(markers_seen)
+    except GCodeFormatError as err:
+        print(f"Error: {err}")
         return False
     return True
 
@@ -192,6 +584,22 @@ def is_comment(txt_row):
     return len(txt_row) > 1 and txt_row.startswith("(") and txt_row.endswith(")")
 
 
+def strip_comments(txt_row):
+    """ Removes "( ... )" and "; ..." comments, including inline ones. """
+    if is_comment(txt_row):
+        return ""
+    if ";" in txt_row:
+        txt_row = txt_row.split(";", 1)[0]
+    while "(" in txt_row:
+        start = txt_row.index("(")
+        end = txt_row.find(")", start)
+        if end < 0:
+            txt_row = txt_row[:start]
+            break
+        txt_row = txt_row[:start] + " " + txt_row[end + 1:]
+    return txt_row.strip()
+
+
 def get_program_number(txt_row):
     if len(txt_row) < 2 or txt_row[0] != "O":
         return -9999
@@ -204,6 +612,8 @@ def get_program_number(txt_row):
 def show_usage():
     print('Error: G-code file missing.')
     print('Usage: ./main.py <filename>')
+    print('       ./main.py --batch <dir|glob> [...] [--jobs N]')
+    print('       ./main.py --dnc <-|[HOST:]PORT> [--lookahead LINES]')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+import mmap
+from array import array
+from main import scan_line, validate_markers
+from program import Program
+
+# Bytes of source decoded and tokenized per chunk.
+CHUNK_BYTES = 1 << 22
+# Every INDEX_STEP-th block gets a line-offset index entry.
+INDEX_STEP = 1024
+
+
+class MappedGCode:
+    """ Memory-mapped G-code file parsed in large chunks.
+    The raw bytes are decoded one chunk (about CHUNK_BYTES, cut at a line
+    end) at a time into a Program that is cleared for the next chunk, so
+    resident memory depends on the chunk size, not on the file size; the
+    mapped pages themselves are clean and can be dropped by the OS at will.
+    A sparse line-offset index (byte offset and line number of every
+    INDEX_STEP-th block) gives random access to any block number by
+    parsing at most INDEX_STEP blocks.
+    """
+
+    def __init__(self, path, chunk_bytes=CHUNK_BYTES, index_step=INDEX_STEP):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.index_step = index_step
+        self._file = open(path, "rb")
+        size = self._file.seek(0, 2)
+        # mmap cannot map empty files.
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.index_offsets = array("Q")
+        self.index_lines = array("L")
+        self.num_blocks = None
+        self.num_commands = None
+        self.pgm_num = None
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        self.build_index()
+        return self.num_blocks
+
+    def _chunks(self, offset, chunk_bytes):
+        """ Yields (byte offset, text) chunks ending at line ends. """
+        data, size = self._map, len(self._map)
+        while offset < size:
+            end = min(offset + chunk_bytes, size)
+            if end < size:
+                cut = data.rfind(b"\n", offset, end)
+                end = cut + 1 if cut >= 0 else (data.find(b"\n", end) + 1 or size)
+            # latin-1 maps bytes 1:1 to characters, so text offsets are byte offsets.
+            yield offset, data[offset:end].decode("latin-1")
+            offset = end
+
+    def iter_programs(self, first_block=0, pgm_data=None, chunk_bytes=None):
+        """ Yields one Program per chunk, starting at block first_block; each
+        Program (and its Block views) is only valid until the next one is
+        produced. Program.first_block is the number of its block 0 in the
+        file. pgm_data, if given, is filled like main.iter_blocks() does.
+        """
+        if first_block:
+            self.build_index()
+            if not 0 <= first_block < self.num_blocks:
+                raise IndexError(first_block)
+            slot = first_block // self.index_step
+            offset, line_no = self.index_offsets[slot], self.index_lines[slot] - 1
+            block = slot * self.index_step
+        else:
+            offset, line_no, block = 0, 0, 0
+        full_pass = block == 0 and self.num_blocks is None
+        if full_pass:
+            # An earlier pass may have stopped half-way.
+            del self.index_offsets[:]
+            del self.index_lines[:]
+
+        program = Program()
+        pgm_data = pgm_data if pgm_data is not None else {}
+        pgm_data["commands"] = program
+        pgm_data.setdefault("num_commands", 0)
+        pgm_data["markers"] = 0
+        commands = 0
+        step = self.index_step
+
+        for chunk_offset, text in self._chunks(offset, chunk_bytes or self.chunk_bytes):
+            program.clear()
+            rows = []
+            row_offsets = {}
+            pos = chunk_offset
+            lines = text.split("\n")
+            if lines[-1] == "":
+                lines.pop()
+            for raw in lines:
+                line_start = pos
+                pos += len(raw) + 1
+                line_no += 1
+                txt_row = scan_line(raw, pgm_data)
+                if txt_row is None:
+                    continue
+                rows.append((txt_row, line_no))
+                row_offsets[line_no] = line_start
+            self.pgm_num = pgm_data.get("pgm_num", self.pgm_num)
+
+            added = program.append_lines(rows)
+            if full_pass:
+                for b in range(-block % step, added, step):
+                    line = program.block_lines[b]
+                    self.index_offsets.append(row_offsets[line])
+                    self.index_lines.append(line)
+            program.first_block = block
+            block += added
+            commands += program.num_commands
+            pgm_data["num_commands"] = commands
+            if program.first_block < first_block:
+                # Skipping up to the requested block within an index step.
+                program.drop_blocks(first_block - program.first_block)
+            if len(program):
+                yield program
+
+        if full_pass:
+            validate_markers(pgm_data["markers"])
+            self.num_blocks = block
+            self.num_commands = commands
+
+    def iter_blocks(self, first_block=0, pgm_data=None):
+        """ Yields Blocks from first_block on; a Block is valid until the end of its chunk. """
+        for program in self.iter_programs(first_block, pgm_data):
+            yield from program
+
+    def build_index(self):
+        """ Parses the whole file once to count blocks and fill the line-offset index. """
+        if self.num_blocks is None:
+            for _ in self.iter_programs():
+                pass
+
+    def block(self, n):
+        """ Returns block n, parsing at most index_step blocks from the nearest index entry. """
+        # A small chunk: the returned Block keeps its chunk's Program alive.
+        for program in self.iter_programs(n, chunk_bytes=1 << 16):
+            return program[0]
+        raise IndexError(n)
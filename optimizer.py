@@ -0,0 +1,286 @@
+import math
+import time
+from bisect import bisect_right
+from estimator import estimate_program
+from main import iter_blocks
+from toolpath import get_toolpath, get_bounds, segment_lengths, RAPID, LINEAR
+from writer import GCodeWriter, check_rewritable, passthrough_words
+# Longest run of features reversed by one 2-opt move.
+MAX_REVERSAL = 50
+# Time budget of the 2-opt improvement per group [s].
+IMPROVE_SECONDS = 10.0
+
+
+class KDTree:
+    """ Static 2D k-d tree with point removal, for repeated nearest
+    neighbour queries. Node ranges are implicit: the node of order[lo:hi]
+    is order[(lo + hi) // 2], split on x at even depths and y at odd ones.
+    """
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        n = len(xs)
+        self.order = list(range(n))
+        # Alive points below each node, and each point's node and parent node position.
+        self.count = [0] * n
+        self.node = [0] * n
+        self.parent = [-1] * n
+        stack = [(0, n, 0, -1)]
+        while stack:
+            lo, hi, depth, parent = stack.pop()
+            if lo >= hi:
+                continue
+            coords = xs if depth % 2 == 0 else ys
+            self.order[lo:hi] = sorted(self.order[lo:hi], key=coords.__getitem__)
+            mid = (lo + hi) // 2
+            self.count[mid] = hi - lo
+            self.node[self.order[mid]] = mid
+            self.parent[mid] = parent
+            stack.append((lo, mid, depth + 1, mid))
+            stack.append((mid + 1, hi, depth + 1, mid))
+        self.removed = bytearray(n)
+
+    def remove(self, i):
+        self.removed[i] = 1
+        pos = self.node[i]
+        while pos >= 0:
+            self.count[pos] -= 1
+            pos = self.parent[pos]
+
+    def nearest(self, x, y):
+        """ Returns the index of the closest point not removed yet, or -1. """
+        xs, ys, order, count, removed = self.xs, self.ys, self.order, self.count, self.removed
+        best, best_d = -1, math.inf
+        stack = [(0, len(order), 0, 0.0)]
+        while stack:
+            lo, hi, depth, bound = stack.pop()
+            if lo >= hi or bound >= best_d:
+                continue
+            mid = (lo + hi) // 2
+            if not count[mid]:
+                continue
+            i = order[mid]
+            if not removed[i]:
+                d = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                if d < best_d:
+                    best, best_d = i, d
+            diff = x - xs[i] if depth % 2 == 0 else y - ys[i]
+            if diff < 0:
+                near, far = (lo, mid), (mid + 1, hi)
+            else:
+                near, far = (mid + 1, hi), (lo, mid)
+            stack.append((far[0], far[1], depth + 1, diff * diff))
+            stack.append((near[0], near[1], depth + 1, 0.0))
+        return best
+
+
+class Feature:
+    """ Run of consecutive cutting segments first..stop-1 between rapids. """
+    __slots__ = ("first", "stop")
+
+    def __init__(self, first, stop):
+        self.first = first
+        self.stop = stop
+
+
+class Section:
+    """ Features that may be reordered freely, the rapids after the last one
+    (e.g. a final retract) and the barrier block (None at the program end)
+    that ends the section.
+    """
+
+    def __init__(self):
+        self.features = []
+        self.trailing = []
+        self.barrier = None
+
+
+def split_features(program, tp):
+    """ Splits the toolpath into Sections of Features. Rapids between
+    features are dropped and regenerated when writing.
+    """
+    sections = [Section()]
+    n = 0
+    run = None
+    for b in range(len(program)):
+        stop = n
+        while stop < len(tp) and tp.blocks[stop] == b:
+            stop += 1
+        if passthrough_words(program, b):
+            if run is not None:
+                sections[-1].features.append(Feature(run, n))
+                run = None
+            sections[-1].barrier = b
+            sections.append(Section())
+        else:
+            for k in range(n, stop):
+                if tp.kinds[k] == RAPID:
+                    if run is not None:
+                        sections[-1].features.append(Feature(run, k))
+                        run = None
+                    sections[-1].trailing.append(k)
+                elif run is None:
+                    run = k
+                    del sections[-1].trailing[:]
+        n = stop
+    if run is not None:
+        sections[-1].features.append(Feature(run, n))
+    return sections
+
+
+def order_features(features, tp, start, deadline=None):
+    """ Returns the features in a short visiting order from start (x, y):
+    greedy nearest neighbour over the entry points (KD-tree), improved by
+    2-opt moves reversing up to MAX_REVERSAL features. Features are never
+    cut backwards, so the travel costs are asymmetric (exit -> entry).
+    The original order is kept unless the new one travels less in XY.
+    """
+    if len(features) < 2:
+        return list(features)
+    entry_x = [tp.x0[f.first] for f in features]
+    entry_y = [tp.y0[f.first] for f in features]
+    exit_x = [tp.x1[f.stop - 1] for f in features]
+    exit_y = [tp.y1[f.stop - 1] for f in features]
+
+    tree = KDTree(entry_x, entry_y)
+    tour = []
+    x, y = start
+    for _ in range(len(features)):
+        i = tree.nearest(x, y)
+        tree.remove(i)
+        tour.append(i)
+        x, y = exit_x[i], exit_y[i]
+
+    def cost(a, b):
+        # a == -1 is the start position.
+        if a < 0:
+            return math.hypot(entry_x[b] - start[0], entry_y[b] - start[1])
+        return math.hypot(entry_x[b] - exit_x[a], entry_y[b] - exit_y[a])
+
+    deadline = deadline or time.perf_counter() + IMPROVE_SECONDS
+    n = len(tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(-1, n - 2):
+            a = tour[i] if i >= 0 else -1
+            b = tour[i + 1]
+            before = cost(a, b)
+            # Reversing tour[i + 1..j]: inner edges change direction.
+            inner = 0.0
+            for j in range(i + 2, min(i + 1 + MAX_REVERSAL, n)):
+                c, d = tour[j - 1], tour[j]
+                inner += cost(d, c) - cost(c, d)
+                after = tour[j + 1] if j + 1 < n else None
+                old = before + (cost(d, after) if after is not None else 0.0)
+                new = cost(a, d) + (cost(b, after) if after is not None else 0.0)
+                if new + inner < old - 1e-9:
+                    tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1]
+                    improved = True
+                    break
+
+    def length(order):
+        return math.fsum(cost(order[k - 1] if k else -1, order[k]) for k in range(len(order)))
+    if length(tour) >= length(range(n)):
+        return list(features)
+    return [features[i] for i in tour]
+
+
+def rapid_distance(tp):
+    """ Total length of the rapid segments [mm]. """
+    return math.fsum(length for length, kind in zip(segment_lengths(tp), tp.kinds) if kind == RAPID)
+
+
+def write_optimized(program, sections, tp):
+    """ Returns the rewritten program text. Rapids never go lower than
+    the original program's rapids did: a feature is reached by a rapid in
+    XY (after retracting to the clearance height, if the tool is below
+    that floor) and a rapid down to its entry height, or to the floor and
+    a plunge at the feature's feed.
+    """
+    rapid_z = [tp.z1[n] for n in range(len(tp)) if tp.kinds[n] == RAPID]
+    bounds = get_bounds(program)
+    safe_z = max(rapid_z) if rapid_z else (bounds.z_max if bounds else 0.0)
+    rapid_floor = min(rapid_z) if rapid_z else safe_z
+
+    writer = GCodeWriter(program.pgm_num)
+    n = 0
+    for section in sections:
+        for feature in section.features:
+            first = feature.first
+            entry = (tp.x0[first], tp.y0[first], tp.z0[first])
+            x, y, z = writer.position
+            if abs(x - entry[0]) > 1e-9 or abs(y - entry[1]) > 1e-9:
+                if z < rapid_floor - 1e-9:
+                    writer.rapid(z=safe_z)
+                writer.rapid(entry[0], entry[1])
+            if writer.position[2] != entry[2]:
+                writer.rapid(z=max(entry[2], rapid_floor))
+                writer.move(LINEAR, entry, tp.feeds[first], tp.feed_modes[first])
+            for k in range(first, feature.stop):
+                writer.segment(tp, k)
+        for k in section.trailing:
+            # Only the axes the original rapid moved (e.g. a retract stays a pure Z move).
+            writer.rapid(*(end if abs(end - begin) > 1e-9 else None
+                           for begin, end in ((tp.x0[k], tp.x1[k]), (tp.y0[k], tp.y1[k]), (tp.z0[k], tp.z1[k]))))
+        b = section.barrier
+        if b is not None:
+            # Commands the segments do not carry are passed through, then the block's own moves.
+            writer.raw(" ".join(passthrough_words(program, b)))
+            while n < len(tp) and tp.blocks[n] < b:
+                n += 1
+            while n < len(tp) and tp.blocks[n] == b:
+                writer.segment(tp, n)
+                n += 1
+    return writer.text()
+
+
+class Report:
+    """ Result of optimize_program(). """
+
+    def __init__(self, features, rapid_before, rapid_after, time_before, time_after):
+        self.features = features
+        self.rapid_before = rapid_before
+        self.rapid_after = rapid_after
+        self.time_before = time_before
+        self.time_after = time_after
+
+    def lines(self):
+        return [f"Features: {self.features}",
+                f"Rapid travel: {self.rapid_before:.1f} mm -> {self.rapid_after:.1f} mm "
+                f"({self.rapid_before - self.rapid_after:+.1f} mm saved)",
+                f"Estimated time: {self.time_before:.1f} s -> {self.time_after:.1f} s "
+                f"({self.time_before - self.time_after:+.1f} s saved)"]
+
+
+def optimize_program(program):
+    """ Reorders the cutting features of a Program to shorten rapid travel.
+    Returns (G-code text, Report); the rewritten program is re-parsed to
+    measure its rapids and estimated time. Raises ValueError if the program
+    cannot be rewritten (see writer.check_rewritable()).
+    """
+    check_rewritable(program)
+    tp = get_toolpath(program)
+    sections = split_features(program, tp)
+    position = (0.0, 0.0)
+    for section in sections:
+        section.features = order_features(section.features, tp, position)
+        if section.features:
+            last = section.features[-1].stop - 1
+            position = (tp.x1[last], tp.y1[last])
+        if section.barrier is not None:
+            # The barrier block's own moves start the next section.
+            last = bisect_right(tp.blocks, section.barrier) - 1
+            if last >= 0 and tp.blocks[last] == section.barrier:
+                position = (tp.x1[last], tp.y1[last])
+
+    text = write_optimized(program, sections, tp)
+    pgm_data = {}
+    for _ in iter_blocks(text.splitlines(), pgm_data):
+        pass
+    optimized = pgm_data["commands"]
+    report = Report(sum(len(s.features) for s in sections),
+                    rapid_distance(tp), rapid_distance(get_toolpath(optimized)),
+                    estimate_program(program).total, estimate_program(optimized).total)
+    return text, report
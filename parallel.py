@@ -0,0 +1,95 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from main import scan_line, validate_markers
+from program import Program, GCodeFormatError
+
+# Chunks per worker process; more, smaller chunks even out the load.
+CHUNKS_PER_JOB = 4
+# Files are never split into chunks smaller than this.
+MIN_CHUNK_BYTES = 1 << 20
+
+
+def split_ranges(path, n_chunks, min_bytes=MIN_CHUNK_BYTES):
+    """ Splits a file into about n_chunks byte ranges ending at line ends.
+    Returns a list of (start, end, first_line), first_line being the number
+    of lines before the range.
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if not size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            step = max(size // max(n_chunks, 1), min_bytes)
+            ranges = []
+            start = lines = 0
+            while start < size:
+                end = min(start + step, size)
+                if end < size:
+                    end = data.find(b"\n", end) + 1 or size
+                ranges.append((start, end, lines))
+                lines += data[start:end].count(b"\n")
+                start = end
+    return ranges
+
+
+def parse_range(path, start, end, first_line):
+    """ Tokenizes the lines in a byte range of a file into a Program (run in
+    a worker process). Returns (program, markers seen, program number or
+    None).
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        # Like mapped.py: comments may hold any bytes, the words are ASCII.
+        text = f.read(end - start).decode("latin-1")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+
+    program = Program()
+    chunk_data = {"commands": program, "markers": 0}
+    rows = []
+    for line_no, raw in enumerate(lines, start=first_line + 1):
+        txt_row = scan_line(raw, chunk_data)
+        if txt_row is not None:
+            rows.append((txt_row, line_no))
+    program.append_lines(rows)
+    return program, chunk_data["markers"], chunk_data.get("pgm_num")
+
+
+def parse_parallel(path, pgm_data, jobs=None):
+    """ Parses a file in newline-aligned chunks on a process pool and
+    stitches the chunk Programs together in file order. Only program
+    numbers and markers span chunks; they are checked while stitching.
+    Motion modes need no fix-up, as build_toolpath() resolves them from
+    the stitched command rows. Small files (or jobs=1) are parsed in this
+    process. Fills pgm_data like main.iter_blocks(); returns the Program.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    ranges = split_ranges(path, jobs * CHUNKS_PER_JOB)
+    program = Program()
+    pgm_data["commands"] = program
+    pgm_data["num_commands"] = 0
+    markers = 0
+
+    def stitch(parts):
+        nonlocal markers
+        for part, part_markers, pgm_num in parts:
+            markers += part_markers
+            if pgm_num is not None:
+                if pgm_data.get("pgm_num") is not None:
+                    raise GCodeFormatError("multiple program numbers found.")
+                pgm_data["pgm_num"] = program.pgm_num = pgm_num
+            program.extend(part)
+
+    starts, ends, first_lines = zip(*ranges) if ranges else ((), (), ())
+    if jobs == 1 or len(ranges) < 2:
+        stitch(map(parse_range, [path] * len(ranges), starts, ends, first_lines))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as pool:
+            stitch(pool.map(parse_range, [path] * len(ranges), starts, ends, first_lines))
+
+    validate_markers(markers)
+    pgm_data["markers"] = markers
+    pgm_data["num_commands"] = program.num_commands
+    return program
@@ -0,0 +1,108 @@
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from estimator import estimate_program, DEFAULT_LIMITS
+from toolpath import segment_point
+
+# Playback speeds offered by the visualizer; None plays the whole program in MAX_SPEED_SECONDS.
+SPEEDS = {"1x": 1.0, "10x": 10.0, "100x": 100.0, "max": None}
+MAX_SPEED_SECONDS = 5.0
+# Simulation step [s of wall time] and the most steps caught up in one frame.
+TIME_STEP = 1.0 / 60.0
+MAX_STEPS_PER_FRAME = 5
+
+
+class Timeline:
+    """ Cumulative-time index over the segments of a toolpath: ends[n] is the
+    machine time [s] at which segment n is finished, so the segment active
+    at any time is found by bisection in O(log n).
+    """
+
+    def __init__(self, estimate):
+        self.toolpath = estimate.toolpath
+        self.ends = array("d", accumulate(estimate.times))
+
+    @property
+    def duration(self):
+        return self.ends[-1] if self.ends else 0.0
+
+    def locate(self, t):
+        """ Returns (segment index, fraction of it done) at time t, or (None, 0) without motion. """
+        ends = self.ends
+        if not ends:
+            return None, 0.0
+        n = min(bisect_right(ends, t), len(ends) - 1)
+        start = ends[n - 1] if n else 0.0
+        span = ends[n] - start
+        fraction = (t - start) / span if span > 0 else 1.0
+        return n, min(max(fraction, 0.0), 1.0)
+
+    def position(self, t):
+        """ Returns ((x, y, z), segment index) of the tool head at time t.
+        Within a segment the head moves uniformly in time; accelerations only
+        shift when a segment is reached, not the path.
+        """
+        n, fraction = self.locate(t)
+        if n is None:
+            return None, None
+        return segment_point(self.toolpath, n, fraction), n
+
+
+def get_timeline(program, limits=None):
+    """ Returns the (cached) Timeline of a Program. """
+    key = ("timeline", (limits or DEFAULT_LIMITS).key())
+    if key not in program.cache:
+        program.cache[key] = Timeline(estimate_program(program, limits))
+    return program.cache[key]
+
+
+class Playback:
+    """ Fixed-timestep playback clock over a Timeline. The machine time only
+    advances in TIME_STEP increments (scaled by speed), independent of the
+    frame rate; frames that arrive late catch up at most MAX_STEPS_PER_FRAME
+    steps so a slow renderer cannot spiral.
+    """
+
+    def __init__(self, timeline, speed=1.0):
+        self.timeline = timeline
+        self.speed = speed
+        self.time = 0.0
+        self.playing = False
+        self._pending = 0.0
+
+    @property
+    def finished(self):
+        return self.time >= self.timeline.duration
+
+    def rate(self):
+        """ Machine seconds per wall-clock second. """
+        if self.speed is None:
+            return max(self.timeline.duration / MAX_SPEED_SECONDS, 1.0)
+        return self.speed
+
+    def play(self):
+        if self.finished:
+            self.time = 0.0
+        self.playing = True
+        self._pending = 0.0
+
+    def pause(self):
+        self.playing = False
+
+    def seek(self, t):
+        self.time = min(max(t, 0.0), self.timeline.duration)
+        self._pending = 0.0
+
+    def advance(self, elapsed):
+        """ Consumes elapsed wall-clock seconds; returns True if the time changed. """
+        if not self.playing:
+            return False
+        self._pending = min(self._pending + elapsed, TIME_STEP * MAX_STEPS_PER_FRAME)
+        steps = int(self._pending / TIME_STEP)
+        if not steps:
+            return False
+        self._pending -= steps * TIME_STEP
+        self.seek(self.time + steps * TIME_STEP * self.rate())
+        if self.finished:
+            self.playing = False
+        return True
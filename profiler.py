@@ -0,0 +1,139 @@
+import time
+from bisect import bisect_right
+from contextlib import contextmanager
+from program import op_name
+
+# Latency histogram buckets: bucket b counts durations in [2^(b-1), 2^b) microseconds.
+BUCKETS = 24
+
+
+class Histogram:
+    """ Log2 latency histogram in microseconds. """
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.total = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        us = seconds * 1e6
+        self.counts[min(int(us).bit_length(), BUCKETS - 1)] += 1
+        self.total += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """ Upper bound [s] of the bucket holding the p-th percentile (0-100). """
+        if not self.total:
+            return 0.0
+        target = self.total * p / 100.0
+        seen = 0
+        for b, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return (1 << b) * 1e-6
+        return self.max
+
+    def lines(self, width=40):
+        """ Text rendering, one line per non-empty bucket. """
+        peak = max(self.counts) or 1
+        result = []
+        for b, count in enumerate(self.counts):
+            if count:
+                label = f"< {1 << b} us" if b else "< 1 us"
+                result.append(f"  {label:>12} {count:>9} {'#' * max(1, count * width // peak)}")
+        return result
+
+
+class Profiler:
+    """ Opt-in instrumentation: wall time per phase (parse, execute, render,
+    ...), call count and cumulative time per opcode, and a per-block latency
+    histogram. Code paths only touch it when a Profiler was passed in, so
+    running without one costs nothing.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.op_counts = {}
+        self.op_times = {}
+        self.blocks = Histogram()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def timed_iter(self, iterable, name):
+        """ Yields from iterable, charging the time spent producing items to a phase. """
+        it = iter(iterable)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_phase(name, clock() - start)
+                return
+            self.add_phase(name, clock() - start)
+            yield item
+
+    def add_op(self, op, seconds):
+        self.op_counts[op] = self.op_counts.get(op, 0) + 1
+        self.op_times[op] = self.op_times.get(op, 0.0) + seconds
+
+    def report(self):
+        """ Returns the collected statistics as text lines. Works on copies,
+        so it may be called while another thread is still recording.
+        """
+        lines = ["Phases:"]
+        for name, seconds in list(self.phases.items()):
+            lines.append(f"  {name:<12} {seconds * 1000:10.1f} ms")
+        op_counts, op_times = dict(self.op_counts), dict(self.op_times)
+        if op_counts:
+            lines.append("Opcodes:")
+            lines.append(f"  {'op':<8} {'count':>9} {'total ms':>10} {'us/call':>9}")
+            for op in sorted(op_counts, key=op_times.get, reverse=True):
+                count, seconds = op_counts[op], op_times[op]
+                lines.append(f"  {op_name(op):<8} {count:>9} {seconds * 1000:10.1f} {seconds * 1e6 / count:9.2f}")
+        if self.blocks.total:
+            h = self.blocks
+            lines.append(f"Block latency ({h.total} blocks, p50 < {h.percentile(50) * 1e6:.0f} us, "
+                         f"p99 < {h.percentile(99) * 1e6:.0f} us, max {h.max * 1e6:.0f} us):")
+            lines.extend(h.lines())
+        return lines
+
+
+def run_compiled_profiled(profiler, compiled, rows, program, start=0, stop=None):
+    """ Profiled equivalent of main.run_compiled() over compiled[start:stop].
+    rows[i] is the command row of compiled[i] (see compile_program()).
+    """
+    clock = time.perf_counter
+    ops, starts = program.ops, program.block_starts
+    stop = len(compiled) if stop is None else stop
+    add_op, add_block = profiler.add_op, profiler.blocks.add
+    block_end = -1
+    block_time = 0.0
+    phase_start = clock()
+    for i in range(start, stop):
+        row = rows[i]
+        if row >= block_end:
+            if block_end >= 0:
+                add_block(block_time)
+            block = bisect_right(starts, row) - 1
+            block_end = starts[block + 1]
+            block_time = 0.0
+        method, args = compiled[i]
+        t0 = clock()
+        method(*args)
+        dt = clock() - t0
+        add_op(ops[row], dt)
+        block_time += dt
+    if block_end >= 0:
+        add_block(block_time)
+    profiler.add_phase("execute", clock() - phase_start)
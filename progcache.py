@@ -0,0 +1,159 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from estimator import Estimate, DEFAULT_LIMITS, estimate_program
+from program import Program, PARSER_VERSION
+from toolpath import Toolpath, get_bounds, get_toolpath, Bounds
+
+# File layout: MAGIC, header length (u32), JSON header, padding to 8 bytes,
+# then the raw column data, every column starting on an 8 byte boundary.
+MAGIC = b"GCSIMPC1"
+_PREFIX = struct.Struct("<8sI")
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                                 "cnc-simulator")
+_HASH_CHUNK = 1 << 20
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def cache_path(source, cache_dir=DEFAULT_CACHE_DIR):
+    """ Returns the cache file of a G-code file: named after the SHA-256 of
+    its content and the parser version, so edited files and parser changes
+    never hit a stale entry.
+    """
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return os.path.join(cache_dir, f"{digest.hexdigest()}.p{PARSER_VERSION}.bin")
+
+
+def _columns(program):
+    """ Yields (name, array) of everything stored: the program columns, the
+    toolpath segments and the segment times of the default estimate.
+    """
+    yield "ops", program.ops
+    yield "masks", program.masks
+    for letter, column in program.words.items():
+        yield "words." + letter, column
+    yield "block_starts", program.block_starts
+    yield "block_lines", program.block_lines
+    yield "ignored_lines", program.ignored_lines
+    for name, column in vars(get_toolpath(program)).items():
+        yield "toolpath." + name, column
+    yield "estimate.times", estimate_program(program).times
+
+
+def write_cache(path, program):
+    """ Stores a Program with its toolpath, bounds and default time estimate
+    (computing the ones not cached yet). Written to a temporary file first,
+    so concurrent readers never see a partial entry.
+    """
+    columns = list(_columns(program))
+    bounds = get_bounds(program)
+    entries = []
+    offset = 0
+    for name, column in columns:
+        entries.append([name, column.typecode, offset, len(column)])
+        offset = _align(offset + len(column) * column.itemsize)
+    header = json.dumps({
+        "parser": PARSER_VERSION,
+        "byteorder": sys.byteorder,
+        "pgm_num": program.pgm_num,
+        "bounds": bounds.as_dict() if bounds is not None else None,
+        "columns": entries,
+    }).encode()
+    data_start = _align(_PREFIX.size + len(header))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        for (name, column), entry in zip(columns, entries):
+            f.seek(data_start + entry[2])
+            f.write(column)
+        f.truncate(data_start + offset)
+    os.replace(tmp, path)
+
+
+def read_cache(path, pgm_data=None):
+    """ Maps a cache file and returns its Program, or None if there is no
+    valid entry. The columns are read-only memoryviews into the mapping,
+    so nothing is copied or decoded; toolpath, bounds and the default
+    estimate are put into the program cache. pgm_data, if given, is filled
+    like main.iter_blocks() does.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, size = _PREFIX.unpack_from(data)
+        if magic != MAGIC:
+            return None
+        header = json.loads(bytes(data[_PREFIX.size:_PREFIX.size + size]))
+        if header["parser"] != PARSER_VERSION or header["byteorder"] != sys.byteorder:
+            return None
+        view = memoryview(data)
+        data_start = _align(_PREFIX.size + size)
+        columns = {}
+        for name, typecode, offset, count in header["columns"]:
+            start = data_start + offset
+            end = start + count * struct.calcsize(typecode)
+            if end > len(data):
+                return None
+            columns[name] = view[start:end].cast(typecode)
+    except (struct.error, ValueError, KeyError, TypeError):
+        return None
+
+    program = Program()
+    program.ops = columns.pop("ops")
+    program.masks = columns.pop("masks")
+    for letter in program.words:
+        program.words[letter] = columns.pop("words." + letter)
+    program.block_starts = columns.pop("block_starts")
+    program.block_lines = columns.pop("block_lines")
+    program.ignored_lines = columns.pop("ignored_lines")
+    program.pgm_num = header["pgm_num"]
+    tp = Toolpath()
+    for name in vars(tp):
+        setattr(tp, name, columns.pop("toolpath." + name))
+    program.cache["toolpath"] = tp
+    bounds = header["bounds"]
+    program.cache["bounds"] = Bounds(**bounds) if bounds is not None else None
+    program.cache[("estimate", DEFAULT_LIMITS.key())] = Estimate(tp, columns.pop("estimate.times"))
+
+    if pgm_data is not None:
+        pgm_data["commands"] = program
+        pgm_data["num_commands"] = program.num_commands
+        if program.pgm_num is not None:
+            pgm_data["pgm_num"] = program.pgm_num
+    return program
+
+
+def load_program(source, pgm_data, cache_dir=DEFAULT_CACHE_DIR):
+    """ Returns the Program of a G-code file from the cache; on a miss the
+    file is parsed and its entry written (the toolpath, bounds and estimate
+    are computed for that). pgm_data is filled like main.iter_blocks() does.
+    """
+    from main import iter_blocks
+    path = cache_path(source, cache_dir)
+    program = read_cache(path, pgm_data)
+    if program is None:
+        with open(source) as f:
+            for _ in iter_blocks(f, pgm_data):
+                pass
+        program = pgm_data["commands"]
+        try:
+            write_cache(path, program)
+        except OSError:
+            # An unwritable cache only costs the next load a parse.
+            pass
+    return program
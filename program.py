@@ -0,0 +1,316 @@
+import functools
+from array import array
+
+# Word letters stored as one float column each, in column order.
+WORDS = "XYZIJKRFST"
+WORD_BITS = {word: 1 << n for n, word in enumerate(WORDS)}
+
+COMMAND_CODES = {"G", "M", "T", "S"}
+PARAMETER_CODES = {"X", "Y", "Z", "I", "J", "K", "R", "F"}
+
+# Version of the tokenizer, column layout and toolpath resolution; bumping it
+# invalidates cached programs (progcache.py).
+PARSER_VERSION = 4
+
+# Zero word rows for blocks of 0..7 commands, appended to every word column.
+_ZEROS = [array("d", bytes(8 * n)) for n in range(8)]
+
+# Opcodes: G codes use their number, M codes are offset by OP_M,
+# T and S carry their value in the T/S word columns.
+OP_M = 1000
+OP_T = 2000
+OP_S = 2001
+OP_UNKNOWN = 0xFFFF
+
+G00, G01, G02, G03 = 0, 1, 2, 3
+G17, G18, G19, G20, G21 = 17, 18, 19, 20, 21
+G28, G90, G91, G92, G93, G94 = 28, 90, 91, 92, 93, 94
+
+
+class GCodeFormatError(ValueError):
+    """ Raised when the program structure (markers, words, program number) is invalid. """
+
+
+def encode_op(letter, number):
+    """ Returns the opcode for a command word, e.g. ("G", 1.0) -> 1. """
+    if letter == "T":
+        return OP_T
+    if letter == "S":
+        return OP_S
+    if number != int(number) or not 0 <= number < OP_M:
+        return OP_UNKNOWN
+    return int(number) if letter == "G" else OP_M + int(number)
+
+
+def _tokenize(txt_row, line_no, row, ops, masks, values, ignored):
+    """ Tokenizes one comment-free line: appends the opcode and word mask of
+    each command to ops and masks, and (letter, row, value) of each word to
+    values, numbering the commands from row + 1; line_no goes to ignored if
+    the line holds words that are not kept (e.g. H, P, or axis words before
+    any G code). Returns the row of the last command (row if none).
+    """
+    gcode_seen = False
+    for part in txt_row.upper().split():
+        letter = part[0]
+        if letter == "N":
+            continue
+        if gcode_seen and letter in PARAMETER_CODES:
+            masks[-1] |= WORD_BITS[letter]
+            values.append((letter, row, _value(part, line_no)))
+            continue
+        if letter in COMMAND_CODES:
+            if letter == "G":
+                gcode_seen = True
+            value = _value(part, line_no)
+            ops.append(encode_op(letter, value))
+            row += 1
+            if letter in ("T", "S"):
+                masks.append(WORD_BITS[letter])
+                values.append((letter, row, value))
+            else:
+                masks.append(0)
+        elif not ignored or ignored[-1] != line_no:
+            ignored.append(line_no)
+    return row
+
+
+def _value(part, line_no):
+    try:
+        return float(part[1:])
+    except ValueError:
+        raise GCodeFormatError(f"line {line_no}: invalid word '{part}'") from None
+
+
+@functools.lru_cache(maxsize=None)
+def mask_words(mask):
+    """ Returns the word letters present in a word bit mask, in column order. """
+    return tuple(word for word in WORDS if mask & WORD_BITS[word])
+
+
+def op_name(op):
+    """ Returns the canonical command name of an opcode, e.g. 1 -> "G01". """
+    if op < OP_M:
+        return f"G{op:02d}"
+    if op < OP_T:
+        return f"M{op - OP_M:02d}"
+    if op == OP_T:
+        return "T"
+    if op == OP_S:
+        return "S"
+    return "?"
+
+
+class Command:
+    """ Lightweight view of one command row of a Program. """
+    __slots__ = ("program", "index")
+
+    def __init__(self, program, index):
+        self.program = program
+        self.index = index
+
+    @property
+    def op(self):
+        return self.program.ops[self.index]
+
+    @property
+    def name(self):
+        return op_name(self.program.ops[self.index])
+
+    @property
+    def letter(self):
+        return self.name[0]
+
+    @property
+    def params(self):
+        """ The command itself if it carries words, otherwise None. """
+        return self if self.program.masks[self.index] else None
+
+    def get(self, word, default=None):
+        """ Returns the value of a word (e.g. "X") as float, or default. """
+        if self.program.masks[self.index] & WORD_BITS.get(word, 0):
+            return self.program.words[word][self.index]
+        return default
+
+    def __contains__(self, word):
+        return bool(self.program.masks[self.index] & WORD_BITS.get(word, 0))
+
+    def __iter__(self):
+        return iter(mask_words(self.program.masks[self.index]))
+
+    def to_dict(self):
+        """ Returns the words as a {letter: value} dict. """
+        words, k = self.program.words, self.index
+        return {word: words[word][k] for word in mask_words(self.program.masks[k])}
+
+    def __bool__(self):
+        return self.program.masks[self.index] != 0
+
+    def __repr__(self):
+        op = self.op
+        if op in (OP_T, OP_S):
+            return f"{op_name(op)}{self.get(op_name(op)):g}"
+        words = " ".join(f"{w}{self.get(w):g}" for w in self if w not in "ST")
+        return f"{op_name(op)} {words}" if words else op_name(op)
+
+
+class Block:
+    """ Lightweight view of one block (source line) of a Program. """
+    __slots__ = ("program", "index")
+
+    def __init__(self, program, index):
+        self.program = program
+        self.index = index
+
+    @property
+    def line(self):
+        return self.program.block_lines[self.index]
+
+    def __len__(self):
+        starts = self.program.block_starts
+        return starts[self.index + 1] - starts[self.index]
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return Command(self.program, self.program.block_starts[self.index] + i)
+
+    def __iter__(self):
+        starts = self.program.block_starts
+        program = self.program
+        return (Command(program, k) for k in range(starts[self.index], starts[self.index + 1]))
+
+    def __repr__(self):
+        return "  ".join(repr(cmd) for cmd in self)
+
+
+class Program:
+    """ Compiled G-code program stored column-wise.
+    Every command is a row: ops holds its opcode, masks the bit set of
+    words present, and words[letter] the float value of each word (0.0 if
+    absent). block_starts[i] is the first command row of block i.
+    Iterating a Program yields Block views, so it can be used like the old
+    list of blocks.
+    """
+
+    def __init__(self):
+        self.ops = array("H")
+        self.masks = array("H")
+        self.words = {word: array("d") for word in WORDS}
+        self.block_starts = array("L", [0])
+        self.block_lines = array("L")
+        # Source lines holding words the tokenizer does not keep.
+        self.ignored_lines = array("L")
+        self.pgm_num = None
+        # Number of block 0 in the whole program when parsed in chunks (see mapped.py).
+        self.first_block = 0
+        self.cache = {}
+
+    @property
+    def num_commands(self):
+        return len(self.ops)
+
+    def __len__(self):
+        return len(self.block_lines)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return Block(self, i)
+
+    def __iter__(self):
+        return (Block(self, i) for i in range(len(self)))
+
+    def command(self, k):
+        return Command(self, k)
+
+    def clear(self):
+        """ Drops all rows (used when streaming without keeping history). """
+        del self.ops[:]
+        del self.masks[:]
+        for column in self.words.values():
+            del column[:]
+        del self.block_starts[1:]
+        del self.block_lines[:]
+        del self.ignored_lines[:]
+        self.cache.clear()
+
+    def append_line(self, txt_row, line_no=0):
+        """ Tokenizes one comment-free line and appends it as a block.
+        Returns the new Block, or None if the line held no commands.
+        The line is validated before anything is appended, so an invalid
+        word leaves the program unchanged.
+        """
+        new_ops, new_masks, values, ignored = [], [], [], []
+        last = _tokenize(txt_row, line_no, len(self.ops) - 1, new_ops, new_masks, values, ignored)
+        self.ignored_lines.extend(ignored)
+        if not new_ops:
+            return None
+        self._append_rows(new_ops, new_masks, values, (last + 1,), (line_no,))
+        return Block(self, len(self.block_lines) - 1)
+
+    def append_lines(self, rows):
+        """ Tokenizes comment-free (txt_row, line_no) rows, appending every
+        row holding commands as a block; returns the number of blocks added.
+        Same tokenization as append_line(), but the columns are grown once
+        per call and only the words present are written, which is faster
+        for large batches (e.g. file chunks). Nothing is appended if a row
+        holds an invalid word.
+        """
+        new_ops, new_masks, values, ignored = [], [], [], []
+        starts = []
+        lines = []
+        last = len(self.ops) - 1
+        for txt_row, line_no in rows:
+            row = _tokenize(txt_row, line_no, last, new_ops, new_masks, values, ignored)
+            if row > last:
+                last = row
+                starts.append(last + 1)
+                lines.append(line_no)
+        self.ignored_lines.extend(ignored)
+        if new_ops:
+            self._append_rows(new_ops, new_masks, values, starts, lines)
+        return len(lines)
+
+    def _append_rows(self, new_ops, new_masks, values, starts, lines):
+        """ Appends tokenized command rows (see _tokenize()) and their blocks. """
+        self.ops.extend(new_ops)
+        self.masks.extend(new_masks)
+        n = len(new_ops)
+        zeros = _ZEROS[n] if n < len(_ZEROS) else array("d", bytes(8 * n))
+        words = self.words
+        for column in words.values():
+            column.extend(zeros)
+        for letter, row, value in values:
+            words[letter][row] = value
+        self.block_starts.extend(starts)
+        self.block_lines.extend(lines)
+        self.cache.clear()
+
+    def extend(self, other):
+        """ Appends all blocks of another Program (e.g. a separately parsed chunk). """
+        base = len(self.ops)
+        self.ops.extend(other.ops)
+        self.masks.extend(other.masks)
+        for letter, column in self.words.items():
+            column.extend(other.words[letter])
+        self.block_starts.extend(array("L", (start + base for start in other.block_starts[1:])))
+        self.block_lines.extend(other.block_lines)
+        self.ignored_lines.extend(other.ignored_lines)
+        self.cache.clear()
+
+    def drop_blocks(self, count):
+        """ Removes the first count blocks (used to start a chunk at a given block). """
+        count = min(count, len(self))
+        if count <= 0:
+            return
+        rows = self.block_starts[count]
+        del self.ops[:rows]
+        del self.masks[:rows]
+        for column in self.words.values():
+            del column[:rows]
+        self.block_starts = array("L", (start - rows for start in self.block_starts[count:]))
+        del self.block_lines[:count]
+        self.first_block += count
+        self.cache.clear()
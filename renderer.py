@@ -0,0 +1,208 @@
+import math
+from array import array
+from toolpath import get_toolpath, get_polyline, RAPID
+
+# Max points of one merged polyline; also the granularity of viewport culling.
+CHUNK_POINTS = 256
+# Markers are only drawn if at most this many segment ends are visible...
+MAX_MARKERS = 2000
+# ...and the average visible segment is at least this long [px].
+MARKER_MIN_PIXELS = 8.0
+
+
+class ViewTransform:
+    """ World (mm) to view (pixel) mapping shared by all renderers:
+    view = (world - origin) * scale + offset, on both axes.
+    """
+
+    def __init__(self, x_min, y_min, scale, offset_x=0.0, offset_y=0.0):
+        self.x_min = x_min
+        self.y_min = y_min
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    def to_view(self, x, y):
+        return ((x - self.x_min) * self.scale + self.offset_x,
+                (y - self.y_min) * self.scale + self.offset_y)
+
+    def to_world(self, vx, vy):
+        return ((vx - self.offset_x) / self.scale + self.x_min,
+                (vy - self.offset_y) / self.scale + self.y_min)
+
+    def world_rect(self, width, height):
+        """ World (x0, y0, x1, y1) rectangle visible in a width x height view. """
+        x0, y0 = self.to_world(0, 0)
+        x1, y1 = self.to_world(width, height)
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def fit_scale(bounds, width, height, default=10.0):
+    """ Scale [px/mm] fitting bounds into a width x height view. """
+    if bounds is None:
+        return default
+    x_range = bounds.x_max - bounds.x_min
+    y_range = bounds.y_max - bounds.y_min
+    if x_range > 0 and y_range > 0:
+        return min(width / x_range, height / y_range)
+    return default
+
+
+class SpatialGrid:
+    """ Uniform grid index of axis-aligned boxes for rectangle queries. """
+
+    def __init__(self, x_min, y_min, x_max, y_max, n_items, max_cells=65536):
+        self.x_min = x_min
+        self.y_min = y_min
+        area = max((x_max - x_min) * (y_max - y_min), 1e-9)
+        cells = min(max(n_items, 1), max_cells)
+        self.cell = max(math.sqrt(area / cells), (x_max - x_min) / 4096, (y_max - y_min) / 4096, 1e-6)
+        self.cells = {}
+
+    def _range(self, lo, hi, origin):
+        return range(int((lo - origin) // self.cell), int((hi - origin) // self.cell) + 1)
+
+    def insert(self, item, x0, y0, x1, y1):
+        cells = self.cells
+        for i in self._range(x0, x1, self.x_min):
+            for j in self._range(y0, y1, self.y_min):
+                cells.setdefault((i, j), []).append(item)
+
+    def query(self, x0, y0, x1, y1):
+        """ Returns the set of items whose cells overlap the rectangle. """
+        found = set()
+        cells = self.cells
+        i_range = self._range(x0, x1, self.x_min)
+        j_range = self._range(y0, y1, self.y_min)
+        if len(i_range) * len(j_range) > len(cells):
+            # Large viewport: scanning the occupied cells is cheaper.
+            for (i, j), items in cells.items():
+                if i in i_range and j in j_range:
+                    found.update(items)
+            return found
+        for i in i_range:
+            for j in j_range:
+                items = cells.get((i, j))
+                if items:
+                    found.update(items)
+        return found
+
+
+class LodScene:
+    """ Level-of-detail view of a program's toolpath.
+    Consecutive feed moves (G01-G03) are merged into polylines of at most
+    CHUNK_POINTS points, indexed by a SpatialGrid. Per zoom level, points
+    closer than about a pixel to the previously kept one are dropped
+    (cached per level), so a frame only touches visible chunks and never
+    draws sub-pixel detail.
+    """
+
+    def __init__(self, program, tolerance):
+        tp = self.toolpath = get_toolpath(program)
+        poly = get_polyline(program, tolerance)
+        self.xs = array("d")
+        self.ys = array("d")
+        self.chunk_starts = array("L", [0])
+        # Number of toolpath segments completed by the end of each chunk.
+        self.chunk_segments = array("L")
+        self.levels = {}
+        xs, ys, starts = self.xs, self.ys, self.chunk_starts
+        open_chunk = False
+
+        for n in range(len(tp)):
+            if tp.kinds[n] == RAPID:
+                open_chunk = self._close_chunk(open_chunk, n)
+                continue
+            first = poly.starts[n]
+            if open_chunk and len(xs) - starts[-1] >= CHUNK_POINTS:
+                open_chunk = self._close_chunk(open_chunk, n)
+            if open_chunk:
+                first += 1  # the segment starts where the previous one ended
+            for i in range(first, poly.starts[n + 1]):
+                xs.append(poly.xs[i])
+                ys.append(poly.ys[i])
+            open_chunk = True
+        self._close_chunk(open_chunk, len(tp))
+
+        bounds_x = (min(tp.x1), max(tp.x1)) if len(tp) else (0.0, 1.0)
+        bounds_y = (min(tp.y1), max(tp.y1)) if len(tp) else (0.0, 1.0)
+        if len(xs):
+            bounds_x = (min(bounds_x[0], min(xs)), max(bounds_x[1], max(xs)))
+            bounds_y = (min(bounds_y[0], min(ys)), max(bounds_y[1], max(ys)))
+        self.grid = SpatialGrid(bounds_x[0], bounds_y[0], bounds_x[1], bounds_y[1], self.num_chunks)
+        for c in range(self.num_chunks):
+            a, b = starts[c], starts[c + 1]
+            self.grid.insert(c, min(xs[a:b]), min(ys[a:b]), max(xs[a:b]), max(ys[a:b]))
+
+        self.marker_grid = SpatialGrid(bounds_x[0], bounds_y[0], bounds_x[1], bounds_y[1], len(tp))
+        for n in range(len(tp)):
+            self.marker_grid.insert(n, tp.x1[n], tp.y1[n], tp.x1[n], tp.y1[n])
+
+    @property
+    def num_chunks(self):
+        return len(self.chunk_starts) - 1
+
+    def _close_chunk(self, open_chunk, segments):
+        if open_chunk:
+            self.chunk_starts.append(len(self.xs))
+            self.chunk_segments.append(segments)
+        return False
+
+    def _level(self, scale):
+        """ Decimated chunk points for the power-of-two level matching scale. """
+        level = math.floor(math.log2(scale)) if scale > 0 else 0
+        if level not in self.levels:
+            # Keep points at least ~one pixel apart at the coarsest scale of this level.
+            tolerance = 1.0 / 2.0 ** level
+            xs, ys, starts = self.xs, self.ys, self.chunk_starts
+            keep = array("L")
+            kept_starts = array("L", [0])
+            for c in range(self.num_chunks):
+                a, b = starts[c], starts[c + 1]
+                keep.append(a)
+                lx, ly = xs[a], ys[a]
+                for i in range(a + 1, b - 1):
+                    if abs(xs[i] - lx) + abs(ys[i] - ly) >= tolerance:
+                        keep.append(i)
+                        lx, ly = xs[i], ys[i]
+                if b - a > 1:
+                    keep.append(b - 1)
+                kept_starts.append(len(keep))
+            self.levels[level] = (keep, kept_starts)
+        return self.levels[level]
+
+    def polylines(self, view, width, height, segments=None):
+        """ Yields the flat view coordinate lists of all visible polylines.
+        Args:
+          segments (int): if given, only chunks whose segments all lie below
+            this toolpath index are drawn (progressive display while running)
+        """
+        x0, y0, x1, y1 = view.world_rect(width, height)
+        keep, kept_starts = self._level(view.scale)
+        xs, ys = self.xs, self.ys
+        sx, ox, mx = view.scale, view.offset_x, view.x_min
+        oy, my = view.offset_y, view.y_min
+        for c in sorted(self.grid.query(x0, y0, x1, y1)):
+            if segments is not None and self.chunk_segments[c] > segments:
+                continue
+            coords = []
+            for i in keep[kept_starts[c]:kept_starts[c + 1]]:
+                coords.append((xs[i] - mx) * sx + ox)
+                coords.append((ys[i] - my) * sx + oy)
+            if len(coords) >= 4:
+                yield coords
+
+    def markers(self, view, width, height):
+        """ Returns view positions of visible segment ends, or [] when zoomed
+        out too far for markers to be distinguishable.
+        """
+        x0, y0, x1, y1 = view.world_rect(width, height)
+        visible = self.marker_grid.query(x0, y0, x1, y1)
+        if not visible or len(visible) > MAX_MARKERS:
+            return []
+        span = math.hypot(x1 - x0, y1 - y0) * view.scale
+        if span / len(visible) < MARKER_MIN_PIXELS:
+            return []
+        tp = self.toolpath
+        return [view.to_view(tp.x1[n], tp.y1[n]) for n in sorted(visible)
+                if x0 <= tp.x1[n] <= x1 and y0 <= tp.y1[n] <= y1]
@@ -0,0 +1,185 @@
+import os
+import queue
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from checkpoints import get_checkpoints
+from main import iter_blocks, compile_program, phase
+from playback import get_timeline
+from profiler import run_compiled_profiled
+from progcache import cache_path, read_cache, write_cache
+from renderer import LodScene, fit_scale
+from simplify import simplify_toolpath, use_toolpath
+from toolpath import get_bounds, get_toolpath
+
+# Commands executed between two progress events / pause checks.
+CHUNK_COMMANDS = 2000
+# Lines parsed between two load progress events.
+CHUNK_LINES = 20000
+
+
+class Worker(threading.Thread):
+    """ Base class of the background jobs of the visualizer. Results and
+    progress are only published as (kind, ...) tuples on the events queue,
+    so the Tk thread can drain them at its own pace.
+    """
+
+    def __init__(self, events=None):
+        super().__init__(daemon=True)
+        self.events = events if events is not None else queue.Queue()
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def checkpoint(self):
+        """ Blocks while paused; returns False once cancelled. """
+        self._running.wait()
+        return not self._cancelled.is_set()
+
+    def run(self):
+        try:
+            if self.work():
+                return
+            self.events.put(("cancelled",))
+        except Exception as err:
+            self.events.put(("error", f"{type(err).__name__}: {err}"))
+
+    def work(self):
+        """ Does the job; returns False if it was cancelled. """
+        raise NotImplementedError
+
+
+class LoadWorker(Worker):
+    """ Parses a file and prepares its toolpath, bounds, LodScene and Timeline.
+    With a simplify tolerance [mm], the toolpath is simplified first (see
+    simplify.py), so the scene and playback use the reduced segment list.
+    Events: ("load_progress", fraction), ("loaded", pgm_data, scene, scale).
+    """
+
+    def __init__(self, filepath, view_size=(700, 500), events=None, profiler=None, cache_dir=None,
+                 simplify=None):
+        super().__init__(events)
+        self.filepath = filepath
+        self.view_size = view_size
+        self.profiler = profiler
+        self.cache_dir = cache_dir
+        self.simplify = simplify
+
+    def work(self):
+        self.total = max(os.path.getsize(self.filepath), 1)
+        self.read = 0
+        pgm_data = {}
+        profiler = self.profiler
+        program = cache_file = None
+        if self.cache_dir:
+            with phase(profiler, "load"):
+                cache_file = cache_path(self.filepath, self.cache_dir)
+                program = read_cache(cache_file, pgm_data)
+        # Cache misses are stored once the toolpath and timeline are computed.
+        store = cache_file is not None and program is None
+        if program is None:
+            with phase(profiler, "parse"), open(self.filepath) as f:
+                for n, _ in enumerate(iter_blocks(self._lines(f), pgm_data), start=1):
+                    if n % CHUNK_LINES == 0:
+                        if not self.checkpoint():
+                            return False
+                        self.events.put(("load_progress", min(self.read / self.total, 1.0)))
+            program = pgm_data["commands"]
+        if self.simplify is not None:
+            if store:
+                # The cache keeps the program's own toolpath.
+                with phase(profiler, "store"):
+                    self._store(cache_file, program)
+                store = False
+            with phase(profiler, "simplify"):
+                simplified = simplify_toolpath(program, get_toolpath(program), self.simplify,
+                                               checkpoint=self.checkpoint)
+            if simplified is None:
+                return False
+            use_toolpath(program, simplified[0])
+        with phase(profiler, "toolpath"):
+            bounds = get_bounds(program)
+        scale = fit_scale(bounds, *self.view_size)
+        with phase(profiler, "scene"):
+            # Arcs are discretized to a quarter pixel at the fitted scale.
+            scene = LodScene(program, 0.25 / scale)
+        with phase(profiler, "timeline"):
+            get_timeline(program)
+        if store:
+            with phase(profiler, "store"):
+                self._store(cache_file, program)
+        self.events.put(("loaded", pgm_data, scene, scale))
+        return True
+
+    def _store(self, cache_file, program):
+        try:
+            write_cache(cache_file, program)
+        except OSError:
+            pass
+
+    def _lines(self, f):
+        # Feeds iter_blocks() while counting the characters read.
+        for txt_row in f:
+            self.read += len(txt_row)
+            yield txt_row
+
+
+class RunWorker(Worker):
+    """ Executes a compiled program on a MachineClient in chunks, from
+    start_block on (the machine is first put into the state before it,
+    see checkpoints.py).
+    Events: ("progress", commands done, total commands, segments done),
+    ("finished",).
+    """
+
+    def __init__(self, program, machine, events=None, profiler=None, start_block=0):
+        super().__init__(events)
+        self.program = program
+        self.machine = machine
+        self.profiler = profiler
+        self.start_block = start_block
+
+    def work(self):
+        program = self.program
+        rows = array("L")
+        with phase(self.profiler, "compile"):
+            compiled = compile_program(program, self.machine, rows)
+        segment_blocks = get_toolpath(program).blocks
+        starts = program.block_starts
+        total = len(compiled)
+        begin = 0
+        if self.start_block:
+            with phase(self.profiler, "seek"):
+                get_checkpoints(program, envelope=self.machine.envelope).seek(self.machine, self.start_block)
+            begin = bisect_left(rows, starts[self.start_block])
+
+        for first in range(begin, total, CHUNK_COMMANDS):
+            if not self.checkpoint():
+                return False
+            last = min(first + CHUNK_COMMANDS, total)
+            if self.profiler is None:
+                for method, args in compiled[first:last]:
+                    method(*args)
+            else:
+                run_compiled_profiled(self.profiler, compiled, rows, program, first, last)
+            # Segments of all blocks up to the one of the last executed command are done.
+            block = bisect_right(starts, rows[last - 1]) - 1
+            self.events.put(("progress", last, total, bisect_right(segment_blocks, block)))
+
+        self.events.put(("finished",))
+        return True
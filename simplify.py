@@ -0,0 +1,364 @@
+import math
+import time
+from arcs import PLANE_XY, DEFAULT_TOLERANCE
+from estimator import estimate_program
+from machineclient import MachineClient
+from main import compile_program, iter_blocks, run_compiled
+from sinks import SilentSink
+from toolpath import Toolpath, get_toolpath, LINEAR, ARC_CW, ARC_CCW, FEED_UPMIN
+from writer import GCodeWriter, check_rewritable, passthrough_words
+
+# Fewest points (segments + 1) replaced by a fitted arc.
+MIN_ARC_POINTS = 5
+# Points are collinear if the middle one is this close to the line through its neighbours [mm].
+COLLINEAR_EPS = 1e-9
+# Longest piece of a run simplified at once [segments]; bounds the cost of
+# rdp(), which is quadratic in the worst case.
+MAX_PIECE = 256
+# Runs are also cut at corners turning by more than this (cosine of 60 deg).
+SHARP_TURN_COS = 0.5
+# Segments simplified between two checkpoint() calls.
+CHECK_SEGMENTS = 5000
+
+
+def _distance(p, a, b):
+    """ Distance of point p from the segment a-b. """
+    abx, aby, abz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    apx, apy, apz = p[0] - a[0], p[1] - a[1], p[2] - a[2]
+    length2 = abx * abx + aby * aby + abz * abz
+    t = 0.0 if length2 == 0.0 else max(0.0, min(1.0, (apx * abx + apy * aby + apz * abz) / length2))
+    dx, dy, dz = apx - t * abx, apy - t * aby, apz - t * abz
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+def merge_collinear(points):
+    """ Drops the points lying on the straight line between their neighbours
+    (in the same direction), returning the indices kept.
+    """
+    kept = [0]
+    for i in range(1, len(points) - 1):
+        if _distance(points[i], points[kept[-1]], points[i + 1]) > COLLINEAR_EPS:
+            kept.append(i)
+    if len(points) > 1:
+        kept.append(len(points) - 1)
+    return kept
+
+
+def rdp(points, tolerance):
+    """ Ramer-Douglas-Peucker: returns the sorted indices of the points kept
+    so that no dropped point is farther than tolerance from the polyline.
+    """
+    if len(points) < 3:
+        return list(range(len(points)))
+    keep = bytearray(len(points))
+    keep[0] = keep[-1] = 1
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        a, b = points[first], points[last]
+        worst, worst_d = -1, tolerance
+        for i in range(first + 1, last):
+            d = _distance(points[i], a, b)
+            if d > worst_d:
+                worst, worst_d = i, d
+        if worst >= 0:
+            keep[worst] = 1
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [i for i in range(len(points)) if keep[i]]
+
+
+def _circle(p, q, r):
+    """ Center (x, y) of the circle through three XY points, or None if they are collinear. """
+    ax, ay = q[0] - p[0], q[1] - p[1]
+    bx, by = r[0] - p[0], r[1] - p[1]
+    d = 2.0 * (ax * by - ay * bx)
+    if abs(d) < 1e-12:
+        return None
+    a2, b2 = ax * ax + ay * ay, bx * bx + by * by
+    return p[0] + (by * a2 - ay * b2) / d, p[1] + (ax * b2 - bx * a2) / d
+
+
+def fit_arc(points, first, last, tolerance):
+    """ Returns (center, clockwise) of an XY arc through points[first..last]
+    that every point and chord midpoint stays within tolerance of, or None.
+    The points must keep their height and turn one way by less than a
+    full circle.
+    """
+    p, q, r = points[first], points[(first + last) // 2], points[last]
+    center = _circle(p, q, r)
+    if center is None:
+        return None
+    cx, cy = center
+    radius = math.hypot(p[0] - cx, p[1] - cy)
+    swept = 0.0
+    previous = math.atan2(p[1] - cy, p[0] - cx)
+    for i in range(first + 1, last + 1):
+        point = points[i]
+        if abs(point[2] - p[2]) > tolerance or abs(math.hypot(point[0] - cx, point[1] - cy) - radius) > tolerance:
+            return None
+        mx = (point[0] + points[i - 1][0]) / 2.0
+        my = (point[1] + points[i - 1][1]) / 2.0
+        if radius - math.hypot(mx - cx, my - cy) > tolerance:
+            return None
+        angle = math.atan2(point[1] - cy, point[0] - cx)
+        step = (angle - previous + math.pi) % (2.0 * math.pi) - math.pi
+        if step == 0.0 or (swept and (step > 0) != (swept > 0)):
+            return None
+        swept += step
+        previous = angle
+    if abs(swept) >= 2.0 * math.pi - 1e-6:
+        return None
+    return (cx, cy, p[2]), swept < 0
+
+
+def _longest_arc(points, first, tolerance):
+    """ Returns (last index, center, clockwise) of the longest arc fitted from
+    points[first], growing the span by doubling and then bisecting, or None
+    if there is none. The center is None if a straight move would do.
+    """
+    last = first + MIN_ARC_POINTS - 1
+    if last >= len(points):
+        return None
+    fit = fit_arc(points, first, last, tolerance)
+    if fit is None:
+        return None
+    best = (last, fit)
+    span = MIN_ARC_POINTS - 1
+    bad = None
+    while bad is None:
+        span *= 2
+        if first + span >= len(points):
+            span = len(points) - 1 - first
+            fit = fit_arc(points, first, first + span, tolerance)
+            if fit is not None:
+                best = (first + span, fit)
+            else:
+                bad = first + span
+            break
+        fit = fit_arc(points, first, first + span, tolerance)
+        if fit is None:
+            bad = first + span
+        else:
+            best = (first + span, fit)
+    if bad is not None:
+        lo, hi = best[0], bad
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            fit = fit_arc(points, first, mid, tolerance)
+            if fit is None:
+                hi = mid
+            else:
+                lo, best = mid, (mid, fit)
+    last, (center, clockwise) = best
+    # Points the chord already fits are left to rdp(), which avoids huge radii.
+    a, b = points[first], points[last]
+    if all(_distance(points[i], a, b) <= tolerance for i in range(first + 1, last)):
+        return last, None, clockwise
+    return last, center, clockwise
+
+
+class _Output:
+    """ Collects the simplified segments; every one copies the feed, tool
+    and block of a source segment.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.tp = Toolpath()
+        self.arcs = 0
+
+    def add(self, kind, n, start, end, center=(0.0, 0.0, 0.0)):
+        src, tp = self.source, self.tp
+        tp.kinds.append(kind)
+        tp.blocks.append(src.blocks[n])
+        for column, value in zip((tp.x0, tp.y0, tp.z0, tp.x1, tp.y1, tp.z1, tp.cx, tp.cy, tp.cz),
+                                 (*start, *end, *center)):
+            column.append(value)
+        tp.planes.append(PLANE_XY if kind >= ARC_CW else src.planes[n])
+        tp.feeds.append(src.feeds[n])
+        tp.feed_modes.append(src.feed_modes[n])
+        tp.tools.append(src.tools[n])
+
+    def copy(self, n):
+        src = self.source
+        self.add(src.kinds[n], n, (src.x0[n], src.y0[n], src.z0[n]), (src.x1[n], src.y1[n], src.z1[n]),
+                 (src.cx[n], src.cy[n], src.cz[n]))
+
+
+def _lines(out, first, points, indices):
+    """ Adds straight moves through points[indices]; point i ends source segment first + i - 1. """
+    for a, b in zip(indices, indices[1:]):
+        out.add(LINEAR, first + b - 1, points[a], points[b])
+
+
+def _simplify_run(out, first, points, tolerance, fit_arcs):
+    """ Adds the simplified form of the run of straight segments starting at
+    segment first, given as its points (start point first).
+    """
+    if not fit_arcs:
+        kept = merge_collinear(points)
+        reduced = [points[i] for i in kept]
+        _lines(out, first, points, [kept[i] for i in rdp(reduced, tolerance)])
+        return
+    # Straight stretches between fitted arcs are reduced like runs without arcs.
+    i = stretch = 0
+    while i < len(points) - 1:
+        arc = _longest_arc(points, i, tolerance)
+        if arc is None:
+            i += 1
+            continue
+        last, center, clockwise = arc
+        if center is None:
+            # Nearly straight: no arc starts before its end either.
+            i = last
+            continue
+        if i > stretch:
+            _simplify_run(out, first + stretch, points[stretch:i + 1], tolerance, False)
+        out.add(ARC_CW if clockwise else ARC_CCW, first + last - 1, points[i], points[last], center)
+        out.arcs += 1
+        i = stretch = last
+    if stretch < len(points) - 1:
+        _simplify_run(out, first + stretch, points[stretch:], tolerance, False)
+
+
+def _sharp(a, b, c, tolerance):
+    """ True if the path a-b-c turns at b by more than 60 deg and b is
+    farther than tolerance from a-c, so b is worth keeping anyway.
+    """
+    ux, uy, uz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    vx, vy, vz = c[0] - b[0], c[1] - b[1], c[2] - b[2]
+    dot = ux * vx + uy * vy + uz * vz
+    norms = math.sqrt((ux * ux + uy * uy + uz * uz) * (vx * vx + vy * vy + vz * vz))
+    return dot < SHARP_TURN_COS * norms and _distance(b, a, c) > tolerance
+
+
+def _pieces(points, tolerance):
+    """ Splits a run's points at sharp corners (see _sharp()) and into at
+    most MAX_PIECE segments. Yields (first, last) point indices; the pieces
+    share their end points.
+    """
+    first = 0
+    for i in range(1, len(points) - 1):
+        if i - first >= MAX_PIECE or _sharp(points[i - 1], points[i], points[i + 1], tolerance):
+            yield first, i
+            first = i
+    yield first, len(points) - 1
+
+
+def simplify_toolpath(program, tp, tolerance=DEFAULT_TOLERANCE, fit_arcs=False, checkpoint=None):
+    """ Returns a Toolpath with every run of consecutive straight cutting
+    moves (same feed, feed mode and tool) reduced: collinear points are
+    merged, the rest is thinned by Ramer-Douglas-Peucker and, with
+    fit_arcs, stretches following a circle in the XY plane become G02/G03
+    arcs. No kept point moves and no dropped point is farther than
+    tolerance [mm] from the new path. Rapids, arcs, inverse time (G93)
+    moves and the moves of barrier blocks (see writer.passthrough_words())
+    are kept as they are; a merged segment belongs to the block of the
+    last segment it replaces. Runs are simplified in pieces (see _pieces()),
+    so the time grows linearly with the run length. Returns (Toolpath,
+    number of fitted arcs), or None if checkpoint (called every few
+    thousand segments) returns False.
+    """
+    barriers = bytearray(len(program))
+    for b in range(len(program)):
+        if passthrough_words(program, b):
+            barriers[b] = 1
+    kinds, blocks = tp.kinds, tp.blocks
+    out = _Output(tp)
+    n = done = 0
+    while n < len(tp):
+        if kinds[n] != LINEAR or tp.feed_modes[n] != FEED_UPMIN or barriers[blocks[n]]:
+            out.copy(n)
+            n += 1
+            continue
+        stop = n + 1
+        while (stop < len(tp) and kinds[stop] == LINEAR and not barriers[blocks[stop]]
+               and tp.feeds[stop] == tp.feeds[n] and tp.feed_modes[stop] == FEED_UPMIN
+               and tp.tools[stop] == tp.tools[n]):
+            stop += 1
+        points = [(tp.x0[n], tp.y0[n], tp.z0[n])]
+        points.extend(zip(tp.x1[n:stop], tp.y1[n:stop], tp.z1[n:stop]))
+        for first, last in _pieces(points, tolerance):
+            _simplify_run(out, n + first, points[first:last + 1], tolerance, fit_arcs)
+            done += last - first
+            if done >= CHECK_SEGMENTS:
+                done = 0
+                if checkpoint is not None and not checkpoint():
+                    return None
+        n = stop
+    return out.tp, out.arcs
+
+
+def write_simplified(program, tp):
+    """ Returns the program text of a (simplified) toolpath: every block's
+    passthrough commands, then the segments it owns.
+    """
+    writer = GCodeWriter(program.pgm_num)
+    n = 0
+    for b in range(len(program)):
+        words = passthrough_words(program, b)
+        if words:
+            writer.raw(" ".join(words))
+        while n < len(tp) and tp.blocks[n] == b:
+            writer.segment(tp, n)
+            n += 1
+    return writer.text()
+
+
+def use_toolpath(program, tp):
+    """ Makes the simulator's and visualizer's toolpath passes (bounds,
+    estimate, timeline, scene, ...) use tp instead of the program's own.
+    """
+    program.cache.clear()
+    program.cache["toolpath"] = tp
+
+
+def _execute_seconds(program):
+    """ Wall time of compiling and executing a Program without output [s]. """
+    begin = time.perf_counter()
+    run_compiled(compile_program(program, MachineClient(SilentSink())))
+    return time.perf_counter() - begin
+
+
+class Report:
+    """ Result of simplify_program(); toolpath is the simplified Toolpath (see use_toolpath()). """
+
+    def __init__(self, toolpath, segments_before, segments_after, arcs, run_before, run_after,
+                 time_before, time_after):
+        self.toolpath = toolpath
+        self.segments_before = segments_before
+        self.segments_after = segments_after
+        self.arcs = arcs
+        self.run_before = run_before
+        self.run_after = run_after
+        self.time_before = time_before
+        self.time_after = time_after
+
+    def lines(self):
+        saved = 100.0 * (1.0 - self.segments_after / self.segments_before) if self.segments_before else 0.0
+        return [f"Segments: {self.segments_before} -> {self.segments_after} ({saved:.1f}% fewer, "
+                f"{self.arcs} fitted arcs)",
+                f"Simulation runtime: {self.run_before:.3f} s -> {self.run_after:.3f} s",
+                f"Estimated time: {self.time_before:.1f} s -> {self.time_after:.1f} s"]
+
+
+def simplify_program(program, tolerance=DEFAULT_TOLERANCE, fit_arcs=False):
+    """ Simplifies the dense straight moves of a Program (see
+    simplify_toolpath()). Returns (G-code text, Report); the text is
+    re-parsed and both programs executed to measure the runtime saved.
+    Raises ValueError if the program cannot be rewritten (see
+    writer.check_rewritable()).
+    """
+    check_rewritable(program)
+    tp = get_toolpath(program)
+    simplified, arcs = simplify_toolpath(program, tp, tolerance, fit_arcs)
+    text = write_simplified(program, simplified)
+    pgm_data = {}
+    for _ in iter_blocks(text.splitlines(), pgm_data):
+        pass
+    rewritten = pgm_data["commands"]
+    report = Report(simplified, len(tp), len(simplified), arcs,
+                    _execute_seconds(program), _execute_seconds(rewritten),
+                    estimate_program(program).total, estimate_program(rewritten).total)
+    return text, report
@@ -0,0 +1,84 @@
+import sys
+import time
+from collections import deque
+
+# Event levels.
+DEBUG = 10
+INFO = 20
+ERROR = 40
+OFF = 100
+
+LEVELS = {"debug": DEBUG, "info": INFO, "error": ERROR}
+
+
+class TextSink:
+    """ Human-readable output, as printed by the simulator so far.
+    Every sink drops events below its level.
+    """
+
+    def __init__(self, level=DEBUG, stream=None):
+        self.level = level
+        self.stream = stream
+
+    def emit(self, level, message, status=True):
+        if level < self.level:
+            return
+        print(4 * "-" + "> " + message if status else message, file=self.stream or sys.stdout)
+
+
+class BufferedSink(TextSink):
+    """ Collects the text output in memory and writes it in one go on flush(). """
+
+    def __init__(self, level=DEBUG, stream=None):
+        super().__init__(level, stream)
+        self.lines = []
+
+    def emit(self, level, message, status=True):
+        if level < self.level:
+            return
+        self.lines.append(4 * "-" + "> " + message if status else message)
+
+    def flush(self):
+        if self.lines:
+            (self.stream or sys.stdout).write("\n".join(self.lines) + "\n")
+            self.lines.clear()
+
+
+class StructuredSink:
+    """ Keeps the last `capacity` events as (timestamp, level, message) tuples. """
+
+    def __init__(self, level=INFO, capacity=10000):
+        self.level = level
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, level, message, status=True):
+        if level < self.level:
+            return
+        self.records.append((time.perf_counter(), level, message))
+
+    def errors(self):
+        return [message for _, level, message in self.records if level >= ERROR]
+
+
+class SilentSink:
+    """ Discards everything; MachineClient skips even formatting the messages. """
+    level = OFF
+
+    def emit(self, level, message, status=True):
+        pass
+
+
+SINKS = {
+    "text": TextSink,
+    "buffered": BufferedSink,
+    "structured": StructuredSink,
+    "silent": SilentSink,
+}
+
+
+def make_sink(name="text", level=None):
+    """ Creates a sink by name ("text", "buffered", "structured", "silent"). """
+    sink = SINKS[name]()
+    if level is not None and name != "silent":
+        sink.level = LEVELS.get(level, level)
+    return sink
@@ -0,0 +1,305 @@
+import math
+from array import array
+from arcs import arc_points
+from toolpath import get_toolpath, get_bounds, RAPID, ARC_CW
+
+DEFAULT_TOOL_DIAMETER = 6.0
+# Side of the square tiles used for dirty tracking [cells].
+TILE = 64
+# Largest grid side chosen automatically [cells].
+MAX_CELLS = 2000
+
+
+class ToolTable:
+    """ Flat end mill diameters [mm] by tool number (the T word).
+    Tools missing from the table use the default diameter.
+    """
+
+    def __init__(self, diameters=None, default=DEFAULT_TOOL_DIAMETER):
+        self.diameters = dict(diameters or {})
+        self.default = default
+
+    def diameter(self, tool):
+        return self.diameters.get(tool, self.default)
+
+    @classmethod
+    def load(cls, path, default=DEFAULT_TOOL_DIAMETER):
+        """ Reads a tool table with one "<tool number> <diameter>" pair per
+        line, e.g. "T3 6.35"; text after ";" is ignored.
+        """
+        diameters = {}
+        with open(path) as f:
+            for line_no, line in enumerate(f, start=1):
+                fields = line.split(";")[0].split()
+                if not fields:
+                    continue
+                try:
+                    diameters[int(fields[0].upper().lstrip("T"))] = float(fields[1])
+                except (IndexError, ValueError):
+                    raise ValueError(f"{path}:{line_no}: expected '<tool> <diameter>'") from None
+        return cls(diameters, default)
+
+
+class Heightmap:
+    """ Top surface of a rectangular stock block sampled on a regular grid.
+    heights[j * nx + i] is the Z of the cell centered at
+    (x_min + (i + 0.5) * cell, y_min + (j + 0.5) * cell). Stamping a move
+    lowers every cell the tool touches to the lowest tool bottom over it;
+    the tiles changed since the last take_dirty() call are tracked so a
+    viewer only has to refresh those.
+    """
+
+    def __init__(self, x_min, y_min, x_max, y_max, cell, top=0.0):
+        self.x_min = x_min
+        self.y_min = y_min
+        self.cell = cell
+        self.nx = max(1, math.ceil((x_max - x_min) / cell))
+        self.ny = max(1, math.ceil((y_max - y_min) / cell))
+        self.top = top
+        self.heights = array("d", [top]) * (self.nx * self.ny)
+        self.dirty = set()
+
+    @classmethod
+    def for_program(cls, program, tools=None, cell=None, top=0.0, max_cells=MAX_CELLS):
+        """ Stock covering the program's extents plus the largest tool radius.
+        The cell size defaults to the one giving at most max_cells per side.
+        """
+        bounds = get_bounds(program)
+        tools = tools or ToolTable()
+        used = set(get_toolpath(program).tools)
+        margin = max([tools.diameter(t) for t in used] or [tools.default]) / 2.0 + 1.0
+        if bounds is None:
+            x0 = y0 = -margin
+            x1 = y1 = margin
+        else:
+            x0, y0 = bounds.x_min - margin, bounds.y_min - margin
+            x1, y1 = bounds.x_max + margin, bounds.y_max + margin
+        if cell is None:
+            cell = max(x1 - x0, y1 - y0) / max_cells
+        return cls(x0, y0, x1, y1, cell, top)
+
+    def take_dirty(self):
+        """ Returns and resets the set of changed (tile x, tile y) indices. """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def removed_volume(self):
+        """ Material removed so far [mm^3]. """
+        top = self.top
+        return math.fsum(top - h for h in self.heights if h < top) * self.cell * self.cell
+
+    def stamp_move(self, x0, y0, z0, x1, y1, z1, radius):
+        """ Sweeps a flat end mill of the given radius along a straight move. """
+        if min(z0, z1) >= self.top:
+            return
+        if z0 == z1 or (x0 == x1 and y0 == y1):
+            self._stamp_level(x0, y0, x1, y1, min(z0, z1), radius)
+            return
+        cell = self.cell
+        length = math.hypot(x1 - x0, y1 - y0)
+        ux, uy = (x1 - x0) / length, (y1 - y0) / length
+        slope = (z1 - z0) / length
+        r2 = radius * radius
+        nx, heights = self.nx, self.heights
+        x_base = self.x_min + 0.5 * cell
+
+        touched = None
+        for j, i_lo, i_hi in self._rows(x0, y0, x1, y1, radius):
+            a, b = j * nx + i_lo, j * nx + i_hi + 1
+            row = heights[a:b]
+            py = self.y_min + (j + 0.5) * cell - y0
+            changed = False
+            # Along the move the tool covers the cell from s - w to s + w;
+            # Z is linear in s, so the lowest bottom is at one of the ends.
+            for n in range(len(row)):
+                px = x_base + (i_lo + n) * cell - x0
+                s = px * ux + py * uy
+                w = math.sqrt(max(r2 - (px * uy - py * ux) ** 2, 0.0))
+                z = min(z0 + slope * min(max(s - w, 0.0), length),
+                        z0 + slope * min(max(s + w, 0.0), length))
+                if z < row[n]:
+                    row[n] = z
+                    changed = True
+            if changed:
+                heights[a:b] = row
+                touched = self._touch(touched, j, i_lo, i_hi)
+        self._mark_dirty(touched)
+
+    def _stamp_level(self, x0, y0, x1, y1, z, radius):
+        nx, heights = self.nx, self.heights
+        touched = None
+        for j, i_lo, i_hi in self._rows(x0, y0, x1, y1, radius):
+            a, b = j * nx + i_lo, j * nx + i_hi + 1
+            row = heights[a:b]
+            if max(row) > z:
+                heights[a:b] = array("d", [h if h < z else z for h in row])
+                touched = self._touch(touched, j, i_lo, i_hi)
+        self._mark_dirty(touched)
+
+    def _rows(self, x0, y0, x1, y1, radius):
+        """ Yields (row, first column, last column) of the cells whose centers
+        lie in the capsule swept by a disk from (x0, y0) to (x1, y1).
+        """
+        cell, x_min, y_min = self.cell, self.x_min, self.y_min
+        r2 = radius * radius
+        length = math.hypot(x1 - x0, y1 - y0)
+        ux, uy = ((x1 - x0) / length, (y1 - y0) / length) if length > 0.0 else (1.0, 0.0)
+        last_i = self.nx - 1
+
+        j_lo = max(0, math.floor((min(y0, y1) - radius - y_min) / cell))
+        j_hi = min(self.ny - 1, math.floor((max(y0, y1) + radius - y_min) / cell))
+        for j in range(j_lo, j_hi + 1):
+            y = y_min + (j + 0.5) * cell
+            lo, hi = math.inf, -math.inf
+            for cx, dy in ((x0, y - y0), (x1, y - y1)):
+                if dy * dy <= r2:
+                    h = math.sqrt(r2 - dy * dy)
+                    lo, hi = min(lo, cx - h), max(hi, cx + h)
+            if length > 0.0:
+                # Band along the move: 0 <= (P - A).u <= length and |(P - A).n| <= radius.
+                dy = y - y0
+                band_lo, band_hi = -math.inf, math.inf
+                if ux != 0.0:
+                    a = x0 - dy * uy / ux
+                    b = a + length / ux
+                    band_lo, band_hi = min(a, b), max(a, b)
+                elif not 0.0 <= dy * uy <= length:
+                    band_lo = math.inf
+                if uy != 0.0:
+                    c = x0 + dy * ux / uy
+                    half = radius / abs(uy)
+                    band_lo, band_hi = max(band_lo, c - half), min(band_hi, c + half)
+                elif abs(dy) > radius:
+                    band_lo = math.inf
+                if band_lo <= band_hi:
+                    lo, hi = min(lo, band_lo), max(hi, band_hi)
+            if lo > hi:
+                continue
+            i_lo = max(0, math.ceil((lo - x_min) / cell - 0.5))
+            i_hi = min(last_i, math.floor((hi - x_min) / cell - 0.5))
+            if i_lo <= i_hi:
+                yield j, i_lo, i_hi
+
+    @staticmethod
+    def _touch(touched, j, i_lo, i_hi):
+        """ Grows the (j_lo, j_hi, i_lo, i_hi) box of changed cells. """
+        if touched is None:
+            return (j, j, i_lo, i_hi)
+        return (min(touched[0], j), max(touched[1], j), min(touched[2], i_lo), max(touched[3], i_hi))
+
+    def _mark_dirty(self, touched):
+        if touched is None:
+            return
+        j_lo, j_hi, i_lo, i_hi = touched
+        for tj in range(j_lo // TILE, j_hi // TILE + 1):
+            for ti in range(i_lo // TILE, i_hi // TILE + 1):
+                self.dirty.add((ti, tj))
+
+    def shade(self, depth=None):
+        """ Returns the heightmap as an 8-bit grayscale PGM image (white = stock
+        top, black = depth below it, default the deepest cut), top row = y max.
+        """
+        low = self.top - depth if depth is not None else min(self.heights)
+        span = (self.top - low) or 1.0
+        nx = self.nx
+        pixels = bytearray()
+        for j in range(self.ny - 1, -1, -1):
+            row = self.heights[j * nx:(j + 1) * nx]
+            pixels += bytes(min(255, max(0, int(255 * (h - low) / span))) for h in row)
+        return b"P5 %d %d 255\n" % (nx, self.ny) + bytes(pixels)
+
+
+def simulate_stock(program, tools=None, heightmap=None):
+    """ Stamps all feed moves (G01-G03) of a Program into a Heightmap,
+    using the tool diameter of the T word in effect. Arcs are swept as
+    chords within half a cell. Runs of level moves are batched into single
+    sweeps while their points stay within half a cell of the swept chord,
+    which the grid cannot resolve anyway. Returns the Heightmap.
+    """
+    tools = tools or ToolTable()
+    heightmap = heightmap or Heightmap.for_program(program, tools)
+    tp = get_toolpath(program)
+    sweep = _Sweep(heightmap)
+    tolerance = heightmap.cell / 2.0
+    radii = {}
+
+    for n in range(len(tp)):
+        kind = tp.kinds[n]
+        if kind == RAPID:
+            sweep.flush()
+            continue
+        tool = tp.tools[n]
+        if tool not in radii:
+            radii[tool] = tools.diameter(tool) / 2.0
+        sweep.move_to(tp.x0[n], tp.y0[n], tp.z0[n], radii[tool])
+        if kind >= ARC_CW:
+            start = (tp.x0[n], tp.y0[n], tp.z0[n])
+            end = (tp.x1[n], tp.y1[n], tp.z1[n])
+            center = (tp.cx[n], tp.cy[n], tp.cz[n])
+            for x, y, z in arc_points(start, end, center, tp.planes[n], kind == ARC_CW, tolerance):
+                sweep.line_to(x, y, z)
+        else:
+            sweep.line_to(tp.x1[n], tp.y1[n], tp.z1[n])
+    sweep.flush()
+    return heightmap
+
+
+class _Sweep:
+    """ Accumulates consecutive moves and stamps them as few straight sweeps
+    as the heightmap resolution allows.
+    """
+
+    # Most points merged into one sweep (bounds the quadratic deviation check).
+    MAX_POINTS = 64
+
+    def __init__(self, heightmap):
+        self.heightmap = heightmap
+        self.tolerance = heightmap.cell / 2.0
+        self.points = []
+        self.radius = None
+
+    def move_to(self, x, y, z, radius):
+        """ Continues the current chain if it ends at (x, y, z) with the same tool. """
+        points = self.points
+        if points and (radius != self.radius or points[-1] != (x, y, z)):
+            self.flush()
+        if not self.points:
+            self.points.append((x, y, z))
+            self.radius = radius
+
+    def line_to(self, x, y, z):
+        points = self.points
+        x0, y0, z0 = points[0]
+        if z != z0 or z != points[-1][2] or len(points) >= self.MAX_POINTS or not self._fits(x, y):
+            self._stamp()
+        self.points.append((x, y, z))
+
+    def _fits(self, x, y):
+        """ True if all intermediate points lie within tolerance of the chord to (x, y). """
+        x0, y0, _ = self.points[0]
+        dx, dy = x - x0, y - y0
+        length = math.hypot(dx, dy)
+        if length == 0.0:
+            return False
+        limit = self.tolerance * length
+        for px, py, _ in self.points[1:]:
+            if abs((px - x0) * dy - (py - y0) * dx) > limit:
+                return False
+            # Also reject points running back behind the start or beyond the end.
+            s = (px - x0) * dx + (py - y0) * dy
+            if s < 0.0 or s > length * length:
+                return False
+        return True
+
+    def _stamp(self):
+        """ Stamps the chain as one sweep and restarts it at its last point. """
+        points = self.points
+        if len(points) > 1:
+            (x0, y0, z0), (x1, y1, z1) = points[0], points[-1]
+            self.heightmap.stamp_move(x0, y0, z0, x1, y1, z1, self.radius)
+        self.points = [points[-1]]
+
+    def flush(self):
+        if self.points:
+            self._stamp()
+        self.points = []
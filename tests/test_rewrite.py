@@ -0,0 +1,76 @@
+""" Round trips of the program rewriting passes (optimizer.py, simplify.py):
+the commands of barrier blocks must come back unchanged, and programs that
+cannot be written back losslessly are refused.
+Run with: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import iter_blocks
+from optimizer import optimize_program
+from simplify import simplify_program
+from writer import RESOLVED_OPS
+
+PROGRAM = """%
+O0042
+G21 G90 G17
+T3 M06
+S12000 M03
+G28 X12.3456789 Y-0.125
+G00 X0 Y0 Z5
+G01 Z-1 F300
+G01 X10 Y0
+G01 X20 Y0.0001
+G01 X30 Y0
+M08
+G00 Z5
+G00 X50 Y50
+G01 Z-1 F300
+G02 X60 Y50 I5 J0
+G00 Z5
+M09 M05
+M30
+%
+"""
+
+
+def parse(text):
+    pgm_data = {}
+    for _ in iter_blocks(text.splitlines(), pgm_data):
+        pass
+    return pgm_data["commands"]
+
+
+def barrier_commands(program):
+    """ The commands the segments do not carry, as (op, words) in program order. """
+    return [(program.ops[k], program.command(k).to_dict()) for k in range(program.num_commands)
+            if program.ops[k] not in RESOLVED_OPS]
+
+
+class RewriteTest(unittest.TestCase):
+
+    def check_round_trip(self, rewrite):
+        program = parse(PROGRAM)
+        text, _ = rewrite(program)
+        self.assertEqual(barrier_commands(parse(text)), barrier_commands(program))
+
+    def test_optimize_keeps_barrier_blocks(self):
+        self.check_round_trip(optimize_program)
+
+    def test_simplify_keeps_barrier_blocks(self):
+        self.check_round_trip(lambda program: simplify_program(program, 0.01, fit_arcs=True))
+
+    def test_lossy_programs_are_refused(self):
+        for line in ("G43 H1", "G04 P1.5", "G92.1", "M03 X5"):
+            program = parse(PROGRAM.replace("M08", line))
+            for rewrite in (optimize_program, simplify_program):
+                with self.subTest(line=line, rewrite=rewrite.__name__):
+                    with self.assertRaisesRegex(ValueError, "line 12"):
+                        rewrite(program)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+""" simplify.py on serpentine raster toolpaths, where every corner is kept
+and plain Ramer-Douglas-Peucker takes quadratic time.
+Run with: python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from main import iter_blocks
+from simplify import simplify_toolpath
+from synth import zigzag_program
+from toolpath import get_toolpath
+
+
+def serpentine(n_lines):
+    pgm_data = {}
+    for _ in iter_blocks(zigzag_program(n_lines).splitlines(), pgm_data):
+        pass
+    program = pgm_data["commands"]
+    return program, get_toolpath(program)
+
+
+class SerpentineTest(unittest.TestCase):
+
+    def test_corners_are_kept(self):
+        program, tp = serpentine(400)
+        for fit_arcs in (False, True):
+            simplified, arcs = simplify_toolpath(program, tp, 0.01, fit_arcs)
+            self.assertEqual(len(simplified), len(tp))
+            self.assertEqual(arcs, 0)
+
+    def test_time_is_linear(self):
+        # Took minutes before runs were simplified in bounded pieces.
+        program, tp = serpentine(20000)
+        start = time.perf_counter()
+        simplify_toolpath(program, tp, 0.01, fit_arcs=True)
+        self.assertLess(time.perf_counter() - start, 10.0)
+
+    def test_checkpoint_cancels(self):
+        program, tp = serpentine(20000)
+        self.assertIsNone(simplify_toolpath(program, tp, 0.01, checkpoint=lambda: False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,325 @@
+import math
+from array import array
+from arcs import (arc_center, arc_extrema, arc_length, arc_point, arc_points, ArcError,
+                  PLANE_XY, PLANE_ZX, PLANE_YZ, PLANE_OFFSETS, DEFAULT_TOLERANCE)
+from program import (G00, G01, G02, G03, G17, G18, G19, G20, G21, G90, G91, G92, G93, G94, OP_T,
+                     WORD_BITS)
+
+# Feed rate modes of a segment.
+FEED_UPMIN = 0
+FEED_INVTIME = 1
+
+# Segment kinds.
+RAPID = 0
+LINEAR = 1
+ARC_CW = 2
+ARC_CCW = 3
+
+MOTION_KINDS = {G00: RAPID, G01: LINEAR, G02: ARC_CW, G03: ARC_CCW}
+PLANES = {G17: PLANE_XY, G18: PLANE_ZX, G19: PLANE_YZ}
+# Work coordinate systems G54-G59.
+WORK_SYSTEMS = range(54, 60)
+MM_PER_INCH = 25.4
+
+_X, _Y, _Z = WORD_BITS["X"], WORD_BITS["Y"], WORD_BITS["Z"]
+_R, _F, _T = WORD_BITS["R"], WORD_BITS["F"], WORD_BITS["T"]
+# Words that make an arc without axis words a full circle, per plane.
+_CIRCLE_WORDS = {plane: WORD_BITS[offsets[0]] | WORD_BITS[offsets[1]] | _R
+                 for plane, offsets in PLANE_OFFSETS.items()}
+
+
+class Toolpath:
+    """ Motion segments of a program resolved to absolute positions.
+    Segment n moves from (x0[n], y0[n], z0[n]) to (x1[n], y1[n], z1[n]);
+    arcs also store their center (cx[n], cy[n], cz[n]) and plane (see arcs.py).
+    blocks[n] is the index of
+    the block the segment came from, feeds[n] the F word in effect and
+    feed_modes[n] whether it is units/min or inverse time (G93);
+    tools[n] is the number of the last T word (0 before the first one).
+    """
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.blocks = array("L")
+        self.x0 = array("d")
+        self.y0 = array("d")
+        self.z0 = array("d")
+        self.x1 = array("d")
+        self.y1 = array("d")
+        self.z1 = array("d")
+        self.cx = array("d")
+        self.cy = array("d")
+        self.cz = array("d")
+        self.planes = array("B")
+        self.feeds = array("d")
+        self.feed_modes = array("B")
+        self.tools = array("H")
+
+    def __len__(self):
+        return len(self.kinds)
+
+
+class Bounds:
+    __slots__ = ("x_min", "x_max", "y_min", "y_max", "z_min", "z_max")
+
+    def __init__(self, x_min, x_max, y_min, y_max, z_min, z_max):
+        self.x_min, self.x_max = x_min, x_max
+        self.y_min, self.y_max = y_min, y_max
+        self.z_min, self.z_max = z_min, z_max
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def get_toolpath(program):
+    """ Returns the (cached) Toolpath of a Program. """
+    toolpath = program.cache.get("toolpath")
+    if toolpath is None:
+        toolpath = program.cache["toolpath"] = build_toolpath(program)
+    return toolpath
+
+
+def get_bounds(program):
+    """ Returns the (cached) machined extents of a Program, or None if it has no motion. """
+    if "bounds" not in program.cache:
+        program.cache["bounds"] = compute_bounds(get_toolpath(program))
+    return program.cache["bounds"]
+
+
+def build_toolpath(program, work_offsets=None):
+    """ Replays the modal state (G00-G03, G17-G19, G20/G21, G90/G91, G92,
+    G54-G59, G93/G94) over the command rows in one pass and resolves every
+    motion command to a segment in absolute machine coordinates [mm].
+    Inch words (G20) are scaled to mm, including arc offsets, radii and
+    units/min feeds.
+    Args:
+      work_offsets (dict): G code number (54-59) -> (x, y, z) origin of that
+        work coordinate system in machine coordinates [mm]; missing systems
+        are at the machine origin
+    """
+    tp = Toolpath()
+    ops, masks, words = program.ops, program.masks, program.words
+    wx, wy, wz = words["X"], words["Y"], words["Z"]
+    wr, wf, wt = words["R"], words["F"], words["T"]
+    starts = program.block_starts
+    work_offsets = work_offsets or {}
+
+    x = y = z = 0.0
+    feed = 0.0
+    feed_mode = FEED_UPMIN
+    plane = PLANE_XY
+    incremental = False
+    unit = 1.0
+    # Program origin in machine coordinates: work offset (G54 at start) plus G92 shift.
+    work = work_offsets.get(54, (0.0, 0.0, 0.0))
+    shift = [0.0, 0.0, 0.0]
+    ox, oy, oz = work
+    tool = 0
+    block = 0
+
+    for k in range(len(ops)):
+        while starts[block + 1] <= k:
+            block += 1
+        op = ops[k]
+        mask = masks[k]
+
+        if op == G90:
+            incremental = False
+        elif op == G91:
+            incremental = True
+        elif op == G93:
+            feed_mode = FEED_INVTIME
+        elif op == G94:
+            feed_mode = FEED_UPMIN
+        elif op == G20:
+            unit = MM_PER_INCH
+        elif op == G21:
+            unit = 1.0
+        elif op in PLANES:
+            plane = PLANES[op]
+        elif op in WORK_SYSTEMS:
+            work = work_offsets.get(op, (0.0, 0.0, 0.0))
+            ox, oy, oz = (work[a] + shift[a] for a in range(3))
+        elif op == G92:
+            # The current position gets the given program coordinates.
+            for a, (bit, column, pos) in enumerate(((_X, wx, x), (_Y, wy, y), (_Z, wz, z))):
+                if mask & bit:
+                    shift[a] = pos - work[a] - column[k] * unit
+            ox, oy, oz = (work[a] + shift[a] for a in range(3))
+        elif op == OP_T and mask & _T:
+            tool = int(wt[k])
+        if mask & _F:
+            feed = wf[k] * unit if feed_mode == FEED_UPMIN else wf[k]
+
+        kind = MOTION_KINDS.get(op)
+        if kind is None:
+            continue
+        if not mask & (_X | _Y | _Z):
+            # An arc with only its center (e.g. G02 I10) is a full circle ending where it starts.
+            if kind < ARC_CW or not mask & _CIRCLE_WORDS[plane]:
+                continue
+
+        if incremental:
+            nx = x + wx[k] * unit if mask & _X else x
+            ny = y + wy[k] * unit if mask & _Y else y
+            nz = z + wz[k] * unit if mask & _Z else z
+        else:
+            nx = ox + wx[k] * unit if mask & _X else x
+            ny = oy + wy[k] * unit if mask & _Y else y
+            nz = oz + wz[k] * unit if mask & _Z else z
+
+        cx = cy = cz = 0.0
+        if kind >= ARC_CW:
+            first, second = PLANE_OFFSETS[plane]
+            offsets = (words[first][k] * unit if mask & WORD_BITS[first] else None,
+                       words[second][k] * unit if mask & WORD_BITS[second] else None)
+            try:
+                cx, cy, cz = arc_center((x, y, z), (nx, ny, nz), plane, kind == ARC_CW,
+                                        offsets, wr[k] * unit if mask & _R else None)
+            except ArcError:
+                kind = LINEAR
+
+        tp.kinds.append(kind)
+        tp.blocks.append(block)
+        tp.x0.append(x)
+        tp.y0.append(y)
+        tp.z0.append(z)
+        tp.x1.append(nx)
+        tp.y1.append(ny)
+        tp.z1.append(nz)
+        tp.cx.append(cx)
+        tp.cy.append(cy)
+        tp.cz.append(cz)
+        tp.planes.append(plane)
+        tp.feeds.append(feed)
+        tp.feed_modes.append(feed_mode)
+        tp.tools.append(tool)
+        x, y, z = nx, ny, nz
+
+    return tp
+
+
+class BlockPositions:
+    """ Absolute tool position [mm] around every block: block i starts at
+    (x[i], y[i], z[i]) and ends at (x[i + 1], y[i + 1], z[i + 1]).
+    """
+
+    def __init__(self, tp, num_blocks):
+        self.x = array("d", bytes(8 * (num_blocks + 1)))
+        self.y = array("d", bytes(8 * (num_blocks + 1)))
+        self.z = array("d", bytes(8 * (num_blocks + 1)))
+        x = y = z = 0.0
+        n = 0
+        for i in range(num_blocks):
+            while n < len(tp) and tp.blocks[n] == i:
+                x, y, z = tp.x1[n], tp.y1[n], tp.z1[n]
+                n += 1
+            self.x[i + 1], self.y[i + 1], self.z[i + 1] = x, y, z
+
+    def start(self, i):
+        return self.x[i], self.y[i], self.z[i]
+
+    def end(self, i):
+        return self.x[i + 1], self.y[i + 1], self.z[i + 1]
+
+
+def get_block_positions(program):
+    """ Returns the (cached) BlockPositions of a Program. """
+    positions = program.cache.get("positions")
+    if positions is None:
+        positions = program.cache["positions"] = BlockPositions(get_toolpath(program), len(program))
+    return positions
+
+
+def compute_bounds(tp):
+    """ Computes the extents of all segment end points plus the axis
+    extrema of every arc that sweeps past 0/90/180/270 degrees.
+    """
+    if not len(tp):
+        return None
+
+    x_min, x_max = min(tp.x1), max(tp.x1)
+    y_min, y_max = min(tp.y1), max(tp.y1)
+    z_min, z_max = min(tp.z1), max(tp.z1)
+
+    for n in range(len(tp)):
+        kind = tp.kinds[n]
+        if kind < ARC_CW:
+            continue
+        for px, py, pz in arc_extrema(*_arc(tp, n), kind == ARC_CW):
+            x_min, x_max = min(x_min, px), max(x_max, px)
+            y_min, y_max = min(y_min, py), max(y_max, py)
+            z_min, z_max = min(z_min, pz), max(z_max, pz)
+
+    return Bounds(x_min, x_max, y_min, y_max, z_min, z_max)
+
+
+def _arc(tp, n):
+    """ Returns (start, end, center, plane) of segment n for the arcs.py functions. """
+    return ((tp.x0[n], tp.y0[n], tp.z0[n]), (tp.x1[n], tp.y1[n], tp.z1[n]),
+            (tp.cx[n], tp.cy[n], tp.cz[n]), tp.planes[n])
+
+
+def segment_point(tp, n, fraction):
+    """ Returns the (x, y, z) point after the given fraction (0..1) of segment n. """
+    if tp.kinds[n] >= ARC_CW:
+        return arc_point(*_arc(tp, n), tp.kinds[n] == ARC_CW, fraction)
+    return (tp.x0[n] + (tp.x1[n] - tp.x0[n]) * fraction,
+            tp.y0[n] + (tp.y1[n] - tp.y0[n]) * fraction,
+            tp.z0[n] + (tp.z1[n] - tp.z0[n]) * fraction)
+
+
+def segment_lengths(tp):
+    """ Returns the path length of every segment (arc length for arcs). """
+    lengths = array("d", bytes(8 * len(tp)))
+    for n in range(len(tp)):
+        if tp.kinds[n] >= ARC_CW:
+            lengths[n] = arc_length(*_arc(tp, n), tp.kinds[n] == ARC_CW)
+        else:
+            lengths[n] = math.sqrt((tp.x1[n] - tp.x0[n]) ** 2 + (tp.y1[n] - tp.y0[n]) ** 2
+                                   + (tp.z1[n] - tp.z0[n]) ** 2)
+    return lengths
+
+
+class Polyline:
+    """ Discretized toolpath: the points of segment n are
+    xs/ys/zs[starts[n]:starts[n + 1]], the first one being the segment start.
+    """
+
+    def __init__(self):
+        self.starts = array("L", [0])
+        self.xs = array("d")
+        self.ys = array("d")
+        self.zs = array("d")
+
+
+def get_polyline(program, tolerance=DEFAULT_TOLERANCE):
+    """ Returns the (cached) discretized toolpath of a Program. """
+    key = ("polyline", tolerance)
+    if key not in program.cache:
+        program.cache[key] = discretize_toolpath(get_toolpath(program), tolerance)
+    return program.cache[key]
+
+
+def discretize_toolpath(tp, tolerance=DEFAULT_TOLERANCE):
+    """ Converts all segments into points in one batch: lines contribute
+    their end points, arcs their chord points from arcs.arc_points().
+    """
+    poly = Polyline()
+    xs, ys, zs, starts = poly.xs, poly.ys, poly.zs, poly.starts
+    for n in range(len(tp)):
+        xs.append(tp.x0[n])
+        ys.append(tp.y0[n])
+        zs.append(tp.z0[n])
+        kind = tp.kinds[n]
+        if kind >= ARC_CW:
+            for x, y, z in arc_points(*_arc(tp, n), kind == ARC_CW, tolerance):
+                xs.append(x)
+                ys.append(y)
+                zs.append(z)
+        else:
+            xs.append(tp.x1[n])
+            ys.append(tp.y1[n])
+            zs.append(tp.z1[n])
+        starts.append(len(xs))
+    return poly
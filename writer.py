@@ -0,0 +1,135 @@
+from bisect import bisect_right
+from arcs import PLANE_XY, PLANE_ZX, PLANE_YZ, PLANE_OFFSETS
+from program import (G00, G01, G02, G03, G17, G18, G19, G20, G21, G90, G91, G92, G93, G94, OP_T, OP_S,
+                     OP_UNKNOWN)
+from toolpath import RAPID, LINEAR, ARC_CW, ARC_CCW, FEED_UPMIN, FEED_INVTIME, WORK_SYSTEMS
+
+# Commands whose effect is carried by the resolved segments; any other
+# command (M, T, S, G28, ...) is passed through when rewriting a program,
+# and segments are not moved or merged across its block (a barrier).
+RESOLVED_OPS = {G00, G01, G02, G03, G17, G18, G19, G20, G21, G90, G91, G92, G93, G94, *WORK_SYSTEMS}
+
+MOTION_WORDS = {RAPID: "G00", LINEAR: "G01", ARC_CW: "G02", ARC_CCW: "G03"}
+PLANE_WORDS = {PLANE_XY: "G17", PLANE_ZX: "G18", PLANE_YZ: "G19"}
+FEED_MODE_WORDS = {FEED_UPMIN: "G94", FEED_INVTIME: "G93"}
+# Offset word letter -> axis index.
+OFFSET_AXES = {"I": 0, "J": 1, "K": 2}
+
+
+class GCodeWriter:
+    """ Writes absolute millimetre moves as G-code lines (G21 G90), emitting
+    the plane, feed mode and F words only when they change and only the
+    axes that move. Used by the program rewriting passes (optimizer.py,
+    simplify.py).
+    Args:
+      pgm_num (int): program number for the O word, if any
+      digits (int): decimals written per coordinate
+      start (tuple): position before the first move; build_toolpath()
+        starts at the origin, so only the axes that move are written
+    """
+
+    def __init__(self, pgm_num=None, digits=4, start=(0.0, 0.0, 0.0)):
+        self.digits = digits
+        self.lines = ["%"]
+        if pgm_num is not None:
+            self.lines.append(f"O{pgm_num:04d}")
+        self.lines.append("G21 G90 G94 G17")
+        self.position = tuple(start)
+        self.plane = PLANE_XY
+        self.feed_mode = FEED_UPMIN
+        self.feed = None
+
+    def number(self, value):
+        text = f"{value:.{self.digits}f}".rstrip("0").rstrip(".")
+        return "0" if text in ("-0", "") else text
+
+    def _axes(self, end, always=False):
+        words = []
+        for letter, old, new in zip("XYZ", self.position, end):
+            if new is None:
+                continue
+            if always or abs(new - old) > 1e-9:
+                words.append(letter + self.number(new))
+        return words
+
+    def move(self, kind, end, feed=0.0, feed_mode=FEED_UPMIN, center=None, plane=PLANE_XY):
+        """ Writes one move to end = (x, y, z); arcs also need center and plane. """
+        words = []
+        if kind >= ARC_CW:
+            if plane != self.plane:
+                words.append(PLANE_WORDS[plane])
+                self.plane = plane
+            axes = self._axes(end, always=True)
+        else:
+            axes = self._axes(end)
+            if not axes:
+                return
+        if kind != RAPID and feed_mode != self.feed_mode:
+            words.append(FEED_MODE_WORDS[feed_mode])
+            self.feed_mode = feed_mode
+            self.feed = None
+        words.append(MOTION_WORDS[kind])
+        words.extend(axes)
+        if kind >= ARC_CW:
+            for letter in PLANE_OFFSETS[plane]:
+                a = OFFSET_AXES[letter]
+                words.append(letter + self.number(center[a] - self.position[a]))
+        if kind != RAPID and feed > 0 and (feed != self.feed or feed_mode == FEED_INVTIME):
+            words.append("F" + self.number(feed))
+            self.feed = feed
+        self.lines.append(" ".join(words))
+        self.position = tuple(old if new is None else new for old, new in zip(self.position, end))
+
+    def segment(self, tp, n):
+        """ Writes toolpath segment n. """
+        self.move(tp.kinds[n], (tp.x1[n], tp.y1[n], tp.z1[n]), tp.feeds[n], tp.feed_modes[n],
+                  (tp.cx[n], tp.cy[n], tp.cz[n]), tp.planes[n])
+
+    def rapid(self, x=None, y=None, z=None):
+        """ Rapid move of the given axes (the others keep their position). """
+        self.move(RAPID, (x, y, z))
+
+    def raw(self, text):
+        """ Writes a line as is (e.g. M, T and S words passed through). """
+        self.lines.append(text)
+
+    def text(self):
+        return "\n".join(self.lines + ["%"]) + "\n"
+
+
+def _number(value):
+    """ Shortest text that reads back as the same float, e.g. 1.0 -> "1". """
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def passthrough_words(program, block):
+    """ Returns the commands of a block the segments do not carry, as text
+    words (e.g. ["T1", "M06"]); an empty list unless the block is a barrier.
+    """
+    ops, starts = program.ops, program.block_starts
+    words = []
+    for k in range(starts[block], starts[block + 1]):
+        op = ops[k]
+        if op in RESOLVED_OPS:
+            continue
+        cmd = program.command(k)
+        if op in (OP_T, OP_S):
+            words.append(cmd.name + _number(cmd.get(cmd.name)))
+        else:
+            words.append(" ".join([cmd.name] + [w + _number(cmd.get(w)) for w in cmd]))
+    return words
+
+
+def check_rewritable(program):
+    """ Raises ValueError unless the program can be written back from its
+    command rows without losing anything: no codes the tokenizer could not
+    number (e.g. G92.1) and no words it does not keep (e.g. the H of G43 H1).
+    """
+    if program.ignored_lines:
+        raise ValueError(f"line {program.ignored_lines[0]}: the program holds words the simulator ignores, "
+                         f"so it cannot be rewritten")
+    if OP_UNKNOWN in program.ops:
+        block = bisect_right(program.block_starts, program.ops.index(OP_UNKNOWN)) - 1
+        raise ValueError(f"line {program.block_lines[block]}: the program holds codes the simulator does not "
+                         f"know, so it cannot be rewritten")